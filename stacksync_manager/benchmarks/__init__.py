@@ -0,0 +1,40 @@
+"""
+Benchmarks for the stacksync user manager.
+
+Every benchmark is a module that can be run from the project directory, e.g.::
+
+    python -m benchmarks.bench_user_loading
+
+They run against a throwaway copy of the configured database, created and
+destroyed the same way the test runner does.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "stacksync_manager.settings")
+
+
+@contextmanager
+def test_database(verbosity=0):
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        teardown_test_environment()
+
+
+class Timer(object):
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.time() - self.start
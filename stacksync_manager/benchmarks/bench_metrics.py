@@ -0,0 +1,47 @@
+"""
+Cost of wrapping a call in users.metrics.observe(), with no metrics consumer,
+with the process registry, and with the registry and a request being counted.
+
+    python -m benchmarks.bench_metrics --calls 200000
+"""
+import argparse
+
+from benchmarks import Timer
+
+
+def run(name, observe, calls, baseline=None):
+    with Timer() as timer:
+        for _ in xrange(calls):
+            with observe('swift', 'head_container'):
+                pass
+    per_call = 1e6 * timer.elapsed / calls
+    print('%-20s %6.2f us/call%s' % (name, per_call, ' (+%.2f us)' % (per_call - baseline) if baseline else ''))
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=200000)
+    args = parser.parse_args()
+
+    from contextlib import contextmanager
+    from users import metrics
+
+    @contextmanager
+    def nothing(service, operation):
+        yield
+
+    for hook in list(metrics._hooks):
+        metrics.remove_hook(hook)
+
+    baseline = run('bare context manager', nothing, args.calls)
+    run('no consumer', metrics.observe, args.calls, baseline)
+    metrics.add_hook(metrics.registry.observe)
+    run('registry', metrics.observe, args.calls, baseline)
+    metrics.start_request()
+    run('registry and request', metrics.observe, args.calls, baseline)
+    metrics.finish_request()
+
+
+if __name__ == '__main__':
+    main()
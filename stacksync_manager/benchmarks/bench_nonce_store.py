@@ -0,0 +1,50 @@
+"""
+Nonce inserts per second as the nonce table ages, with expired windows swept
+after each window, as sweep_oauth_tokens run from cron does, and, for
+comparison, with every nonce kept forever as it used to be.
+
+    python -m benchmarks.bench_nonce_store --windows 10 --per-window 5000
+"""
+import argparse
+import datetime
+import uuid
+
+from benchmarks import test_database, Timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--windows', type=int, default=10,
+                        help='timestamp windows the simulated traffic lasts')
+    parser.add_argument('--per-window', type=int, default=5000,
+                        help='requests per timestamp window')
+    parser.add_argument('--store', default='database', choices=['database', 'cache', 'memory'])
+    args = parser.parse_args()
+
+    with test_database():
+        from django.utils import timezone
+        from oauth.models import Nonce
+        from oauth import nonces
+        from oauth.sweeper import sweep_expired
+
+        stores = {'database': nonces.DatabaseNonceStore, 'cache': nonces.CacheNonceStore,
+                  'memory': nonces.MemoryNonceStore}
+        for name, store, swept in [('unbounded', nonces.DatabaseNonceStore(window=300), False),
+                                   (args.store, stores[args.store](window=300), True)]:
+            Nonce.objects.all().delete()
+            start = 1000000
+            print(name)
+            for window in range(args.windows):
+                with Timer() as timer:
+                    for i in range(args.per_window):
+                        now = start + (window * 300) + (300.0 * i / args.per_window)
+                        assert store.check_and_insert('consumer', 'token', int(now), uuid.uuid4().hex, now=now)
+                print('  window %3d: %8.0f inserts/s, %8d rows' % (
+                    window, args.per_window / timer.elapsed, Nonce.objects.count()))
+                if swept:
+                    sweep_expired({}, throttle=0, now=timezone.make_aware(
+                        datetime.datetime.utcfromtimestamp(now), timezone.utc))
+
+
+if __name__ == '__main__':
+    main()
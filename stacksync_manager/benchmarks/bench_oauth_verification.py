@@ -0,0 +1,52 @@
+"""
+Access token verifications per second with many tokens in the table, straight
+from the database and through the verification cache.
+
+    python -m benchmarks.bench_oauth_verification --tokens 1000000 --lookups 20000
+"""
+import argparse
+import random
+
+from benchmarks import test_database, Timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tokens', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--hot-tokens', type=int, default=250,
+                        help='distinct tokens looked up, the clients active at the same time; '
+                             'keep it below the size of the cache (300 for the default locmem cache)')
+    args = parser.parse_args()
+
+    with test_database():
+        from oauth.models import Consumer, AccessToken
+        from oauth import verification
+        from users.models import StacksyncUser
+
+        StacksyncUser.objects.bulk_create([StacksyncUser(name='bench', email='bench@stacksync.org',
+                                                         swift_user='stacksync_bench', swift_account='AUTH_bench')])
+        user = StacksyncUser.objects.get()
+        consumer = Consumer.objects.create(consumer_key='bench_key', consumer_secret='secret', user=user)
+        for start in range(0, args.tokens, 10000):
+            AccessToken.objects.bulk_create(
+                AccessToken(consumer=consumer, user=user, access_token='token%d' % i, access_token_secret='secret')
+                for i in range(start, min(start + 10000, args.tokens)))
+
+        hot = ['token%d' % random.randrange(args.tokens) for _ in range(args.hot_tokens)]
+        lookups = [random.choice(hot) for _ in range(args.lookups)]
+
+        def uncached(consumer_key, access_token):
+            return (AccessToken.objects.select_related('consumer', 'user')
+                    .filter(access_token=access_token, consumer__consumer_key=consumer_key).first())
+
+        verification.get_verification_cache().clear()
+        for name, verify in [('database', uncached), ('cached', verification.get_access_token)]:
+            with Timer() as timer:
+                for access_token in lookups:
+                    assert verify('bench_key', access_token) is not None
+            print('%-10s %10.0f verifications/s with %d tokens' % (name, args.lookups / timer.elapsed, args.tokens))
+
+
+if __name__ == '__main__':
+    main()
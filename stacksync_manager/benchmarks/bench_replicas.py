@@ -0,0 +1,156 @@
+"""
+Replays a mix of requests twice, once with every read on the primary and once
+with a replica in DATABASE_REPLICAS, and reports the queries each database got.
+
+    python -m benchmarks.bench_replicas --requests 2000 --writes 0.02
+
+The mix is made of signed polls of the workspaces API by sync clients, admin
+changelist pages and admin writes (password changes), each from its own
+client. The replica is a second connection to the same test database, or the
+same connection on sqlite, so it is never behind: the benchmark measures the
+load taken off the primary, not the effect of lag.
+"""
+import argparse
+import copy
+import random
+import time
+import urllib
+
+from benchmarks import test_database
+
+CHANGELISTS = ['/admin/users/stacksyncuser/', '/admin/users/stacksyncworkspace/', '/admin/oauth/consumer/',
+               '/admin/oauth/accesstoken/', '/admin/oauth/requesttoken/']
+
+
+def add_replica(alias='replica'):
+    """A second alias for the test database, sharing the connection on in memory sqlite"""
+    from django.db import connections, DEFAULT_DB_ALIAS
+
+    primary = connections[DEFAULT_DB_ALIAS]
+    settings_dict = dict(primary.settings_dict)
+    connections.databases[alias] = settings_dict
+    if primary.vendor == 'sqlite':
+        primary.ensure_connection()
+        replica = copy.copy(primary)
+        replica.alias = alias
+        replica.settings_dict = settings_dict
+        replica.queries = []
+        setattr(connections._connections, alias, replica)
+    return connections[alias]
+
+
+def populate(users):
+    import uuid
+    from django.contrib.auth.models import User
+    from oauth.models import Consumer, AccessToken
+    from users.models import StacksyncUser, StacksyncWorkspace, StacksyncMembership
+
+    User.objects.create_superuser('admin', 'admin@stacksync.org', 'admin')
+    StacksyncUser.objects.bulk_create([
+        StacksyncUser(id=uuid.uuid4(), name='bench%d' % i, email='bench%d@stacksync.org' % i,
+                      swift_user='stacksync_bench%d' % i, swift_account='AUTH_bench') for i in range(users)])
+    owners = list(StacksyncUser.objects.all())
+    workspaces = [StacksyncWorkspace(id=uuid.uuid4(), owner=owner, swift_container='container%d' % i,
+                                     swift_url='http://swift/v1/AUTH_bench') for i, owner in enumerate(owners)]
+    StacksyncWorkspace.objects.bulk_create(workspaces)
+    StacksyncMembership.objects.bulk_create([
+        StacksyncMembership(id=uuid.uuid4(), user=workspace.owner, workspace=workspace, name='default')
+        for workspace in workspaces])
+    Consumer.objects.bulk_create([Consumer(consumer_key='key%d' % i, consumer_secret='secret', user=owner)
+                                  for i, owner in enumerate(owners)])
+    consumers = dict(Consumer.objects.values_list('consumer_key', 'id'))
+    AccessToken.objects.bulk_create([
+        AccessToken(consumer_id=consumers['key%d' % i], user=owner, access_token='token%d' % i,
+                    access_token_secret='secret') for i, owner in enumerate(owners)])
+
+
+def sign(i, nonce):
+    parameters = {'oauth_consumer_key': 'key%d' % i, 'oauth_token': 'token%d' % i,
+                  'oauth_signature_method': 'PLAINTEXT', 'oauth_signature': 'secret&secret',
+                  'oauth_timestamp': str(int(time.time())), 'oauth_nonce': nonce}
+    return 'OAuth ' + ', '.join('%s="%s"' % (name, urllib.quote(value, safe='~'))
+                                for name, value in sorted(parameters.items()))
+
+
+def make_requests(count, users, writes, admins, seed):
+    """(kind, client number, target) for every request of the replay"""
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(count):
+        draw = rng.random()
+        if draw < writes:
+            requests.append(('write', rng.randrange(admins), None))
+        elif draw < writes + (1 - writes) / 5:
+            requests.append(('changelist', rng.randrange(admins), rng.choice(CHANGELISTS)))
+        else:
+            requests.append(('poll', None, rng.randrange(users)))
+    return requests
+
+
+def replay(requests, run):
+    from django.test import Client
+
+    admins = {}
+    etags = {}
+    polls = Client()
+    for n, (kind, admin, target) in enumerate(requests):
+        if kind == 'poll':
+            headers = {'HTTP_AUTHORIZATION': sign(target, '%s-%d' % (run.replace(' ', '-'), n))}
+            if target in etags:
+                headers['HTTP_IF_NONE_MATCH'] = etags[target]
+            response = polls.get('/api/workspaces', **headers)
+            assert response.status_code in (200, 304), response.status_code
+            etags[target] = response['ETag']
+            continue
+
+        if admin not in admins:
+            admins[admin] = Client()
+            admins[admin].login(username='admin', password='admin')
+        client = admins[admin]
+        if kind == 'changelist':
+            assert client.get(target).status_code == 200
+        else:
+            client.post('/admin/password_change/', {'old_password': 'admin', 'new_password1': 'admin',
+                                                    'new_password2': 'admin'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--writes', type=float, default=0.02, help='share of the requests that write')
+    parser.add_argument('--admins', type=int, default=5, help='admin clients, each pinned on its own')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with test_database() as connection:
+        from django.core.cache import cache
+        from django.test.utils import override_settings, CaptureQueriesContext
+        from oauth.verification import get_verification_cache
+        from users import replicas
+
+        replica = add_replica()
+        populate(args.users)
+        requests = make_requests(args.requests, args.users, args.writes, args.admins, args.seed)
+
+        results = {}
+        for name, aliases in [('primary only', []), ('with replica', [replica.alias])]:
+            cache.clear()
+            get_verification_cache().clear()
+            replicas.lag_monitor.clear()
+            with override_settings(DATABASE_REPLICAS=aliases):
+                with CaptureQueriesContext(connection) as primary_queries:
+                    with CaptureQueriesContext(replica) as replica_queries:
+                        start = time.time()
+                        replay(requests, run=name)
+                        elapsed = time.time() - start
+            results[name] = len(primary_queries)
+            print('%-13s %6d requests %8.1f req/s  primary %7d queries  replica %7d queries' % (
+                name, len(requests), len(requests) / elapsed, len(primary_queries), len(replica_queries)))
+
+        before, after = results['primary only'], results['with replica']
+        print('primary load reduced by %.1f%%' % (100.0 * (before - after) / before if before else 0.0))
+
+
+if __name__ == '__main__':
+    main()
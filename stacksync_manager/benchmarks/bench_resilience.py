@@ -0,0 +1,98 @@
+"""
+Latency of swift calls while the proxy stalls, with and without the timeouts,
+retries and circuit breakers of users.resilience.
+
+    python -m benchmarks.bench_resilience --duration 6 --threads 8 --stall 1.0
+
+Every thread makes a call every --interval seconds. During the middle half of
+the run the fake proxy answers after --stall seconds, a proxy that is up but
+hanging. Unprotected, every call waits for it; protected, calls give up after
+--timeout and, once the circuit opens, fail at once until a probe finds the
+proxy back.
+"""
+import argparse
+import logging
+import threading
+import time
+
+from django.test.utils import override_settings
+
+from benchmarks.bench_swift_client import FakeKeystone
+from benchmarks.fake_openstack import FakeSwift
+
+UNPROTECTED = dict(OPENSTACK_TIMEOUTS={}, OPENSTACK_RETRY_ATTEMPTS=1, OPENSTACK_CIRCUIT_FAILURES=None)
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def run(client, fake, swift_url, duration, threads, interval, stall):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    started = time.time()
+
+    def worker():
+        while True:
+            now = time.time() - started
+            if now >= duration:
+                return
+            fake.latency = stall if duration / 4 <= now < 3 * duration / 4 else 0.0
+            start = time.time()
+            try:
+                client.get_container_metadata(swift_url, 'bench', use_cache=False)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+            with lock:
+                latencies.append(time.time() - start)
+            time.sleep(interval)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return latencies, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=6.0, help='seconds the run lasts')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--interval', type=float, default=0.01, help='seconds between the calls of a thread')
+    parser.add_argument('--stall', type=float, default=1.0, help='seconds the stalled proxy takes to answer')
+    parser.add_argument('--timeout', type=float, default=0.1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    from mock import patch
+    from users import openstack
+    from users.models import SwiftClient
+
+    fake = FakeSwift().start()
+    keystone = FakeKeystone()
+    swift_url = fake.url + '/AUTH_bench'
+    protected = dict(OPENSTACK_TIMEOUTS={'swift': args.timeout}, OPENSTACK_RETRY_BACKOFF=args.timeout,
+                     OPENSTACK_CIRCUIT_RESET=args.stall)
+    try:
+        with patch.object(openstack, 'get_keystone_client', return_value=keystone):
+            for name, overrides in [('unprotected', UNPROTECTED), ('protected', protected)]:
+                with override_settings(**overrides):
+                    openstack.reset()
+                    client = SwiftClient()
+                    client.create_container('bench', swift_url, 'bench')
+                    latencies, errors = run(client, fake, swift_url, args.duration, args.threads, args.interval,
+                                            args.stall)
+                    fake.latency = 0.0
+                print('%-12s %6d calls  p50 %7.1f ms  p99 %7.1f ms  max %7.1f ms  %5d failed' % (
+                    name, len(latencies), 1000 * percentile(latencies, 0.5), 1000 * percentile(latencies, 0.99),
+                    1000 * max(latencies), errors))
+    finally:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Commits per second on a single hot workspace, each commit moving its
+latest_revision on, from many threads with a database connection each:
+
+    python -m benchmarks.bench_revisions --threads 16 --commits 200
+
+read-modify-write  locks the row, reads it and saves the revision plus one
+update             StacksyncWorkspace.objects.increment_revision, one UPDATE
+coalesced          the same with coalescing, one UPDATE per group of commits
+
+Every mode must end with one revision per commit; lost counts the ones that
+went missing. Meant for postgresql, where threads really wait on the row lock:
+on sqlite, run on a temporary file, the whole database is locked instead.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks import test_database
+
+
+def read_modify_write(workspace_id):
+    from django.db import transaction
+    from users.models import StacksyncWorkspace
+
+    with transaction.atomic():
+        workspace = StacksyncWorkspace.objects.select_for_update().get(pk=workspace_id)
+        workspace.latest_revision += 1
+        workspace.save(update_fields=['latest_revision'])
+    return workspace.latest_revision
+
+
+def update(workspace_id):
+    from users.models import StacksyncWorkspace
+
+    return StacksyncWorkspace.objects.increment_revision(workspace_id, coalesce=False)
+
+
+def coalesced(workspace_id):
+    from users.models import StacksyncWorkspace
+
+    return StacksyncWorkspace.objects.increment_revision(workspace_id, coalesce=True)
+
+
+def run(commit, workspace_id, threads, commits):
+    from django.db import connection
+
+    revisions = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            for _ in range(commits):
+                try:
+                    revision = commit(workspace_id)
+                except Exception:
+                    with lock:
+                        errors[0] += 1
+                    continue
+                with lock:
+                    revisions.append(revision)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.time() - start, revisions, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--commits', type=int, default=200, help='commits made by each thread')
+    args = parser.parse_args()
+
+    from django.db import connection
+
+    db_file = None
+    if connection.vendor == 'sqlite':
+        # Threads can't share an in memory database
+        db_file = tempfile.mktemp(suffix='.sqlite3')
+        connection.settings_dict['TEST_NAME'] = db_file
+        connection.settings_dict.setdefault('OPTIONS', {})['timeout'] = 60
+
+    try:
+        with test_database():
+            import uuid
+            from users.models import StacksyncUser, StacksyncWorkspace
+
+            owner = StacksyncUser(id=uuid.uuid4(), name='bench', email='bench@stacksync.org', swift_user='bench',
+                                  swift_account='AUTH_bench')
+            StacksyncUser.objects.bulk_create([owner])
+            for name, commit in [('read-modify-write', read_modify_write), ('update', update),
+                                 ('coalesced', coalesced)]:
+                workspace = StacksyncWorkspace.objects.create(id=uuid.uuid4(), owner=owner, swift_container=name,
+                                                              swift_url='http://swift/v1/AUTH_bench')
+                elapsed, revisions, errors = run(commit, workspace.id, args.threads, args.commits)
+                final = StacksyncWorkspace.objects.get(pk=workspace.id).latest_revision
+                print('%-18s %9.1f commits/s  %6d lost  %6d duplicated  %4d failed' % (
+                    name, len(revisions) / elapsed, len(revisions) - final, len(revisions) - len(set(revisions)),
+                    errors))
+    finally:
+        if db_file and os.path.exists(db_file):
+            os.remove(db_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Time taken by a fresh process to import the WSGI application and load the
+url configuration (which imports every models and admin module), and the
+outbound connections it attempts meanwhile. There should be none: OpenStack
+clients are only created when first used.
+
+    python -m benchmarks.bench_startup --iterations 10
+
+Every iteration is a new interpreter. Connection attempts are counted and
+refused, so a regression shows up as a count instead of a hang on an
+unreachable Keystone.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+
+def count_connections():
+    """Patches sockets to refuse and record every connection attempt"""
+    attempts = []
+
+    def connect(self, address):
+        attempts.append(address)
+        raise socket.error('connection attempted during startup: %r' % (address,))
+
+    def connect_ex(self, address):
+        attempts.append(address)
+        return 111
+
+    socket._socketobject.connect = connect
+    socket._socketobject.connect_ex = connect_ex
+    return attempts
+
+
+def startup():
+    """Runs in the child process, prints the measures as json"""
+    attempts = count_connections()
+
+    start = time.time()
+    from stacksync_manager import wsgi
+    wsgi_imported = time.time()
+
+    from django.conf import settings
+    from django.utils.importlib import import_module
+    error = None
+    try:
+        import_module(settings.ROOT_URLCONF)
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+    finished = time.time()
+
+    print(json.dumps({'wsgi': wsgi_imported - start,
+                      'urls': finished - wsgi_imported,
+                      'total': finished - start,
+                      'connections': [repr(address) for address in attempts],
+                      'error': error}))
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        startup()
+        return
+
+    runs = []
+    for _ in range(args.iterations):
+        output = subprocess.check_output([sys.executable, '-m', 'benchmarks.bench_startup', '--child'],
+                                         env=os.environ.copy())
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    for measure in ('wsgi', 'urls', 'total'):
+        values = [run[measure] * 1000 for run in runs]
+        print('%-6s median %7.1f ms  min %7.1f ms  max %7.1f ms' % (measure, median(values), min(values),
+                                                                    max(values)))
+    connections = max(len(run['connections']) for run in runs)
+    print('outbound connections during startup: %d' % connections)
+    for run in runs:
+        if run['connections'] or run['error']:
+            print('  %s %s' % (', '.join(run['connections']), run['error'] or ''))
+            break
+    if connections:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
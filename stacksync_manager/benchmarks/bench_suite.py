@@ -0,0 +1,207 @@
+"""
+Drives the real code paths of the user manager against the in process fake
+Keystone and Swift of benchmarks.fake_openstack: StacksyncUser.save() for new
+users and password changes, create_workspace, quota reads, OAuth access token
+lookups and StacksyncUser.delete().
+
+    python -m benchmarks.bench_suite --users 200 --latency 0.002
+    python -m benchmarks.bench_suite --error-rate 0.01
+    python -m benchmarks.bench_suite --compare
+
+For every scenario it reports the throughput, the p50 and p99 latency of an
+operation, the requests made to each service per operation and the errors.
+Swift operations run inline, as with PROVISIONING_QUEUE off.
+
+Every run is appended to benchmarks/results/suite.jsonl with the commit it was
+measured on. --compare prints the change against the last run of another
+commit, or of the one given with --baseline.
+"""
+import argparse
+import json
+import os
+import subprocess
+import time
+
+from benchmarks import test_database
+from benchmarks.fake_openstack import FakeKeystone, FakeSwift
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'suite.jsonl')
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[int(round(percent / 100.0 * (len(values) - 1)))]
+
+
+def measure(name, operation, items, services):
+    """Runs operation on every item, returns the measures of the scenario"""
+    before = dict((service, fake.counters()) for service, fake in services.items())
+    latencies = []
+    errors = 0
+    start = time.time()
+    for item in items:
+        started = time.time()
+        try:
+            operation(item)
+        except Exception:
+            errors += 1
+        latencies.append(time.time() - started)
+    elapsed = time.time() - start
+
+    operations = len(latencies)
+    result = {'scenario': name, 'operations': operations, 'errors': errors, 'elapsed': elapsed,
+              'throughput': operations / elapsed if elapsed else 0.0,
+              'p50_ms': 1000 * percentile(latencies, 50), 'p99_ms': 1000 * percentile(latencies, 99)}
+    for service, fake in services.items():
+        after = fake.counters()
+        for counter in ('requests', 'connections'):
+            result['%s_%s' % (service, counter)] = after[counter] - before[service][counter]
+    return result
+
+
+def print_result(result):
+    operations = float(result['operations'] or 1)
+    print('%-18s %6d ops %9.1f ops/s  p50 %8.2f ms  p99 %8.2f ms  keystone %5.2f/op  swift %5.2f/op  errors %d' % (
+        result['scenario'], result['operations'], result['throughput'], result['p50_ms'], result['p99_ms'],
+        result['keystone_requests'] / operations, result['swift_requests'] / operations, result['errors']))
+
+
+def run_suite(args, keystone, swift):
+    from django.test.utils import override_settings
+
+    from oauth.models import Consumer, AccessToken
+    from oauth.verification import get_access_token, get_verification_cache
+    from users import openstack
+    from users.models import StacksyncUser, StacksyncWorkspace
+
+    services = {'keystone': keystone, 'swift': swift}
+    results = []
+
+    def scenario(name, operation, items):
+        result = measure(name, operation, items, services)
+        print_result(result)
+        results.append(result)
+
+    with override_settings(KEYSTONE_AUTH_URL=keystone.url, SWIFT_URL=swift.url, PROVISIONING_QUEUE=False):
+        openstack.reset()
+        users = []
+
+        def create_user(i):
+            user = StacksyncUser(name='bench%d' % i, email='bench%d@stacksync.org' % i, quota_limit=1024)
+            user.save()
+            users.append(user)
+
+        scenario('user_save', create_user, range(args.users))
+        scenario('password_update', lambda user: user.save(password='bench'), list(users))
+        scenario('create_workspace', StacksyncWorkspace.objects.create_workspace, list(users))
+
+        workspaces = list(StacksyncWorkspace.objects.all())
+        openstack.get_container_metadata_cache().clear()
+        scenario('quota_read', lambda workspace: workspace.get_physical_quota(), workspaces)
+        scenario('quota_read_cached', lambda workspace: workspace.get_physical_quota(), workspaces)
+
+        consumers = Consumer.objects.bulk_create([
+            Consumer(consumer_key='key%d' % i, consumer_secret='secret', user=user) for i, user in enumerate(users)])
+        consumers = dict(Consumer.objects.values_list('consumer_key', 'id'))
+        AccessToken.objects.bulk_create([
+            AccessToken(consumer_id=consumers['key%d' % i], user=user, access_token='token%d' % i,
+                        access_token_secret='secret') for i, user in enumerate(users)])
+        get_verification_cache().clear()
+        lookups = [('key%d' % i, 'token%d' % i) for i in range(len(users))]
+        scenario('oauth_lookup', lambda lookup: get_access_token(*lookup), lookups)
+        scenario('oauth_lookup_cached', lambda lookup: get_access_token(*lookup), lookups)
+
+        scenario('user_delete', lambda user: user.delete(), list(users))
+        openstack.reset()
+
+    return results
+
+
+def get_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + ('-dirty' if dirty else '')
+
+
+def load_runs(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as results:
+        return [json.loads(line) for line in results if line.strip()]
+
+
+def store_run(path, run):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'a') as results:
+        results.write(json.dumps(run) + '\n')
+
+
+def compare(run, baseline):
+    print('\ncompared with %s (%s)' % (baseline['commit'], baseline['date']))
+    previous = dict((result['scenario'], result) for result in baseline['results'])
+    for result in run['results']:
+        before = previous.get(result['scenario'])
+        if before is None:
+            continue
+        change = (100.0 * (result['throughput'] - before['throughput']) / before['throughput']
+                  if before['throughput'] else 0.0)
+        print('%-18s %9.1f -> %9.1f ops/s (%+6.1f%%)  p99 %8.2f -> %8.2f ms' % (
+            result['scenario'], before['throughput'], result['throughput'], change,
+            before['p99_ms'], result['p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added by both fake services to every request')
+    parser.add_argument('--connect-latency', type=float, default=0.0,
+                        help='seconds added by both fake services to every new connection')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of the requests the fake services fail with a 503')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the error injection')
+    parser.add_argument('--results', default=RESULTS, help='file the runs are appended to')
+    parser.add_argument('--no-store', action='store_true', help="don't store this run")
+    parser.add_argument('--compare', action='store_true', help='compare with the last run of another commit')
+    parser.add_argument('--baseline', help='commit to compare with')
+    args = parser.parse_args()
+
+    from django.conf import settings
+
+    options = dict(latency=args.latency, connect_latency=args.connect_latency,
+                   error_rate=args.error_rate, seed=args.seed)
+    swift = FakeSwift(tokens=(), **options).start()
+    keystone = FakeKeystone(settings.KEYSTONE_ADMIN_USER, settings.KEYSTONE_ADMIN_PASSWORD,
+                            settings.KEYSTONE_TENANT, swift=swift, **options).start()
+    try:
+        with test_database():
+            results = run_suite(args, keystone, swift)
+    finally:
+        keystone.stop()
+        swift.stop()
+
+    run = {'commit': get_commit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+           'options': vars(args), 'results': results}
+    previous_runs = load_runs(args.results)
+    if not args.no_store:
+        store_run(args.results, run)
+
+    if args.compare or args.baseline:
+        commit = run['commit'].replace('-dirty', '')
+        candidates = [previous for previous in previous_runs
+                      if (previous['commit'] == args.baseline if args.baseline
+                          else previous['commit'].replace('-dirty', '') != commit)]
+        if candidates:
+            compare(run, candidates[-1])
+        else:
+            print('\nno run to compare with in %s' % args.results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Creates, sets the quota of, reads back and deletes containers on a local fake
+swift proxy in batches, one container after the other, with a new pool of
+threads per batch (users.swift_batch.batch_client(concurrency)) and on the
+shared pool of users.swift_batch.
+
+    python -m benchmarks.bench_swift_batch --containers 400 --batch 50 --latency 0.005
+"""
+import argparse
+
+from benchmarks import Timer
+from benchmarks.bench_swift_client import FakeKeystone
+from benchmarks.fake_openstack import FakeSwift
+
+
+def serial(swift_client, concurrency):
+    def run(operation, items):
+        return [operation(*item) for item in items]
+    return run
+
+
+def threaded(swift_client, concurrency):
+    from users.swift_batch import SwiftBatchClient
+
+    def run(operation, items):
+        client = SwiftBatchClient(concurrency, swift_client)
+        try:
+            return client.run(operation, items)
+        finally:
+            client.close()
+    return run
+
+
+def batched(swift_client, concurrency):
+    from users.swift_batch import SwiftBatchClient
+
+    return SwiftBatchClient(concurrency, swift_client).run
+
+
+def lifecycle(run, swift_client, swift_url, names):
+    run(swift_client.create_container, [('bench', swift_url, name) for name in names])
+    run(swift_client.set_container_quota, [(swift_url, name, 1024) for name in names])
+    run(lambda url, name: swift_client.get_container_metadata(url, name, use_cache=False),
+        [(swift_url, name) for name in names])
+    run(swift_client.delete_container, [(swift_url, name) for name in names])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--containers', type=int, default=400)
+    parser.add_argument('--batch', type=int, default=50, help='containers handed over in each call')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='seconds added by the fake proxy to every request')
+    parser.add_argument('--connect-latency', type=float, default=0.002,
+                        help='seconds added by the fake proxy to every new connection')
+    args = parser.parse_args()
+
+    from mock import patch
+    from users import openstack
+    from users.models import SwiftClient
+
+    fake = FakeSwift(latency=args.latency, connect_latency=args.connect_latency).start()
+    keystone = FakeKeystone()
+    swift_url = fake.url + '/AUTH_bench'
+    try:
+        with patch.object(openstack, 'get_keystone_client', return_value=keystone):
+            openstack.reset()
+            swift_client = SwiftClient()
+            for name, make_run in [('serial', serial), ('threaded', threaded), ('batch', batched)]:
+                run = make_run(swift_client, args.concurrency)
+                connections, requests = fake.connections, fake.requests
+                with Timer() as timer:
+                    for start in range(0, args.containers, args.batch):
+                        names = ['%s_%d' % (name, i) for i in range(start, min(start + args.batch, args.containers))]
+                        lifecycle(run, swift_client, swift_url, names)
+                requests = fake.requests - requests
+                print('%-9s %8.3f ms/request %8.1f requests/s %6d connections' % (
+                    name, 1000.0 * timer.elapsed / requests, requests / timer.elapsed,
+                    fake.connections - connections))
+    finally:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
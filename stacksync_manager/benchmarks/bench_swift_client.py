@@ -0,0 +1,106 @@
+"""
+Per operation latency of SwiftClient against a local fake swift proxy, compared
+with calling swiftclient the way it was done before connections were pooled:
+a new connection for every request.
+
+    python -m benchmarks.bench_swift_client --workspaces 200 --connect-latency 0.002
+"""
+import argparse
+import datetime
+
+from swiftclient import client as swift
+
+from benchmarks import Timer
+from benchmarks.fake_openstack import FakeSwift
+
+
+class FakeAuthRef(object):
+
+    def __init__(self):
+        self.auth_token = 'bench_token'
+        self.expires = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+
+class FakeKeystone(object):
+    """Keystone admin client that counts the authentications it performs"""
+
+    def __init__(self):
+        self.authentications = 1
+        self.auth_ref = FakeAuthRef()
+
+    def authenticate(self):
+        self.authentications += 1
+        self.auth_ref = FakeAuthRef()
+
+    def get_token(self, session):
+        return self.auth_ref.auth_token
+
+
+def workspace_lifecycle(client, swift_url, container):
+    client.create_container('bench', swift_url, container)
+    client.set_container_quota(swift_url, container, 1024)
+    client.get_container_metadata(swift_url, container)
+    client.delete_container(swift_url, container)
+
+
+class UnpooledSwiftClient(object):
+    """SwiftClient as it was: one new HTTP connection per request"""
+
+    def __init__(self, keystone):
+        self.keystone = keystone
+
+    def create_container(self, keystone_username, swift_url, swift_container):
+        headers = {'x-container-read': 'stacksync:' + keystone_username,
+                   'x-container-write': 'stacksync:' + keystone_username}
+        swift.put_container(swift_url, self.keystone.get_token('id'), swift_container, headers=headers)
+
+    def delete_container(self, swift_url, swift_container):
+        swift.delete_container(swift_url, self.keystone.get_token('id'), swift_container)
+
+    def get_container_metadata(self, swift_url, swift_container):
+        return swift.head_container(swift_url, self.keystone.get_token('id'), swift_container)
+
+    def set_container_quota(self, swift_url, swift_container, quota_limit):
+        headers = {'X-Container-Meta-Quota-Bytes': quota_limit}
+        swift.post_container(swift_url, self.keystone.get_token('id'), swift_container, headers=headers)
+
+
+def run(name, client, fake, keystone, workspaces):
+    swift_url = fake.url + '/AUTH_bench'
+    connections, requests = fake.connections, fake.requests
+    authentications = keystone.authentications
+    with Timer() as timer:
+        for i in range(workspaces):
+            workspace_lifecycle(client, swift_url, 'bench_%d' % i)
+    operations = fake.requests - requests
+    print('%-10s %8.3f ms/op %8d connections %6d authentications' % (
+        name, 1000.0 * timer.elapsed / operations, fake.connections - connections,
+        keystone.authentications - authentications))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workspaces', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added by the fake proxy to every request')
+    parser.add_argument('--connect-latency', type=float, default=0.002,
+                        help='seconds added by the fake proxy to every new connection')
+    args = parser.parse_args()
+
+    from mock import patch
+    from users import openstack
+    from users.models import SwiftClient
+
+    fake = FakeSwift(latency=args.latency, connect_latency=args.connect_latency).start()
+    keystone = FakeKeystone()
+    try:
+        with patch.object(openstack, 'get_keystone_client', return_value=keystone):
+            openstack.reset()
+            run('unpooled', UnpooledSwiftClient(keystone), fake, keystone, args.workspaces)
+            run('pooled', SwiftClient(), fake, keystone, args.workspaces)
+    finally:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Counts the keystone calls made while loading StacksyncUser rows from the database.
+
+    python -m benchmarks.bench_user_loading --users 100 --iterations 5
+"""
+import argparse
+
+from mock import MagicMock, patch
+
+from benchmarks import test_database, Timer
+
+
+class CountingKeystone(object):
+    """Stand-in for keystoneclient.v2_0.client.Client that counts every call made to it"""
+    constructed = 0
+    calls = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingKeystone.constructed += 1
+        tenant = MagicMock()
+        tenant.name = 'stacksync'
+        tenant.id = 'bench_tenant'
+        self.tenants = MagicMock()
+        self.tenants.list.side_effect = self._count([tenant])
+        self.users = MagicMock()
+        self.users.list.side_effect = self._count([])
+
+    def _count(self, result):
+        def call(*args, **kwargs):
+            CountingKeystone.calls += 1
+            return result
+        return call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+
+    with test_database():
+        from users import openstack
+        from users.models import StacksyncUser
+
+        with patch('users.openstack.client.Client', CountingKeystone):
+            openstack.reset()
+            StacksyncUser.objects.bulk_create(
+                StacksyncUser(name='bench%d' % i, email='bench%d@stacksync.org' % i,
+                              swift_user='stacksync_bench%d' % i, swift_account='AUTH_bench_tenant')
+                for i in range(args.users))
+
+            with Timer() as timer:
+                for _ in range(args.iterations):
+                    users = list(StacksyncUser.objects.all())
+                    assert len(users) == args.users
+
+        rows = args.users * args.iterations
+        print('rows loaded:            %d' % rows)
+        print('keystone clients built: %d' % CountingKeystone.constructed)
+        print('keystone calls:         %d' % CountingKeystone.calls)
+        print('keystone calls per row: %.3f' % (float(CountingKeystone.calls) / rows))
+        print('rows per second:        %.0f' % (rows / timer.elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""
+In process stand-ins for the OpenStack services, good enough to drive the real
+keystoneclient and swiftclient code paths over real sockets.
+
+Both services add configurable latency to every request (and to every new
+connection), fail a configurable share of requests, and count what they get.
+"""
+import collections
+import datetime
+import json
+import random
+import socket
+import sys
+import threading
+import time
+import urlparse
+import uuid
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients giving up on a slow answer hang up on it
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        fake = self.server.fake
+        with fake.lock:
+            fake.connections += 1
+            fake.sockets.add(self.connection)
+        if fake.connect_latency:
+            time.sleep(fake.connect_latency)
+
+    def finish(self):
+        BaseHTTPRequestHandler.finish(self)
+        with self.server.fake.lock:
+            self.server.fake.sockets.discard(self.connection)
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, headers=None, body=None):
+        payload = json.dumps(body) if body is not None else ''
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if payload:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if payload and self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    def _handle(self):
+        fake = self.server.fake
+        path = urlparse.urlparse(self.path).path
+        with fake.lock:
+            fake.requests += 1
+            fake.calls[self.command, fake.route(path)] += 1
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length) if length else ''
+
+        if fake.should_fail():
+            with fake.lock:
+                fake.errors += 1
+            return self.reply(fake.error_status)
+        fake.handle(self, path, body)
+
+    do_GET = do_PUT = do_POST = do_HEAD = do_DELETE = _handle
+
+
+class FakeService(object):
+    """
+    An HTTP service on a local port.
+
+    latency is added to every request and connect_latency once per new TCP
+    connection, to stand in for a service that is not on the same host.
+    A share error_rate of the requests is answered with error_status.
+    """
+
+    def __init__(self, latency=0.0, connect_latency=0.0, error_rate=0.0, error_status=503, seed=None):
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self.calls = collections.Counter()
+        self.sockets = set()
+        self.lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), FakeServiceHandler)
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+
+    @property
+    def address(self):
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    def route(self, path):
+        """Path with its ids left out, the key calls are counted by"""
+        return path
+
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self.lock:
+            return self._random.random() < self.error_rate
+
+    def handle(self, request, path, body):
+        raise NotImplementedError
+
+    def counters(self):
+        with self.lock:
+            return {'connections': self.connections, 'requests': self.requests,
+                    'errors': self.errors, 'calls': dict(self.calls)}
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        # Hang up on the clients still keeping a connection alive
+        with self.lock:
+            for sock in self.sockets:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+
+class FakeSwift(FakeService):
+    """Swift proxy keeping its containers in memory, accepting the tokens in self.tokens"""
+
+    def __init__(self, tokens=('bench_token',), **kwargs):
+        super(FakeSwift, self).__init__(**kwargs)
+        self.tokens = set(tokens)
+        self.containers = {}
+
+    @property
+    def url(self):
+        return self.address + '/v1'
+
+    def route(self, path):
+        parts = path.strip('/').split('/')
+        return '/'.join(parts[:1] + ['{account}', '{container}'][:len(parts) - 1])
+
+    def handle(self, request, path, body):
+        if request.headers.get('x-auth-token') not in self.tokens:
+            return request.reply(401)
+        if request.command == 'GET' and len(path.strip('/').split('/')) == 2:
+            return self.list_containers(request, path)
+
+        container = self.containers.get(path)
+        metadata = dict((k.lower(), v) for k, v in request.headers.items()
+                        if k.lower().startswith('x-container-'))
+
+        if request.command == 'PUT':
+            with self.lock:
+                self.containers.setdefault(path, {'x-container-object-count': '0',
+                                                  'x-container-bytes-used': '0'}).update(metadata)
+            return request.reply(201 if container is None else 202)
+        if container is None:
+            return request.reply(404)
+        if request.command == 'HEAD':
+            return request.reply(204, container)
+        if request.command == 'POST':
+            with self.lock:
+                container.update(metadata)
+            return request.reply(204)
+        if request.command == 'DELETE':
+            with self.lock:
+                self.containers.pop(path, None)
+            return request.reply(204)
+        request.reply(405)
+
+    def list_containers(self, request, path):
+        """A page of the containers of the account, in name order like swift"""
+        query = urlparse.parse_qs(urlparse.urlparse(request.path).query)
+        account = path.rstrip('/') + '/'
+        with self.lock:
+            containers = sorted((container_path[len(account):], metadata)
+                                for container_path, metadata in self.containers.items()
+                                if container_path.startswith(account))
+        prefix = query.get('prefix', [''])[0]
+        marker = query.get('marker', [''])[0]
+        containers = [(name, metadata) for name, metadata in containers if name.startswith(prefix) and name > marker]
+        if 'limit' in query:
+            containers = containers[:int(query['limit'][0])]
+        request.reply(200, body=[{'name': name, 'count': int(metadata['x-container-object-count']),
+                                  'bytes': int(metadata['x-container-bytes-used'])}
+                                 for name, metadata in containers])
+
+
+class FakeKeystone(FakeService):
+    """
+    Keystone v2 identity service with a single admin user and tenant, keeping
+    the users it creates in memory. Tokens it issues are also accepted by swift.
+    """
+
+    def __init__(self, username, password, tenant_name, tenant_id='bench_tenant', swift=None,
+                 token_ttl=3600, **kwargs):
+        super(FakeKeystone, self).__init__(**kwargs)
+        self.username = username
+        self.password = password
+        self.tenant = {'id': tenant_id, 'name': tenant_name, 'enabled': True, 'description': ''}
+        self.swift = swift
+        self.token_ttl = token_ttl
+        self.tokens = set()
+        self.users = {}
+
+    @property
+    def url(self):
+        return self.address + '/v2.0'
+
+    def route(self, path):
+        parts = path.strip('/').split('/')
+        if len(parts) > 2 and parts[1] in ('users', 'tenants'):
+            parts[2] = '{id}'
+        return '/'.join(parts)
+
+    def issue_token(self):
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens.add(token)
+        if self.swift is not None:
+            self.swift.tokens.add(token)
+        expires = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.token_ttl)
+        return token, expires.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def handle(self, request, path, body):
+        parts = path.strip('/').split('/')[1:]
+        data = json.loads(body) if body else {}
+
+        if request.command == 'POST' and parts == ['tokens']:
+            return self.authenticate(request, data)
+        if request.headers.get('x-auth-token') not in self.tokens:
+            return request.reply(401, body={'error': {'code': 401, 'message': 'Unauthorized'}})
+
+        if parts == ['tenants'] and request.command == 'GET':
+            return request.reply(200, body={'tenants': [self.tenant]})
+        if parts == ['users'] and request.command == 'GET':
+            return self.list_users(request)
+        if parts[:3] == ['tenants', self.tenant['id'], 'users'] and request.command == 'GET':
+            return self.list_users(request)
+        if parts == ['users'] and request.command == 'POST':
+            return self.create_user(request, data['user'])
+        if len(parts) >= 2 and parts[0] == 'users':
+            user = self.users.get(parts[1])
+            if user is None:
+                return request.reply(404, body={'error': {'code': 404, 'message': 'Not found'}})
+            if len(parts) == 2 and request.command == 'GET':
+                return request.reply(200, body={'user': user})
+            if len(parts) == 2 and request.command == 'DELETE':
+                with self.lock:
+                    self.users.pop(user['id'], None)
+                return request.reply(204)
+            if parts[2:] == ['OS-KSADM', 'password'] and request.command == 'PUT':
+                return request.reply(200, body={'user': user})
+        request.reply(404, body={'error': {'code': 404, 'message': 'Not found'}})
+
+    def authenticate(self, request, data):
+        credentials = data.get('auth', {}).get('passwordCredentials', {})
+        if (credentials.get('username'), credentials.get('password')) != (self.username, self.password):
+            return request.reply(401, body={'error': {'code': 401, 'message': 'Invalid credentials'}})
+        token, expires = self.issue_token()
+        endpoint = {'adminURL': self.url, 'internalURL': self.url, 'publicURL': self.url, 'region': 'RegionOne'}
+        request.reply(200, body={'access': {
+            'token': {'id': token, 'expires': expires, 'tenant': self.tenant},
+            'serviceCatalog': [{'type': 'identity', 'name': 'keystone', 'endpoints': [endpoint]}],
+            'user': {'id': 'admin', 'name': self.username, 'roles': [{'name': 'admin'}]},
+            'metadata': {'roles': [], 'is_admin': 0},
+        }})
+
+    def create_user(self, request, fields):
+        with self.lock:
+            if any(user['name'] == fields['name'] for user in self.users.values()):
+                return request.reply(409, body={'error': {'code': 409, 'message': 'Conflict'}})
+            user = {'id': uuid.uuid4().hex, 'name': fields['name'], 'email': fields.get('email'),
+                    'tenantId': fields.get('tenantId'), 'enabled': fields.get('enabled', True)}
+            self.users[user['id']] = user
+        request.reply(200, body={'user': user})
+
+    def list_users(self, request):
+        # Like the v2 API of keystone, every user at once: limit and marker are ignored
+        with self.lock:
+            users = list(self.users.values())
+        request.reply(200, body={'users': users})
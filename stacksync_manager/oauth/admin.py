@@ -1,28 +1,72 @@
 from django.contrib import admin
 from django.core.urlresolvers import reverse
+from django.forms.models import BaseInlineFormSet
 from oauth.models import Consumer, RequestToken, AccessToken, Nonce
+from users.replicas import ReplicaChangeListMixin
 
 
-class RequestTokenAdmin(admin.ModelAdmin):
+class LatestInlineFormSet(BaseInlineFormSet):
+    """Only the max_rows most recent objects, however many there are"""
+    max_rows = 20
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            self._queryset = self.queryset.order_by('-created_at', '-id')[:self.max_rows]
+        return self._queryset
+
+
+class LatestTabularInline(admin.TabularInline):
+    """
+    Tabular inline showing the max_rows most recent objects, with the related
+    objects in select_related loaded by the same query. The complete list is
+    in the changelist of the model.
+    """
+    formset = LatestInlineFormSet
+    extra = 0
+    max_rows = 20
+    select_related = ()
+
+    def get_queryset(self, request):
+        queryset = super(LatestTabularInline, self).get_queryset(request)
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        return queryset
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super(LatestTabularInline, self).get_formset(request, obj, **kwargs)
+        formset.max_rows = self.max_rows
+        return formset
+
+
+class RequestTokenAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     list_display = ('request_token', 'request_token_secret', 'verifier')
-    search_fields = ['user__email', 'consumer__consumer_key']
+    search_fields = ['=request_token', 'user__email', '=consumer__consumer_key']
+    raw_id_fields = ('consumer', 'user')
 
 
-class RequestTokenInLine(admin.TabularInline):
+class RequestTokenInLine(LatestTabularInline):
     model = RequestToken
-    extra = 0
+    fields = ('consumer', 'request_token', 'request_token_secret', 'verifier')
+    readonly_fields = ('consumer',)
+    select_related = ('consumer__user',)
+    # Tokens are only issued by the oauth flow
+    max_num = 0
 
 
-class AccessTokenAdmin(admin.ModelAdmin):
+class AccessTokenAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     list_display = ('user', 'access_token', 'access_token_secret', 'modified_at')
     list_filter = ['modified_at']
-    search_fields = ['user__email', 'consumer__consumer_key']
+    list_select_related = ('user',)
+    search_fields = ['=access_token', 'user__email', '=consumer__consumer_key']
+    raw_id_fields = ('consumer', 'user')
 
 
-class AccessTokenInLine(admin.TabularInline):
+class AccessTokenInLine(LatestTabularInline):
     model = AccessToken
-    extra = 0
-    fields = ('consumer','access_token', 'access_token_secret')
+    fields = ('consumer', 'access_token', 'access_token_secret')
+    readonly_fields = ('consumer',)
+    select_related = ('consumer__user',)
+    max_num = 0
 
 
 class NonceAdmin(admin.ModelAdmin):
@@ -30,15 +74,16 @@ class NonceAdmin(admin.ModelAdmin):
     search_fields = ['consumer_key', 'token']
 
 
-class ConsumerAdmin(admin.ModelAdmin):
+class ConsumerAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     list_display = ('user', 'consumer_key', 'consumer_secret')
-    search_fields = ['user__email', 'consumer_key']
+    list_select_related = ('user',)
+    search_fields = ['user__email', '=consumer_key']
+    raw_id_fields = ('user',)
     inlines = [RequestTokenInLine, AccessTokenInLine]
 
 
-class ConsumerInLine(admin.TabularInline):
+class ConsumerInLine(LatestTabularInline):
     model = Consumer
-    extra = 0
     fields = ('consumer_key', 'consumer_secret')
 
 
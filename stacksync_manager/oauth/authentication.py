@@ -0,0 +1,102 @@
+"""Authentication of requests signed with an OAuth1 access token (RFC 5849)."""
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponse
+from oauthlib.oauth1 import RequestValidator, ResourceEndpoint
+from oauthlib.oauth1.rfc5849 import SIGNATURE_HMAC, SIGNATURE_PLAINTEXT
+
+from oauth.nonces import get_nonce_store
+from oauth.verification import get_access_token
+
+
+class StacksyncRequestValidator(RequestValidator):
+    """
+    Validates access tokens against the database. The token is looked up once,
+    with its consumer, and kept on the oauthlib request as stacksync_token.
+    """
+
+    allowed_signature_methods = (SIGNATURE_HMAC, SIGNATURE_PLAINTEXT)
+    dummy_client = u'dummy_client'
+    dummy_access_token = u'dummy_access_token'
+    enforce_ssl = False
+
+    @property
+    def timestamp_lifetime(self):
+        return settings.OAUTH_TIMESTAMP_WINDOW
+
+    # Keys, tokens and nonces are whatever was issued, not the format oauthlib suggests
+    def check_client_key(self, client_key):
+        return bool(client_key)
+
+    def check_access_token(self, access_token):
+        return bool(access_token)
+
+    def check_nonce(self, nonce):
+        return bool(nonce)
+
+    def validate_timestamp_and_nonce(self, client_key, timestamp, nonce, request, request_token=None,
+                                     access_token=None):
+        return get_nonce_store().check_and_insert(client_key, access_token or request_token, int(timestamp), nonce)
+
+    def validate_client_key(self, client_key, request):
+        request.stacksync_token = get_access_token(client_key, request.resource_owner_key)
+        return request.stacksync_token is not None
+
+    def validate_access_token(self, client_key, access_token, request):
+        return request.stacksync_token is not None
+
+    def validate_realms(self, client_key, token, request, uri=None, realms=None):
+        return True
+
+    def get_client_secret(self, client_key, request):
+        if request.stacksync_token is None:
+            return u'dummy'
+        return request.stacksync_token.consumer.consumer_secret
+
+    def get_access_token_secret(self, client_key, access_token, request):
+        if request.stacksync_token is None:
+            return u'dummy'
+        return request.stacksync_token.access_token_secret
+
+
+endpoint = ResourceEndpoint(StacksyncRequestValidator())
+
+
+def authenticate(request):
+    """
+    The AccessToken the request is signed with, None unless the signature is
+    valid and the nonce was not used before.
+    """
+    headers = {}
+    if 'HTTP_AUTHORIZATION' in request.META:
+        headers['Authorization'] = request.META['HTTP_AUTHORIZATION']
+    if 'CONTENT_TYPE' in request.META:
+        headers['Content-Type'] = request.META['CONTENT_TYPE']
+    try:
+        valid, oauth_request = endpoint.validate_protected_resource_request(
+            request.build_absolute_uri(), http_method=request.method, body=request.body, headers=headers)
+    except ValueError:
+        # oauthlib refuses some malformed parameters outright
+        return None
+    if not valid:
+        return None
+    return oauth_request.stacksync_token
+
+
+def oauth_required(view):
+    """
+    Lets the request through only if it is signed with a valid access token,
+    available as request.oauth_token, and its user as request.stacksync_user.
+    """
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        token = authenticate(request)
+        if token is None:
+            response = HttpResponse('Unauthorized', status=401, content_type='text/plain')
+            response['WWW-Authenticate'] = 'OAuth realm="stacksync"'
+            return response
+        request.oauth_token = token
+        request.stacksync_user = token.user
+        return view(request, *args, **kwargs)
+    return wrapped
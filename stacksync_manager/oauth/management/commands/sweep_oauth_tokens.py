@@ -0,0 +1,32 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from oauth.sweeper import sweep_expired, TABLES
+
+
+class Command(BaseCommand):
+    help = ('Deletes the request tokens, access tokens and unused consumers older than their maximum age, '
+            'and the expired nonces')
+    option_list = BaseCommand.option_list + tuple(
+        make_option('--%s-days' % name.replace('_', '-'), type='int', dest=name, default=None,
+                    help='Delete the %s created more than this many days ago, instead of OAUTH_MAX_AGE_DAYS'
+                         % name.replace('_', ' '))
+        for name, model in TABLES) + (
+        make_option('--batch-size', type='int', dest='batch_size', default=None,
+                    help='Rows deleted per transaction, OAUTH_SWEEP_BATCH_SIZE by default'),
+        make_option('--throttle', type='float', dest='throttle', default=None,
+                    help='Seconds to wait between batches, OAUTH_SWEEP_THROTTLE by default'),
+    )
+
+    def handle(self, *args, **options):
+        max_age = dict(settings.OAUTH_MAX_AGE_DAYS)
+        for name, model in TABLES:
+            if options[name] is not None:
+                max_age[name] = options[name]
+
+        report = sweep_expired(max_age, batch_size=options['batch_size'], throttle=options['throttle'])
+        deleted = ', '.join('%d %s' % (report.deleted[name], name.replace('_', ' '))
+                            for name in [name for name, model in TABLES] + ['nonces'])
+        self.stdout.write('Deleted %s in %d batches, %.1fs' % (deleted, report.batches, report.elapsed))
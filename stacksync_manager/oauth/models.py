@@ -6,7 +6,7 @@ from users.models import StacksyncUser
 class Consumer(models.Model):
 
     id = models.AutoField(primary_key=True)
-    consumer_key = models.CharField(max_length=100)
+    consumer_key = models.CharField(max_length=100, db_index=True)
     consumer_secret = models.CharField(max_length=100)
     rsa_key = models.CharField(max_length=100, blank=True)
     user = models.ForeignKey(StacksyncUser, db_column="user")
@@ -16,7 +16,7 @@ class Consumer(models.Model):
     application_description = models.CharField(max_length=100)
     application_uri = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now_add=True)
+    modified_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     class Meta:
         db_table = "oauth1_consumers"
@@ -35,11 +35,11 @@ class RequestToken(models.Model):
     user = models.ForeignKey(StacksyncUser, db_column="user")
     realm = models.CharField(max_length=100)
     redirect_uri = models.CharField(max_length=100)
-    request_token = models.CharField(max_length=100)
+    request_token = models.CharField(max_length=100, db_index=True)
     request_token_secret = models.CharField(max_length=100)
     verifier = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now_add=True)
+    modified_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     class Meta:
         db_table = "oauth1_request_tokens"
@@ -54,10 +54,10 @@ class AccessToken(models.Model):
     consumer = models.ForeignKey(Consumer, db_column="consumer")
     user = models.ForeignKey(StacksyncUser, db_column="user")
     realm = models.CharField(max_length=100)
-    access_token = models.CharField(max_length=100)
+    access_token = models.CharField(max_length=100, db_index=True)
     access_token_secret = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now_add=True)
+    modified_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     class Meta:
         db_table = "oauth1_access_tokens"
@@ -74,7 +74,7 @@ class Nonce(models.Model):
     id = models.AutoField(primary_key=True)
     consumer_key = models.CharField(max_length=100, db_column='consumer_key')
     token = models.CharField(max_length=100)
-    timestamp = models.IntegerField()
+    timestamp = models.IntegerField(db_index=True)
     nonce = models.CharField(max_length=100)
 
     class Meta:
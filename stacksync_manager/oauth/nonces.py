@@ -0,0 +1,129 @@
+"""Replay protection for OAuth1 nonces, remembered while their timestamp is in the window."""
+import abc
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db import transaction, IntegrityError, DEFAULT_DB_ALIAS
+from django.utils.module_loading import import_by_path
+
+from oauth.models import Nonce
+
+
+class BaseNonceStore(object):
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, window=None):
+        self.window = window or settings.OAUTH_TIMESTAMP_WINDOW
+
+    def is_timestamp_valid(self, timestamp, now=None):
+        now = time.time() if now is None else now
+        return abs(now - timestamp) <= self.window
+
+    def get_bucket(self, timestamp):
+        return int(timestamp) // self.window
+
+    def get_oldest_live_bucket(self, now):
+        """Buckets before this one only hold nonces whose timestamp is out of the window"""
+        return self.get_bucket(now) - 1
+
+    def check_and_insert(self, consumer_key, token, timestamp, nonce, now=None):
+        """
+        Records the nonce of a request.
+        :return bool: False if the nonce was already used or the timestamp is out of the window
+        """
+        now = time.time() if now is None else now
+        if not self.is_timestamp_valid(timestamp, now):
+            return False
+        return self.insert(consumer_key or '', token or '', int(timestamp), nonce, now)
+
+    @abc.abstractmethod
+    def insert(self, consumer_key, token, timestamp, nonce, now):
+        """
+        Atomically records the nonce of a request received at now, whose
+        timestamp is in the window.
+        :return bool: False if it was already there
+        """
+
+
+class MemoryNonceStore(BaseNonceStore):
+    """Nonces of this process only, for single node deployments"""
+
+    def __init__(self, window=None):
+        super(MemoryNonceStore, self).__init__(window)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def insert(self, consumer_key, token, timestamp, nonce, now):
+        key = (consumer_key, token, timestamp, nonce)
+        self.purge_expired(now)
+        with self._lock:
+            bucket = self._buckets.setdefault(self.get_bucket(timestamp), set())
+            if key in bucket:
+                return False
+            bucket.add(key)
+            return True
+
+    def purge_expired(self, now=None):
+        oldest = self.get_oldest_live_bucket(time.time() if now is None else now)
+        with self._lock:
+            for bucket in [bucket for bucket in self._buckets if bucket < oldest]:
+                del self._buckets[bucket]
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+
+class CacheNonceStore(BaseNonceStore):
+    """
+    Nonces in a cache of the django cache framework, shared by every process
+    using it. Entries expire with their bucket, the cache drops them.
+    """
+
+    def __init__(self, window=None, alias='default'):
+        super(CacheNonceStore, self).__init__(window)
+        self._cache = get_cache(alias)
+
+    def insert(self, consumer_key, token, timestamp, nonce, now):
+        digest = hashlib.sha1('\0'.join([consumer_key, token, str(timestamp), nonce]).encode('utf8')).hexdigest()
+        # add() only stores the key if it is not there yet, in a single operation
+        return self._cache.add('oauth_nonce:' + digest, 1, 2 * self.window)
+
+
+class DatabaseNonceStore(BaseNonceStore):
+    """
+    Nonces in the oauth1_nonce table. Its unique index does the replay check.
+    Expired nonces are deleted out of the request path by manage.py
+    sweep_oauth_tokens, on the index of timestamp.
+    """
+
+    def get_expiry(self, now):
+        """Timestamps before this one are out of the window of every live bucket"""
+        return self.get_oldest_live_bucket(now) * self.window
+
+    def insert(self, consumer_key, token, timestamp, nonce, now):
+        # Written on the primary by name: nonces are never read back from a
+        # replica, so they don't make the rest of the request read the primary
+        try:
+            with transaction.atomic():
+                Nonce.objects.db_manager(DEFAULT_DB_ALIAS).create(consumer_key=consumer_key, token=token,
+                                                                  timestamp=timestamp, nonce=nonce)
+        except IntegrityError:
+            return False
+        return True
+
+
+_nonce_store = None
+_nonce_store_lock = threading.Lock()
+
+
+def get_nonce_store():
+    """The nonce store configured by settings.OAUTH_NONCE_STORE"""
+    global _nonce_store
+    if _nonce_store is None:
+        with _nonce_store_lock:
+            if _nonce_store is None:
+                _nonce_store = import_by_path(settings.OAUTH_NONCE_STORE)()
+    return _nonce_store
@@ -0,0 +1,25 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from oauth.models import Consumer, AccessToken
+from oauth.verification import invalidate_access_tokens
+
+
+@receiver(pre_save, sender=AccessToken)
+def invalidate_rotated_access_token(sender, instance, **kwargs):
+    if instance.pk:
+        previous = AccessToken.objects.filter(pk=instance.pk).values_list('access_token', flat=True).first()
+        if previous:
+            invalidate_access_tokens(previous)
+
+
+@receiver(post_save, sender=AccessToken)
+@receiver(post_delete, sender=AccessToken)
+def invalidate_access_token(sender, instance, **kwargs):
+    invalidate_access_tokens(instance.access_token)
+
+
+@receiver(post_save, sender=Consumer)
+def invalidate_consumer_access_tokens(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_access_tokens(*instance.accesstoken_set.values_list('access_token', flat=True))
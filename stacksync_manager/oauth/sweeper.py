@@ -0,0 +1,84 @@
+"""Deletes the OAuth1 rows older than their maximum age, and the expired nonces, in small batches."""
+import calendar
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from oauth.models import Consumer, RequestToken, AccessToken, Nonce
+from oauth.nonces import DatabaseNonceStore
+from oauth.verification import invalidate_access_tokens
+from users.concurrency import Report
+
+# In this order, so consumers left without tokens go in the same sweep
+TABLES = (('request_tokens', RequestToken), ('access_tokens', AccessToken), ('consumers', Consumer))
+
+
+class SweepReport(Report):
+
+    def __init__(self):
+        super(SweepReport, self).__init__()
+        self.deleted = dict((name, 0) for name, model in TABLES)
+        self.deleted['nonces'] = 0
+        self.batches = 0
+
+
+def get_expired(model, cutoff):
+    if model is Nonce:
+        return Nonce.objects.filter(timestamp__lt=cutoff).order_by()
+    expired = model.objects.filter(modified_at__lt=cutoff)
+    if model is Consumer:
+        # A consumer still holding tokens is in use
+        expired = expired.filter(requesttoken__isnull=True, accesstoken__isnull=True)
+    return expired.order_by()
+
+
+def delete_rows(model, pks):
+    quote = connection.ops.quote_name
+    connection.cursor().execute('DELETE FROM %s WHERE %s IN (%s)' % (
+        quote(model._meta.db_table), quote(model._meta.pk.column), ', '.join(['%s'] * len(pks))), pks)
+
+
+def sweep_table(name, model, cutoff, batch_size, throttle, report):
+    # Access tokens are read with their value, to drop them from the cache
+    fields = ('pk', 'access_token') if model is AccessToken else ('pk',)
+    while True:
+        with transaction.atomic():
+            rows = list(get_expired(model, cutoff).values_list(*fields)[:batch_size])
+            if not rows:
+                return
+            batch = [row[0] for row in rows]
+            delete_rows(model, batch)
+        if model is AccessToken:
+            invalidate_access_tokens(*[row[1] for row in rows])
+        report.deleted[name] += len(batch)
+        report.batches += 1
+        if len(batch) < batch_size:
+            return
+        if throttle:
+            time.sleep(throttle)
+
+
+def sweep_expired(max_age=None, batch_size=None, throttle=None, now=None):
+    """
+    Deletes the request tokens, access tokens and consumers created more than
+    the number of days max_age gives for their table ago, OAUTH_MAX_AGE_DAYS by
+    default. Tables with no maximum age, or None, are left alone. Expired
+    nonces are always deleted.
+    :return SweepReport:
+    """
+    max_age = settings.OAUTH_MAX_AGE_DAYS if max_age is None else max_age
+    batch_size = batch_size or settings.OAUTH_SWEEP_BATCH_SIZE
+    throttle = settings.OAUTH_SWEEP_THROTTLE if throttle is None else throttle
+    now = now or timezone.now()
+
+    report = SweepReport()
+    for name, model in TABLES:
+        days = max_age.get(name)
+        if days is not None:
+            sweep_table(name, model, now - timezone.timedelta(days=days), batch_size, throttle, report)
+    expiry = DatabaseNonceStore().get_expiry(calendar.timegm(now.utctimetuple()))
+    sweep_table('nonces', Nonce, expiry, batch_size, throttle, report)
+    report.finish()
+    return report
@@ -1,3 +1,202 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.utils import timezone
+
+from oauth.models import Consumer, RequestToken, AccessToken, Nonce
+from oauth.nonces import MemoryNonceStore, CacheNonceStore, DatabaseNonceStore
+from oauth.sweeper import sweep_expired
+from oauth.verification import get_access_token, get_verification_cache
+from users.models import StacksyncUser
+
+
+class NonceStoreTests(object):
+    """Checks shared by every nonce store, mixed into a TestCase per store"""
+    now = 1000000
+
+    def test_replayed_nonce_is_rejected(self):
+        self.assertTrue(self.store.check_and_insert('key', 'token', self.now, 'nonce', now=self.now))
+        self.assertFalse(self.store.check_and_insert('key', 'token', self.now, 'nonce', now=self.now + 1))
+        self.assertTrue(self.store.check_and_insert('key', 'token', self.now, 'other', now=self.now + 1))
+
+    def test_timestamp_out_of_window_is_rejected(self):
+        self.assertFalse(self.store.check_and_insert('key', 'token', self.now - 301, 'nonce', now=self.now))
+        self.assertFalse(self.store.check_and_insert('key', 'token', self.now + 301, 'nonce', now=self.now))
+
+
+class MemoryNonceStoreTest(NonceStoreTests, TestCase):
+
+    def setUp(self):
+        self.store = MemoryNonceStore(window=300)
+
+    def test_expired_buckets_are_dropped(self):
+        self.store.check_and_insert('key', 'token', self.now, 'nonce', now=self.now)
+        self.store.check_and_insert('key', 'token', self.now + 600, 'nonce', now=self.now + 600)
+        self.assertEquals(1, len(self.store))
+
+
+class CacheNonceStoreTest(NonceStoreTests, TestCase):
+
+    def setUp(self):
+        self.store = CacheNonceStore(window=300)
+        self.store._cache.clear()
+
+
+class DatabaseNonceStoreTest(NonceStoreTests, TestCase):
+
+    def setUp(self):
+        self.store = DatabaseNonceStore(window=300)
+
+    def test_expired_buckets_are_swept(self):
+        for timestamp in [self.now, self.now + 300, self.now + 600]:
+            self.store.check_and_insert('key', 'token', timestamp, 'nonce', now=timestamp)
+        # Not on the request path
+        self.assertEquals(3, Nonce.objects.count())
+
+        now = timezone.make_aware(datetime.datetime.utcfromtimestamp(self.now + 600), timezone.utc)
+        with self.settings(OAUTH_TIMESTAMP_WINDOW=300):
+            report = sweep_expired({}, batch_size=10, throttle=0, now=now)
+
+        self.assertEquals(1, report.deleted['nonces'])
+        self.assertEquals([self.now + 300, self.now + 600],
+                          sorted(Nonce.objects.values_list('timestamp', flat=True)))
+
+
+class AccessTokenVerificationTest(TestCase):
+
+    def setUp(self):
+        get_verification_cache().clear()
+        StacksyncUser.objects.bulk_create([StacksyncUser(name="AAA", email="testuser@testuser.com",
+                                                         swift_user="stacksync_AAA", swift_account="AUTH_id")])
+        self.user = StacksyncUser.objects.get()
+        self.consumer = Consumer.objects.create(consumer_key='key', consumer_secret='secret', user=self.user)
+        self.token = AccessToken.objects.create(consumer=self.consumer, user=self.user,
+                                                access_token='token', access_token_secret='token_secret')
+
+    def test_token_is_resolved_with_consumer_and_user_in_one_query(self):
+        with self.assertNumQueries(1):
+            token = get_access_token('key', 'token')
+            self.assertEquals('secret', token.consumer.consumer_secret)
+            self.assertEquals(self.user.pk, token.user.pk)
+
+        with self.assertNumQueries(0):
+            self.assertEquals(self.token.pk, get_access_token('key', 'token').pk)
+
+    def test_token_of_another_consumer_is_rejected(self):
+        self.assertIsNone(get_access_token('other_key', 'token'))
+        self.assertIsNone(get_access_token('key', 'other_token'))
+
+    def test_deleted_token_is_rejected(self):
+        get_access_token('key', 'token')
+        self.token.delete()
+        self.assertIsNone(get_access_token('key', 'token'))
+
+    def test_rotated_token_replaces_the_old_one(self):
+        get_access_token('key', 'token')
+        self.token.access_token = 'new_token'
+        self.token.save()
+
+        self.assertIsNone(get_access_token('key', 'token'))
+        self.assertEquals(self.token.pk, get_access_token('key', 'new_token').pk)
+
+    def test_rotated_consumer_key_replaces_the_old_one(self):
+        get_access_token('key', 'token')
+        self.consumer.consumer_key = 'new_key'
+        self.consumer.save()
+
+        self.assertIsNone(get_access_token('key', 'token'))
+        self.assertEquals(self.token.pk, get_access_token('new_key', 'token').pk)
+
+
+class TokenInlineTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        StacksyncUser.objects.bulk_create([StacksyncUser(name="AAA", email="testuser@testuser.com",
+                                                         swift_user="stacksync_AAA", swift_account="AUTH_id")])
+        self.user = StacksyncUser.objects.get()
+        self.consumer = Consumer.objects.create(consumer_key='key', consumer_secret='secret', user=self.user)
+
+    def add_tokens(self, count):
+        start = AccessToken.objects.count()
+        AccessToken.objects.bulk_create([
+            AccessToken(consumer=self.consumer, user=self.user, access_token='token%d' % i,
+                        access_token_secret='secret') for i in range(start, start + count)])
+        RequestToken.objects.bulk_create([
+            RequestToken(consumer=self.consumer, user=self.user, request_token='token%d' % i,
+                         request_token_secret='secret', verifier='verifier') for i in range(start, start + count)])
+
+    def get_change_page(self, model, obj):
+        response = self.client.get(reverse('admin:%s_%s_change' % (model._meta.app_label, model._meta.model_name),
+                                           args=[obj.pk]))
+        self.assertEquals(200, response.status_code)
+        return response
+
+    def count_queries(self, model, obj):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            self.get_change_page(model, obj)
+        return len(queries)
+
+    def test_only_latest_tokens_are_shown(self):
+        self.add_tokens(30)
+        for model, obj in [(StacksyncUser, self.user), (Consumer, self.consumer)]:
+            response = self.get_change_page(model, obj)
+            self.assertContains(response, 'token29')
+            self.assertNotContains(response, 'token9"')
+            self.assertEquals(20, response.context['inline_admin_formsets'][-1].formset.initial_form_count())
+
+    def test_queries_do_not_grow_with_tokens(self):
+        self.add_tokens(5)
+        queries = self.count_queries(StacksyncUser, self.user), self.count_queries(Consumer, self.consumer)
+        self.add_tokens(15)
+        self.assertEquals(queries, (self.count_queries(StacksyncUser, self.user),
+                                    self.count_queries(Consumer, self.consumer)))
+
+
+class SweeperTest(TestCase):
+
+    def setUp(self):
+        get_verification_cache().clear()
+        StacksyncUser.objects.bulk_create([StacksyncUser(name="AAA", email="testuser@testuser.com",
+                                                         swift_user="stacksync_AAA", swift_account="AUTH_id")])
+        self.user = StacksyncUser.objects.get()
+        self.old, self.new = [Consumer.objects.create(consumer_key=key, consumer_secret='secret', user=self.user)
+                              for key in ['old', 'new']]
+        for i in range(5):
+            RequestToken.objects.create(consumer=self.new, user=self.user, request_token='request%d' % i)
+            AccessToken.objects.create(consumer=self.old if i < 3 else self.new, user=self.user,
+                                       access_token='access%d' % i, access_token_secret='secret')
+        two_days_ago = timezone.now() - timezone.timedelta(days=2)
+        RequestToken.objects.filter(request_token__in=['request0', 'request1', 'request2']).update(
+            modified_at=two_days_ago)
+        AccessToken.objects.filter(consumer=self.old).update(modified_at=two_days_ago)
+        Consumer.objects.filter(pk=self.old.pk).update(modified_at=two_days_ago)
+
+    def test_request_tokens_are_swept_in_batches(self):
+        report = sweep_expired({'request_tokens': 1}, batch_size=2, throttle=0)
+
+        self.assertEquals(3, report.deleted['request_tokens'])
+        self.assertEquals(2, report.batches)
+        self.assertEquals(['request3', 'request4'],
+                          sorted(RequestToken.objects.values_list('request_token', flat=True)))
+        self.assertEquals(5, AccessToken.objects.count())
+
+    def test_consumers_go_with_their_last_token(self):
+        self.assertEquals('old', get_access_token('old', 'access0').consumer.consumer_key)
+
+        report = sweep_expired({'access_tokens': 1, 'consumers': 1}, batch_size=10, throttle=0)
+
+        self.assertEquals({'request_tokens': 0, 'access_tokens': 3, 'consumers': 1, 'nonces': 0}, report.deleted)
+        self.assertEquals(['new'], list(Consumer.objects.values_list('consumer_key', flat=True)))
+        # Dropped from the verification cache too
+        self.assertIsNone(get_access_token('old', 'access0'))
 
-# Create your tests here.
+    def test_consumers_with_tokens_are_kept(self):
+        report = sweep_expired({'consumers': 1}, throttle=0)
+        self.assertEquals(0, report.deleted['consumers'])
+        self.assertEquals(2, Consumer.objects.count())
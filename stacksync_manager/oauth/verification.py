@@ -0,0 +1,59 @@
+"""Lookups needed to verify signed OAuth1 requests."""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db import DEFAULT_DB_ALIAS
+
+from oauth.models import Consumer, RequestToken, AccessToken
+from users.replicas import get_read_database
+
+_missing = object()
+
+
+def get_cache_key(access_token):
+    return 'oauth_access_token:' + hashlib.sha1(access_token.encode('utf8')).hexdigest()
+
+
+def get_verification_cache():
+    return get_cache(settings.OAUTH_VERIFICATION_CACHE)
+
+
+def get_consumer(consumer_key):
+    return Consumer.objects.filter(consumer_key=consumer_key).first()
+
+
+def get_request_token(consumer_key, request_token):
+    return (RequestToken.objects.select_related('consumer', 'user')
+            .filter(request_token=request_token, consumer__consumer_key=consumer_key).first())
+
+
+def find_access_token(access_token, database):
+    return (AccessToken.objects.using(database).select_related('consumer', 'user')
+            .filter(access_token=access_token).first())
+
+
+def get_access_token(consumer_key, access_token):
+    """
+    The AccessToken issued to the consumer, with its consumer and user loaded,
+    or None if there is no such token for that consumer.
+    """
+    cache = get_verification_cache()
+    key = get_cache_key(access_token)
+    token = cache.get(key, _missing)
+    if token is _missing:
+        database = get_read_database()
+        token = find_access_token(access_token, database)
+        if token is None and database != DEFAULT_DB_ALIAS:
+            # Just issued, and not replicated yet
+            token = find_access_token(access_token, DEFAULT_DB_ALIAS)
+        # Unknown tokens are cached too, briefly, so guessing is not a free query
+        cache.set(key, token, settings.OAUTH_VERIFICATION_CACHE_TTL if token else 5)
+
+    if token is None or token.consumer.consumer_key != consumer_key:
+        return None
+    return token
+
+
+def invalidate_access_tokens(*access_tokens):
+    get_verification_cache().delete_many([get_cache_key(token) for token in access_tokens])
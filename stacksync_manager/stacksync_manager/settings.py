@@ -42,6 +42,8 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'users.middleware.RequestMetricsMiddleware',
+    'users.middleware.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -70,6 +72,8 @@ DATABASES = {
         'PASSWORD': 'stacksync',
         'HOST': '192.168.56.101',
         'PORT': '5432',
+        # Seconds connections are kept open for the next requests
+        'CONN_MAX_AGE': 60,
     }
 }
 
@@ -105,3 +109,111 @@ KEYSTONE_ADMIN_USER = 'stacksync_admin'
 KEYSTONE_ADMIN_PASSWORD = 'secret'
 SWIFT_URL = 'http://192.168.56.101:8080/v1'
 
+# Swift clusters new workspaces are spread over, e.g.
+# [{'URL': 'http://swift-a:8080/v1', 'WEIGHT': 2}, {'URL': 'http://swift-b:8080/v1', 'WEIGHT': 1}],
+# SWIFT_URL alone when empty. SWIFT_PLACEMENT chooses the cluster of each one:
+# users.placement.LeastUsedPlacement, ConsistentHashPlacement or RoundRobinPlacement.
+SWIFT_ENDPOINTS = []
+SWIFT_PLACEMENT = 'users.placement.LeastUsedPlacement'
+# Seconds LeastUsedPlacement goes on with the bytes used per cluster it read
+SWIFT_PLACEMENT_USAGE_TTL = 60
+
+# Seconds the stacksync tenant looked up in keystone is reused before asking again
+KEYSTONE_CACHE_TTL = 300
+
+# Seconds before expiry the shared keystone admin token used for swift is renewed
+KEYSTONE_TOKEN_REFRESH_MARGIN = 60
+
+# Idle HTTP connections kept open to the swift proxy, per storage url
+SWIFT_MAX_IDLE_CONNECTIONS = 16
+
+# Seconds keystone and swift calls wait for an answer, per service or per
+# 'host:port' of an endpoint, which wins over its service. None waits forever.
+OPENSTACK_TIMEOUTS = {'keystone': 10, 'swift': 20}
+# Attempts in all of the idempotent calls that hit an outage, waiting a random
+# time up to OPENSTACK_RETRY_BACKOFF seconds, doubled each time up to the max
+OPENSTACK_RETRY_ATTEMPTS = 3
+OPENSTACK_RETRY_BACKOFF = 0.1
+OPENSTACK_RETRY_MAX_BACKOFF = 2
+# Retries of an endpoint allowed over the last 10 seconds: this share of its
+# calls plus this many per second
+OPENSTACK_RETRY_RATIO = 0.2
+OPENSTACK_RETRY_MIN_PER_SECOND = 1
+# After this many outages in a row an endpoint is not called for
+# OPENSTACK_CIRCUIT_RESET seconds, then OPENSTACK_CIRCUIT_PROBES calls at a
+# time check whether it is back. None never stops calling.
+OPENSTACK_CIRCUIT_FAILURES = 5
+OPENSTACK_CIRCUIT_RESET = 30
+OPENSTACK_CIRCUIT_PROBES = 1
+
+# Threads of users.swift_batch shared by the whole process: the most swift
+# requests the bulk container operations have in flight at once
+SWIFT_CONCURRENCY = 16
+
+# Swift containers are created and deleted by manage.py provisioning_worker
+# instead of inside the request that creates or deletes the workspace
+PROVISIONING_QUEUE = True
+PROVISIONING_MAX_ATTEMPTS = 8
+# Seconds before retrying a failed job, doubled on every attempt up to the max
+PROVISIONING_RETRY_BACKOFF = 30
+PROVISIONING_MAX_BACKOFF = 3600
+# Seconds a worker owns the jobs it claimed before another worker may take them
+PROVISIONING_LEASE = 300
+
+# Cache of swift container metadata (quotas). users.cache.TTLCache keeps it in
+# process, bounded to MAX_ENTRIES; users.cache.DjangoCache uses the cache
+# framework instead, the ALIAS cache of CACHES.
+SWIFT_METADATA_CACHE = {
+    'BACKEND': 'users.cache.TTLCache',
+    'TTL': 60,
+    'MAX_ENTRIES': 10000,
+}
+
+# OAuth1 requests are only accepted with a timestamp this many seconds from now,
+# and their nonces only remembered that long, in OAUTH_NONCE_STORE: one of
+# oauth.nonces.DatabaseNonceStore, CacheNonceStore or MemoryNonceStore
+OAUTH_TIMESTAMP_WINDOW = 300
+OAUTH_NONCE_STORE = 'oauth.nonces.DatabaseNonceStore'
+
+# Cache, of CACHES, keeping the access tokens of verified OAuth1 requests, and for how long
+OAUTH_VERIFICATION_CACHE = 'default'
+OAUTH_VERIFICATION_CACHE_TTL = 300
+
+# Duration histograms and error counts of the keystone and swift calls, served
+# at /metrics in the prometheus text format, only to INTERNAL_IPS if set
+OPENSTACK_METRICS = True
+# Requests taking longer than this many seconds are logged with their OpenStack calls
+SLOW_REQUEST_THRESHOLD = 2.0
+
+# Seconds manage.py reconcile waits before checking again the keystone users it
+# found without a stacksync user, bulk provisioning storing the row a bit later
+RECONCILE_KEYSTONE_GRACE = 300
+
+# Days manage.py sweep_oauth_tokens keeps the OAuth1 rows after they were created,
+# whether or not they are still used; None keeps them forever. Consumers only go
+# once they have no tokens left.
+OAUTH_MAX_AGE_DAYS = {
+    'request_tokens': 1,
+    'access_tokens': None,
+    'consumers': None,
+}
+# Rows the sweeper deletes per transaction, and seconds it waits between batches
+OAUTH_SWEEP_BATCH_SIZE = 1000
+OAUTH_SWEEP_THROTTLE = 0.1
+
+# Aliases of DATABASES holding read only replicas of default. Admin changelists,
+# exports, OAuth verification and the workspaces API read from one of them,
+# unless the client wrote something in the last REPLICA_PIN_SECONDS.
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['users.replicas.ReplicaRouter']
+REPLICA_PIN_SECONDS = 10
+# Replicas further behind the primary than this many seconds are not read from,
+# their lag checked at most every REPLICA_LAG_CHECK_INTERVAL seconds
+REPLICA_MAX_LAG = 5
+REPLICA_LAG_CHECK_INTERVAL = 10
+# Seconds between checks that a persistent connection (CONN_MAX_AGE) still works
+DATABASE_HEALTH_CHECK_INTERVAL = 30
+
+# Increments of workspace revisions made at the same time by the threads of a
+# process are written with one UPDATE, see users.revisions
+WORKSPACE_REVISION_COALESCING = False
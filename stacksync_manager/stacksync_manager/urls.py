@@ -9,4 +9,6 @@ urlpatterns = patterns('',
     # url(r'^$', 'stacksync_manager.views.home', name='home'),
     # url(r'^blog/', include('blog.urls')),
     url(r'^admin/', include(admin.site.urls)),
+    url(r'^api/workspaces$', 'users.views.workspaces', name='api_workspaces'),
+    url(r'^metrics$', 'users.views.openstack_metrics', name='openstack_metrics'),
 )
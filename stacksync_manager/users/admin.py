@@ -1,7 +1,12 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.template.response import TemplateResponse
 from oauth.admin import ConsumerInLine, RequestTokenInLine, AccessTokenInLine
-from users.forms import StacksyncUserForm
+from users.deletion import delete_users
+from users.forms import StacksyncUserForm, QuotaForm
 from users.models import StacksyncUser, StacksyncWorkspace, StacksyncMembership
+from users.quotas import set_quota_limit
+from users.replicas import ReplicaChangeListMixin
 
 class StacksyncMembershipInline(admin.StackedInline):
     model = StacksyncMembership
@@ -9,17 +14,18 @@ class StacksyncMembershipInline(admin.StackedInline):
     extra = 1
 
 
-class StacksyncWorkspaceAdmin(admin.ModelAdmin):
+class StacksyncWorkspaceAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     inlines = [StacksyncMembershipInline]
 
 
-class StacksyncUserAdmin(admin.ModelAdmin):
+class StacksyncUserAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     inlines = [ConsumerInLine, RequestTokenInLine, AccessTokenInLine]
     form = StacksyncUserForm
     fields = ['name', 'email', 'password']
     list_display = ('name', 'email', 'swift_user', 'swift_account')
-    search_fields = ['name', 'email', 'swift_user', 'swift_account']
-    actions = ['custom_delete']
+    # Backed by the indexes of users.indexes
+    search_fields = ['name', 'email', 'swift_user', '=swift_account']
+    actions = ['custom_delete', 'set_quota']
 
     def get_actions(self, request):
         actions = super(StacksyncUserAdmin, self).get_actions(request)
@@ -27,10 +33,30 @@ class StacksyncUserAdmin(admin.ModelAdmin):
         return actions
 
     def custom_delete(self, request, queryset):
-            for user in queryset:
-                user.delete()
+        results = delete_users(queryset)
+        deleted = len([result for result in results if result.deleted])
+        self.message_user(request, "Deleted %d stacksync users" % deleted)
+        for result in results:
+            if result.errors:
+                self.message_user(request, unicode(result), level=messages.WARNING)
     custom_delete.short_description = "Delete selected stacksync users"
 
+    def set_quota(self, request, queryset):
+        form = QuotaForm(request.POST if 'apply' in request.POST else None)
+        if not form.is_valid():
+            return TemplateResponse(request, 'admin/users/stacksyncuser/set_quota.html', {
+                'title': 'Set the quota of stacksync users', 'opts': self.model._meta, 'form': form,
+                'queryset': queryset, 'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME})
+
+        report = set_quota_limit(queryset, form.cleaned_data['quota_limit'])
+        self.message_user(request, unicode(report))
+        for (swift_url, swift_container), error in report.failures:
+            self.message_user(request, u'%s: %s, queued for the provisioning worker' % (swift_container, error),
+                              level=messages.WARNING)
+        for (swift_url, swift_container), error in report.rejections:
+            self.message_user(request, u'%s: %s, not retried' % (swift_container, error), level=messages.WARNING)
+    set_quota.short_description = "Set the quota of selected stacksync users"
+
     def save_model(self, request, obj, form, change):
         if form.cleaned_data['password']:
             obj.save(password=form.cleaned_data['password'])
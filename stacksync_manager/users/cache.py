@@ -0,0 +1,140 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.utils.encoding import force_bytes
+from django.utils.module_loading import import_by_path
+
+_missing = object()
+
+
+class TTLCache(object):
+    """
+    Thread safe in-process cache whose entries expire ttl seconds after being set.
+    With max_entries, the least recently used entries are evicted to stay within it.
+    """
+
+    def __init__(self, ttl, max_entries=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None or entry[1] <= time.time():
+                self.misses += 1
+                return default
+            # Back at the end, as the most recently used
+            self._data[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time() + self.ttl)
+            if self.max_entries is not None:
+                while len(self._data) > self.max_entries:
+                    self._data.popitem(last=False)
+
+    def get_or_set(self, key, loader):
+        """
+        Returns the cached value for key, calling loader() to fill it on a miss.
+        Concurrent misses wait for the first loader instead of calling it again.
+        """
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+
+        with self._load_lock:
+            value = self.get(key, _missing)
+            if value is _missing:
+                value = loader()
+                if value is not None:
+                    self.set(key, value)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._data)}
+
+
+class DjangoCache(object):
+    """
+    Same interface as TTLCache, on top of a cache of the django cache framework,
+    so the entries can be shared by every process. Size is bounded by that cache.
+    """
+
+    def __init__(self, ttl, max_entries=None, alias='default', key_prefix='stacksync'):
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self.hits = 0
+        self.misses = 0
+        self._cache = get_cache(alias)
+
+    def _key(self, key):
+        # Hashed: keys hold user input, too long or with characters memcached refuses
+        if isinstance(key, tuple):
+            key = u':'.join(key)
+        return '%s:%s' % (self.key_prefix, hashlib.md5(force_bytes(key)).hexdigest())
+
+    def get(self, key, default=None):
+        value = self._cache.get(self._key(key), _missing)
+        if value is _missing:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._cache.set(self._key(key), value, self.ttl)
+
+    def get_or_set(self, key, loader):
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = loader()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def delete(self, key):
+        self._cache.delete(self._key(key))
+
+    def clear(self):
+        # Entries of other processes expire on their own
+        pass
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+_container_metadata_cache = None
+_container_metadata_lock = threading.Lock()
+
+
+def get_container_metadata_cache():
+    """The cache of swift container metadata, built from settings.SWIFT_METADATA_CACHE"""
+    global _container_metadata_cache
+    if _container_metadata_cache is None:
+        with _container_metadata_lock:
+            if _container_metadata_cache is None:
+                options = dict(getattr(settings, 'SWIFT_METADATA_CACHE', {}))
+                backend = import_by_path(options.pop('BACKEND', 'users.cache.TTLCache'))
+                options = dict((name.lower(), value) for name, value in options.items())
+                _container_metadata_cache = backend(**options)
+    return _container_metadata_cache
@@ -0,0 +1,52 @@
+"""Helpers of the bulk operations."""
+import itertools
+import time
+
+
+class Result(object):
+    """Outcome of calling a function on one item: its return value or the exception it raised"""
+
+    def __init__(self, item, value=None, error=None):
+        self.item = item
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class Report(object):
+    """What a bulk operation did: when it ran, and its failures, the first max_failures of them kept"""
+
+    def __init__(self, max_failures=None):
+        self.max_failures = max_failures
+        self.failed = 0
+        self.failures = []
+        self.started_at = time.time()
+        self.finished_at = None
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    def fail(self, item, error):
+        self.add_failure((item, error))
+
+    def add_failure(self, failure):
+        self.failed += 1
+        if self.max_failures is None or len(self.failures) < self.max_failures:
+            self.failures.append(failure)
+
+    def finish(self):
+        self.finished_at = time.time()
+
+
+def chunked(iterable, size):
+    """Yields lists of up to size items, consuming iterable lazily"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
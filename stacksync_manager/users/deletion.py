@@ -0,0 +1,85 @@
+"""Deletes many stacksync users at once."""
+from keystoneclient import exceptions as keystone_exceptions
+from swiftclient import client as swift
+
+from users import openstack
+from users.models import StacksyncUser, StacksyncWorkspace, ProvisioningJob, get_swift_client
+from users.swift_batch import batch_client
+
+
+class DeletionResult(object):
+
+    def __init__(self, user):
+        self.user = user
+        self.deleted = False
+        self.errors = []
+
+    def __unicode__(self):
+        if self.deleted and not self.errors:
+            return u'%s: deleted' % self.user
+        return u'%s: %s%s' % (self.user, 'deleted, ' if self.deleted else 'not deleted, ', '; '.join(self.errors))
+
+
+def delete_users(queryset, concurrency=None):
+    """
+    Deletes the users of the queryset with their keystone users, workspaces and containers.
+
+    A user whose keystone user can't be deleted is kept, so the deletion can be
+    tried again. A container that can't be deleted doesn't keep its user; its
+    deletion is queued for the provisioning worker instead. Calls run on the
+    shared batch pool, or on one of concurrency threads.
+    :return list: a DeletionResult per user
+    """
+    users = list(queryset)
+    # keyed by the text form of the uuid, the one values_list returns
+    results = dict((str(user.pk), DeletionResult(user)) for user in users)
+
+    # Resolved here because it may store ids found by name in the database
+    keystone_ids = []
+    for user in users:
+        try:
+            keystone_ids.append((user, user.get_keystone_user_id()))
+        except Exception as e:
+            results[str(user.pk)].errors.append(u'keystone: %s' % e)
+    with batch_client(concurrency) as client:
+        for result in client.run(_delete_keystone_user, keystone_ids):
+            if not result.ok:
+                user = result.item[0]
+                results[str(user.pk)].errors.append(u'keystone: %s' % result.error)
+
+        deletable = [pk for pk, result in results.items() if not result.errors]
+        workspaces = list(StacksyncWorkspace.objects.filter(owner__in=deletable)
+                          .values_list('owner_id', 'swift_url', 'swift_container'))
+
+        swift_client = get_swift_client()
+        for result in client.run(lambda owner_id, swift_url, swift_container: _delete_container(
+                swift_client, swift_url, swift_container), workspaces):
+            if not result.ok:
+                owner_id, swift_url, swift_container = result.item
+                results[str(owner_id)].errors.append(u'swift container %s: %s' % (swift_container, result.error))
+                ProvisioningJob.objects.enqueue(ProvisioningJob.DELETE_CONTAINER, swift_url, swift_container)
+
+    # Workspaces, memberships and oauth rows go with their users in the same cascade
+    StacksyncUser.objects.filter(pk__in=deletable).delete()
+    for pk in deletable:
+        results[pk].deleted = True
+
+    return [results[str(user.pk)] for user in users]
+
+
+def _delete_keystone_user(user, keystone_user_id):
+    if not keystone_user_id:
+        return
+    try:
+        user.keystone.users.delete(keystone_user_id)
+    except keystone_exceptions.NotFound:
+        pass
+    openstack.keystone_users.discard(user.swift_user)
+
+
+def _delete_container(swift_client, swift_url, swift_container):
+    try:
+        swift_client.delete_container(swift_url, swift_container)
+    except swift.ClientException as e:
+        if e.http_status != 404:
+            raise
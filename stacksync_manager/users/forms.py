@@ -1,4 +1,5 @@
 from django import forms
+from django.db import models
 from django.forms import ModelForm, PasswordInput
 from users.models import StacksyncUser
 
@@ -8,3 +9,7 @@ class StacksyncUserForm(ModelForm):
 
     class Meta:
         model = StacksyncUser
+
+
+class QuotaForm(forms.Form):
+    quota_limit = forms.IntegerField(min_value=0, max_value=models.BigIntegerField.MAX_BIGINT, label='Quota (bytes)')
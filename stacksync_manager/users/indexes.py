@@ -0,0 +1,76 @@
+"""Indexes behind the admin search boxes."""
+import logging
+
+from django.db import connections, transaction, DatabaseError, DEFAULT_DB_ALIAS
+
+logger = logging.getLogger(__name__)
+
+TRIGRAM = 'USING gin (UPPER(%(column)s::text) gin_trgm_ops)'
+EXACT = '(UPPER(%(column)s::text))'
+
+
+def get_search_indexes():
+    """(table, column, kind) of every index, kind being TRIGRAM or EXACT"""
+    from oauth.models import Consumer, RequestToken, AccessToken
+    from users.models import StacksyncUser
+
+    user_table = StacksyncUser._meta.db_table
+    return [
+        (user_table, 'name', TRIGRAM),
+        (user_table, 'email', TRIGRAM),
+        (user_table, 'swift_user', TRIGRAM),
+        (user_table, 'swift_account', EXACT),
+        (Consumer._meta.db_table, 'consumer_key', EXACT),
+        (RequestToken._meta.db_table, 'request_token', EXACT),
+        (AccessToken._meta.db_table, 'access_token', EXACT),
+    ]
+
+
+def get_index_name(table, column, kind):
+    return '%s_%s_%s' % (table, column, 'trgm' if kind == TRIGRAM else 'upper')
+
+
+def create_search_indexes(using=DEFAULT_DB_ALIAS):
+    """
+    Creates the search indexes that don't exist yet, only on postgresql.
+    :return list: names of the indexes created
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return []
+
+    cursor = connection.cursor()
+    trigram = create_trigram_extension(connection, cursor)
+    tables = connection.introspection.table_names(cursor)
+    created = []
+    for table, column, kind in get_search_indexes():
+        if table not in tables:
+            # created by a later syncdb step
+            continue
+        if kind == TRIGRAM and not trigram:
+            continue
+        name = get_index_name(table, column, kind)
+        cursor.execute("SELECT 1 FROM pg_class WHERE relname = %s AND relkind = 'i'", [name])
+        if cursor.fetchone():
+            continue
+        quote = connection.ops.quote_name
+        cursor.execute('CREATE INDEX %s ON %s %s' % (quote(name), quote(table), kind % {'column': quote(column)}))
+        logger.info('Created search index %s', name)
+        created.append(name)
+    return created
+
+
+def create_trigram_extension(connection, cursor):
+    """Whether pg_trgm is installed, installing it if the database user may"""
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    if cursor.fetchone():
+        return True
+    try:
+        # A savepoint, so a refusal doesn't break the transaction of syncdb
+        with transaction.atomic(using=connection.alias):
+            cursor.execute('CREATE EXTENSION pg_trgm')
+    except DatabaseError as e:
+        logger.warning('Skipping the trigram search indexes, the pg_trgm extension could not be created '
+                       '(run CREATE EXTENSION pg_trgm as a superuser): %s', e)
+        return False
+    return True
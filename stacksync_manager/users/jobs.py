@@ -0,0 +1,78 @@
+"""Provisioning worker: performs the swift operations queued as ProvisioningJob rows."""
+import logging
+import random
+
+from django.conf import settings
+from django.utils import timezone
+from swiftclient import client as swift
+
+from users.models import ProvisioningJob, get_swift_client
+from users.swift_batch import batch_client
+
+logger = logging.getLogger(__name__)
+
+
+def create_container(job):
+    swift_client = get_swift_client()
+    swift_client.create_container(job.keystone_username, job.swift_url, job.swift_container)
+    if job.quota_limit:
+        swift_client.set_container_quota(job.swift_url, job.swift_container, job.quota_limit)
+
+
+def set_quota(job):
+    get_swift_client().set_container_quota(job.swift_url, job.swift_container, job.quota_limit or 0)
+
+
+def delete_container(job):
+    try:
+        get_swift_client().delete_container(job.swift_url, job.swift_container)
+    except swift.ClientException as e:
+        if e.http_status != 404:
+            raise
+
+
+HANDLERS = {
+    ProvisioningJob.CREATE_CONTAINER: create_container,
+    ProvisioningJob.SET_QUOTA: set_quota,
+    ProvisioningJob.DELETE_CONTAINER: delete_container,
+}
+
+
+def get_backoff(attempts):
+    """Seconds to wait before the next attempt, doubling each time, with jitter"""
+    base = settings.PROVISIONING_RETRY_BACKOFF * 2 ** (attempts - 1)
+    return min(base, settings.PROVISIONING_MAX_BACKOFF) * random.uniform(0.5, 1.0)
+
+
+def process_jobs(batch_size=100, concurrency=None):
+    """
+    Runs one batch of due jobs, on the shared batch pool or on one of
+    concurrency threads.
+    :return int: number of jobs processed
+    """
+    jobs = ProvisioningJob.objects.claim(batch_size, settings.PROVISIONING_LEASE)
+    if not jobs:
+        return 0
+
+    with batch_client(concurrency) as client:
+        results = client.run(lambda job: HANDLERS[job.action](job), [(job,) for job in jobs])
+
+    done = [job.id for job, result in zip(jobs, results) if result.ok]
+    ProvisioningJob.objects.filter(id__in=done, status=ProvisioningJob.RUNNING).update(
+        status=ProvisioningJob.DONE, last_error='')
+
+    for job, result in zip(jobs, results):
+        if result.ok:
+            continue
+        # The attempt was counted when the job was claimed
+        logger.warning('Provisioning job %s failed (attempt %d): %s', job, job.attempts, result.error)
+        if job.attempts >= settings.PROVISIONING_MAX_ATTEMPTS:
+            values = {'status': ProvisioningJob.FAILED}
+        else:
+            values = {'status': ProvisioningJob.PENDING,
+                      'run_after': timezone.now() + timezone.timedelta(seconds=get_backoff(job.attempts))}
+        # Only if it was not queued again while it ran
+        ProvisioningJob.objects.filter(id=job.id, status=ProvisioningJob.RUNNING).update(
+            last_error=unicode(result.error), **values)
+
+    return len(jobs)
@@ -0,0 +1,17 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from users.models import StacksyncUser
+
+
+class Command(BaseCommand):
+    help = 'Stores the keystone user id of existing stacksync users that do not have it yet'
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', type='int', dest='chunk_size', default=1000,
+                    help='Number of users updated per UPDATE statement'),
+    )
+
+    def handle(self, *args, **options):
+        updated = StacksyncUser.objects.backfill_keystone_ids(chunk_size=options['chunk_size'])
+        self.stdout.write('Stored the keystone id of %d users' % updated)
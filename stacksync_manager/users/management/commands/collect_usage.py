@@ -0,0 +1,27 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from users.usage import collect_usage
+
+
+class Command(BaseCommand):
+    help = 'Reads the bytes and objects stored in every workspace container and updates quota_used of their owners'
+    option_list = BaseCommand.option_list + (
+        make_option('--stale-after', type='int', dest='stale_after', default=None,
+                    help='Only revisit workspaces whose usage is older than this many seconds'),
+        make_option('--concurrency', type='int', dest='concurrency', default=None,
+                    help=('Containers read at the same time, on threads of their own '
+                          'instead of the SWIFT_CONCURRENCY shared ones')),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=500,
+                    help='Workspaces read and stored at once'),
+    )
+
+    def handle(self, *args, **options):
+        report = collect_usage(stale_after=options['stale_after'],
+                               concurrency=options['concurrency'],
+                               chunk_size=options['chunk_size'])
+        for swift_container, error in report.failures:
+            self.stderr.write('%s: %s' % (swift_container, error))
+        self.stdout.write('Collected the usage of %d workspaces of %d users in %.1fs, %d failed' % (
+            report.workspaces, report.owners, report.elapsed, len(report.failures)))
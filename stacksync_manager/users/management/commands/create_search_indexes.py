@@ -0,0 +1,20 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from users.indexes import create_search_indexes
+
+
+class Command(BaseCommand):
+    help = 'Creates the indexes used by the admin search on an existing postgresql database'
+    option_list = BaseCommand.option_list + (
+        make_option('--database', dest='database', default=DEFAULT_DB_ALIAS,
+                    help='Database to create the indexes in'),
+    )
+
+    def handle(self, *args, **options):
+        created = create_search_indexes(using=options['database'])
+        self.stdout.write('Created %d search indexes' % len(created))
+        for name in created:
+            self.stdout.write('  %s' % name)
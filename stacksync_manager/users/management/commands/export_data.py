@@ -0,0 +1,49 @@
+import gzip
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from users.replicas import get_read_database
+from users.transfer import export_rows, get_models
+
+
+def open_file(path, mode):
+    """'-' is stdin or stdout, and paths ending in .gz are gzipped"""
+    if path == '-':
+        return sys.stdout if 'w' in mode else sys.stdin
+    return gzip.open(path, mode) if path.endswith('.gz') else open(path, mode)
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = ('Writes the users, workspaces, memberships and OAuth tables to a JSON lines file, '
+            'or to stdout given -, for import_data')
+    option_list = BaseCommand.option_list + (
+        make_option('--model', action='append', dest='models', default=[],
+                    help='Only export this model, e.g. users.stacksyncuser. Can be repeated'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=2000,
+                    help='Rows fetched from the database at once'),
+        make_option('--database', dest='database', default=None,
+                    help='Database to export from, a replica of DATABASE_REPLICAS close enough to the primary '
+                         'by default, or the primary'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Give the file to export to')
+        try:
+            models = get_models(options['models'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        output = open_file(args[0], 'wb')
+        try:
+            report = export_rows(output, models, chunk_size=options['chunk_size'],
+                                 using=options['database'] or get_read_database())
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        for label, rows in sorted(report.rows.items()):
+            self.stderr.write('%s: %d rows' % (label, rows))
+        self.stderr.write('Exported %d rows in %.1fs, %.0f rows/s' % (report.total, report.elapsed,
+                                                                        report.throughput))
@@ -0,0 +1,37 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from users.management.commands.export_data import open_file
+from users.transfer import import_rows
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = ('Inserts the rows of a file written by export_data, or of stdin given -, '
+            'skipping the ones already there. Keystone and swift are not called')
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', type='int', dest='chunk_size', default=2000,
+                    help='Rows inserted per transaction'),
+        make_option('--database', dest='database', default=DEFAULT_DB_ALIAS,
+                    help='Database to import into'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Give the file to import')
+
+        lines = open_file(args[0], 'rb')
+        try:
+            report = import_rows(lines, chunk_size=options['chunk_size'], using=options['database'])
+        except ValueError as e:
+            raise CommandError(e)
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+        for label, rows in sorted(report.rows.items()):
+            self.stdout.write('%s: %d rows' % (label, rows))
+        self.stdout.write('Imported %d rows in %.1fs, %.0f rows/s, skipped %d already there' % (
+            report.total, report.elapsed, report.throughput, report.skipped))
@@ -0,0 +1,59 @@
+import csv
+import json
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.provisioning import provision_users
+
+
+def read_csv(stream):
+    return csv.DictReader(stream)
+
+
+def read_jsonl(stream):
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = ('Creates stacksync users, with their keystone user, default workspace and swift container, '
+            'from a CSV or JSONL file (- for stdin) with name, email, password and quota_limit fields')
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', choices=sorted(READERS.keys()),
+                    help='Format of the input, guessed from the file extension by default'),
+        make_option('--concurrency', type='int', dest='concurrency', default=None,
+                    help=('Keystone and swift calls running at the same time, on threads of their own '
+                          'instead of the SWIFT_CONCURRENCY shared ones')),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=500,
+                    help='Users inserted per bulk insert'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Expected the file to read the users from')
+        path = args[0]
+
+        input_format = options['format'] or path.rsplit('.', 1)[-1]
+        if input_format not in READERS:
+            raise CommandError('Unknown input format %r, use --format' % input_format)
+
+        stream = sys.stdin if path == '-' else open(path, 'rb')
+        try:
+            report = provision_users(READERS[input_format](stream),
+                                     concurrency=options['concurrency'],
+                                     chunk_size=options['chunk_size'])
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for failure in report.failures:
+            self.stderr.write(unicode(failure))
+        self.stdout.write('Provisioned %d users in %.1fs (%.1f users/s), %d containers queued, %d failed' % (
+            len(report.created), report.elapsed, report.throughput, len(report.queued), len(report.failures)))
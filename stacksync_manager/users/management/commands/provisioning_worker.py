@@ -0,0 +1,34 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from users.jobs import process_jobs
+
+
+class Command(BaseCommand):
+    help = 'Performs the queued swift container creations, quota changes and deletions'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=100,
+                    help='Jobs claimed at once'),
+        make_option('--concurrency', type='int', dest='concurrency', default=None,
+                    help=('Swift calls running at the same time, on threads of their own '
+                          'instead of the SWIFT_CONCURRENCY shared ones')),
+        make_option('--poll-interval', type='float', dest='poll_interval', default=2.0,
+                    help='Seconds to wait when there are no jobs due'),
+        make_option('--once', action='store_true', dest='once', default=False,
+                    help='Exit once there are no jobs due instead of waiting for more'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        while True:
+            close_old_connections()
+            processed = process_jobs(batch_size=options['batch_size'], concurrency=options['concurrency'])
+            if processed and verbosity >= 2:
+                self.stdout.write('Processed %d jobs' % processed)
+            if not processed:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
@@ -0,0 +1,43 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from users.reconciliation import reconcile
+
+
+class Command(BaseCommand):
+    help = ('Lists the workspaces without a container, the containers without a workspace and the keystone users '
+            'without a stacksync user, and with --repair fixes them')
+    option_list = BaseCommand.option_list + (
+        make_option('--repair', action='store_true', dest='repair', default=False,
+                    help='Create the missing containers and delete the orphans, instead of only reporting them'),
+        make_option('--concurrency', type='int', dest='concurrency', default=None,
+                    help=('Repairs run at the same time, on threads of their own '
+                          'instead of the SWIFT_CONCURRENCY shared ones')),
+        make_option('--page-size', type='int', dest='page_size', default=1000,
+                    help='Containers and keystone users listed per request'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=500,
+                    help='Findings checked and repaired at once'),
+        make_option('--max-examples', type='int', dest='max_examples', default=100,
+                    help='Findings of each kind shown in the report'),
+        make_option('--grace', type='int', dest='grace', default=None,
+                    help=('Seconds keystone users without a stacksync user are given to get one before being '
+                          'reported, RECONCILE_KEYSTONE_GRACE by default')),
+    )
+
+    def handle(self, *args, **options):
+        report = reconcile(repair=options['repair'], concurrency=options['concurrency'],
+                           page_size=options['page_size'], chunk_size=options['chunk_size'],
+                           max_examples=options['max_examples'], grace=options['grace'])
+        for kind, findings in sorted(report.examples.items()):
+            for finding in findings:
+                self.stdout.write(unicode(finding))
+        for finding, error in report.failures:
+            self.stderr.write(u'could not repair %s: %s' % (finding, error))
+
+        counts = ', '.join('%d %s' % (count, kind) for kind, count in sorted(report.counts.items()))
+        if report.repair:
+            self.stdout.write('Found %s in %.1fs, repaired %d, %d failed' % (
+                counts, report.elapsed, report.repaired, report.failed))
+        else:
+            self.stdout.write('Found %s in %.1fs, nothing repaired (dry run)' % (counts, report.elapsed))
@@ -0,0 +1,39 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+
+from users.models import StacksyncUser
+from users.quotas import set_quota_limit
+
+
+class Command(BaseCommand):
+    args = '<bytes> [<user name> ...]'
+    help = ('Sets the quota of the named stacksync users, or of all of them with --all, and on the containers '
+            'of every workspace they own')
+    option_list = BaseCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+                    help='Change the quota of every stacksync user'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=500,
+                    help='Containers updated at once'),
+        make_option('--attempts', type='int', dest='attempts', default=3,
+                    help='Tries per container before queuing it for the provisioning worker'),
+    )
+
+    def handle(self, *args, **options):
+        if not args or not args[0].isdigit() or (len(args) == 1) != options['all']:
+            raise CommandError('Give the quota in bytes and either user names or --all')
+        if int(args[0]) > models.BigIntegerField.MAX_BIGINT:
+            raise CommandError('The quota can be at most %d bytes' % models.BigIntegerField.MAX_BIGINT)
+        users = StacksyncUser.objects.all() if options['all'] else StacksyncUser.objects.filter(name__in=args[1:])
+
+        def progress(report):
+            self.stdout.write('%d/%d containers, %d queued' % (report.done, report.containers, report.queued))
+
+        report = set_quota_limit(users, int(args[0]), chunk_size=options['chunk_size'],
+                                 attempts=options['attempts'], progress=progress)
+        for (swift_url, swift_container), error in report.failures:
+            self.stderr.write('%s: %s, queued for the provisioning worker' % (swift_container, error))
+        for (swift_url, swift_container), error in report.rejections:
+            self.stderr.write('%s: %s, not retried' % (swift_container, error))
+        self.stdout.write(unicode(report))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from users.placement import get_cluster_loads
+
+
+class Command(BaseCommand):
+    help = ('Shows the workspaces, bytes and objects of every swift cluster, and how far each is from its share '
+            'by weight, from the usage in the database without calling swift')
+
+    def handle(self, *args, **options):
+        for load in get_cluster_loads():
+            self.stdout.write(unicode(load))
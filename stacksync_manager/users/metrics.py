@@ -0,0 +1,198 @@
+"""Timing and counting of the calls made to OpenStack."""
+import bisect
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Upper bounds, in seconds, of the buckets of the call duration histograms
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the buckets of the histogram of OpenStack calls per request
+CALLS_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_hooks = []
+_collectors = []
+_local = threading.local()
+
+
+def add_hook(hook):
+    """hook(service, operation, elapsed, error) is called after every observed call"""
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def add_collector(collector):
+    """collector() returns more lines of metrics, in the prometheus text format, to export with the registry"""
+    _collectors.append(collector)
+
+
+def get_error_label(error):
+    """The http status of the failure if there is one, its class name otherwise"""
+    status = getattr(error, 'http_status', None) or getattr(error, 'code', None)
+    return str(status) if status else type(error).__name__
+
+
+@contextmanager
+def observe(service, operation):
+    calls = getattr(_local, 'calls', None)
+    if not _hooks and calls is None:
+        yield
+        return
+
+    error = None
+    start = time.time()
+    try:
+        yield
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        elapsed = time.time() - start
+        for hook in _hooks:
+            hook(service, operation, elapsed, error)
+        if calls is not None:
+            calls.record(service, operation, elapsed, error)
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class Registry(object):
+    """Call duration histograms and error counts per service and operation"""
+
+    def __init__(self):
+        self.durations = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+        self.errors = defaultdict(int)
+        self.request_calls = Histogram(CALLS_BUCKETS)
+        self._lock = threading.Lock()
+
+    def observe(self, service, operation, elapsed, error):
+        with self._lock:
+            self.durations[service, operation].observe(elapsed)
+            if error is not None:
+                self.errors[service, operation, get_error_label(error)] += 1
+
+    def observe_request(self, calls):
+        with self._lock:
+            self.request_calls.observe(calls.count)
+
+    def clear(self):
+        with self._lock:
+            self.durations.clear()
+            self.errors.clear()
+            self.request_calls = Histogram(CALLS_BUCKETS)
+
+    def render(self):
+        """The metrics in the prometheus text exposition format"""
+        with self._lock:
+            lines = ['# HELP stacksync_openstack_call_duration_seconds Duration of the calls to OpenStack services',
+                     '# TYPE stacksync_openstack_call_duration_seconds histogram']
+            for (service, operation), histogram in sorted(self.durations.items()):
+                labels = 'service="%s",operation="%s"' % (escape(service), escape(operation))
+                for bound, count in histogram.cumulative_counts():
+                    lines.append('stacksync_openstack_call_duration_seconds_bucket{%s,le="%s"} %d' % (
+                        labels, bound, count))
+                lines.append('stacksync_openstack_call_duration_seconds_sum{%s} %f' % (labels, histogram.sum))
+                lines.append('stacksync_openstack_call_duration_seconds_count{%s} %d' % (labels, histogram.count))
+
+            lines += ['# HELP stacksync_openstack_call_errors_total Calls to OpenStack services that failed',
+                      '# TYPE stacksync_openstack_call_errors_total counter']
+            for (service, operation, error), count in sorted(self.errors.items()):
+                lines.append('stacksync_openstack_call_errors_total{service="%s",operation="%s",error="%s"} %d' % (
+                    escape(service), escape(operation), escape(error), count))
+
+            lines += ['# HELP stacksync_request_openstack_calls OpenStack calls made by each request',
+                      '# TYPE stacksync_request_openstack_calls histogram']
+            for bound, count in self.request_calls.cumulative_counts():
+                lines.append('stacksync_request_openstack_calls_bucket{le="%s"} %d' % (bound, count))
+            lines.append('stacksync_request_openstack_calls_sum %d' % self.request_calls.sum)
+            lines.append('stacksync_request_openstack_calls_count %d' % self.request_calls.count)
+        for collector in _collectors:
+            lines += collector()
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RequestCalls(object):
+    """The OpenStack calls made while serving one request"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.count = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self.by_service = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, service, operation, elapsed, error):
+        with self._lock:
+            self.count += 1
+            self.elapsed += elapsed
+            self.by_service[service] += 1
+            if error is not None:
+                self.errors += 1
+
+    def __unicode__(self):
+        services = ', '.join('%s: %d' % item for item in sorted(self.by_service.items()))
+        return u'%d openstack calls in %.3fs (%s), %d failed' % (self.count, self.elapsed, services, self.errors)
+
+
+def start_request():
+    """Starts counting the calls made by this thread, returns their RequestCalls"""
+    _local.calls = RequestCalls()
+    return _local.calls
+
+
+def finish_request():
+    calls = getattr(_local, 'calls', None)
+    _local.calls = None
+    return calls
+
+
+def bind_request(func):
+    """
+    Wraps func so that its calls count for the request of this thread, even
+    when it runs on another thread.
+    """
+    calls = getattr(_local, 'calls', None)
+    if calls is None:
+        return func
+
+    def bound(*args, **kwargs):
+        previous = getattr(_local, 'calls', None)
+        _local.calls = calls
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.calls = previous
+    return bound
+
+
+registry = Registry()
+if getattr(settings, 'OPENSTACK_METRICS', False):
+    add_hook(registry.observe)
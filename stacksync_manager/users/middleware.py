@@ -0,0 +1,52 @@
+import logging
+import time
+
+from django.conf import settings
+
+from users import metrics, replicas
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetricsMiddleware(object):
+    """
+    Counts the OpenStack calls made while serving each request, in
+    request.openstack_calls, and logs the requests slower than
+    SLOW_REQUEST_THRESHOLD seconds with those calls.
+    """
+
+    def process_request(self, request):
+        request.openstack_calls = metrics.start_request()
+
+    def process_response(self, request, response):
+        calls = metrics.finish_request()
+        if calls is None:
+            return response
+
+        if getattr(settings, 'OPENSTACK_METRICS', False):
+            metrics.registry.observe_request(calls)
+        elapsed = time.time() - calls.started_at
+        if elapsed >= settings.SLOW_REQUEST_THRESHOLD:
+            logger.warning(u'Slow request %s %s: %d in %.3fs, %s', request.method, request.get_full_path(),
+                           response.status_code, elapsed, unicode(calls))
+        return response
+
+
+class ReplicaPinningMiddleware(object):
+    """
+    Reads of the requests of a client go to the primary for REPLICA_PIN_SECONDS
+    after one of them wrote, remembered in a cookie, so the client sees its own
+    writes even on a lagging replica.
+    """
+    cookie_name = 'stacksync_primary'
+
+    def process_request(self, request):
+        replicas.reset()
+        if request.COOKIES.get(self.cookie_name):
+            replicas.pin_primary()
+
+    def process_response(self, request, response):
+        if replicas.wrote():
+            response.set_cookie(self.cookie_name, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
+        replicas.reset()
+        return response
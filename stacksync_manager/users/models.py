@@ -1,41 +1,131 @@
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import connection, models, transaction, IntegrityError
+from django.utils import timezone
 from django_pg.models import UUIDField
 from django_pg.models.fields.uuid import UUIDAdapter
-from keystoneclient.v2_0 import client
 from swiftclient import client as swift
 from django.conf import settings
+from users import openstack
+from users.cache import get_container_metadata_cache
+from users.revisions import RevisionCoalescer
+import logging
 import uuid
 
 
+logger = logging.getLogger(__name__)
+
+
 def prefix():
     return str(uuid.uuid4()).split('-')[0]
 
 
+def get_quota_bytes(container_metadata):
+    return int(container_metadata.get('x-container-meta-quota-bytes', 0))
+
+
 class SwiftClient():
-    def __init__(self):
-        self.keystone = client.Client(username=settings.KEYSTONE_ADMIN_USER,
-                                      password=settings.KEYSTONE_ADMIN_PASSWORD,
-                                      tenant_name=settings.KEYSTONE_TENANT,
-                                      auth_url=settings.KEYSTONE_AUTH_URL)
+    """
+    Container operations against swift. Every instance shares the process wide
+    admin token and connection pool kept in users.openstack, and the container
+    metadata cache.
+    """
+
+    @property
+    def keystone(self):
+        return openstack.get_keystone_client()
+
+    @property
+    def metadata_cache(self):
+        return get_container_metadata_cache()
+
+    def get_acl_headers(self, keystone_usernames):
+        """Read and write permissions for the given keystone users of the stacksync tenant"""
+        acl = ','.join(settings.KEYSTONE_TENANT + ':' + name for name in sorted(set(keystone_usernames)))
+        return {'x-container-read': acl, 'x-container-write': acl}
 
     def create_container(self, keystone_username=None, swift_url=None, swift_container=None):
         """creates the container in swift with read and write permissions"""
-        user_and_tenant = settings.KEYSTONE_TENANT + ':' + keystone_username
-        headers = {'x-container-read': user_and_tenant, 'x-container-write': user_and_tenant}
-        swift.put_container(swift_url, self.keystone.get_token('id'), swift_container,
-                            headers=headers)
+        headers = self.get_acl_headers([keystone_username])
+        openstack.call_swift(swift.put_container, swift_url, swift_container, headers=headers)
+        self.metadata_cache.delete((swift_url, swift_container))
+
+    def set_container_acl(self, swift_url, swift_container, keystone_usernames):
+        """Replaces who can read and write the container, in a single request"""
+        headers = self.get_acl_headers(keystone_usernames)
+        try:
+            openstack.call_swift(swift.post_container, swift_url, swift_container, headers=headers)
+        finally:
+            self.metadata_cache.delete((swift_url, swift_container))
 
     def delete_container(self, swift_url=None, swift_container=None):
-        swift.delete_container(swift_url, self.keystone.get_token('id'), swift_container)
+        try:
+            openstack.call_swift(swift.delete_container, swift_url, swift_container)
+        finally:
+            self.metadata_cache.delete((swift_url, swift_container))
 
-    def get_container_metadata(self, swift_url, swift_container):
-        return swift.head_container(swift_url, self.keystone.get_token('id'), swift_container)
+    def get_container_metadata(self, swift_url, swift_container, use_cache=True):
+        """
+        Returns the container headers, from the cache unless use_cache is False.
+        Either way the cache is refreshed when swift is asked.
+        """
+        key = (swift_url, swift_container)
+        if use_cache:
+            metadata = self.metadata_cache.get(key)
+            if metadata is not None:
+                return metadata
+        metadata = openstack.call_swift(swift.head_container, swift_url, swift_container)
+        self.metadata_cache.set(key, metadata)
+        return metadata
 
     def set_container_quota(self, swift_url=None, swift_container=None, quota_limit=0):
         """sets the physical quota limit on the container"""
         headers = {'X-Container-Meta-Quota-Bytes': quota_limit}
-        swift.post_container(swift_url, self.keystone.get_token('id'), swift_container, headers=headers)
+        try:
+            openstack.call_swift(swift.post_container, swift_url, swift_container, headers=headers)
+        finally:
+            self.metadata_cache.delete((swift_url, swift_container))
+
+
+_swift_client = None
+
+
+def get_swift_client():
+    """The SwiftClient shared by the whole process, created on first use"""
+    global _swift_client
+    if _swift_client is None:
+        _swift_client = SwiftClient()
+    return _swift_client
+
+
+class StacksyncUserManager(models.Manager):
+
+    def backfill_keystone_ids(self, chunk_size=1000):
+        """
+        Stores the keystone id of every user that doesn't have it yet, using a
+        single keystone listing and one UPDATE per chunk of users.
+        :return int: number of users updated
+        """
+        keystone_ids = dict((user.name, user.id) for user in openstack.get_keystone_client().users.list())
+        swift_users = [name for name in self.filter(keystone_id__isnull=True).values_list('swift_user', flat=True)
+                       if name in keystone_ids]
+
+        updated = 0
+        for start in range(0, len(swift_users), chunk_size):
+            chunk = swift_users[start:start + chunk_size]
+            updated += self._update_keystone_ids(dict((name, keystone_ids[name]) for name in chunk))
+        return updated
+
+    def _update_keystone_ids(self, keystone_ids):
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        cases = ' '.join(['WHEN %s THEN %s'] * len(keystone_ids))
+        params = [value for item in keystone_ids.items() for value in item]
+        placeholders = ', '.join(['%s'] * len(keystone_ids))
+        sql = ('UPDATE %s SET keystone_id = CASE swift_user %s END '
+               'WHERE keystone_id IS NULL AND swift_user IN (%s)' % (table, cases, placeholders))
+        with transaction.atomic():
+            cursor = connection.cursor()
+            cursor.execute(sql, params + list(keystone_ids.keys()))
+            return cursor.rowcount
 
 
 class StacksyncUser(models.Model):
@@ -44,30 +134,28 @@ class StacksyncUser(models.Model):
     email = models.CharField(max_length=100)
     swift_user = models.CharField(max_length=100, unique=True)
     swift_account = models.CharField(max_length=100)
-    quota_limit = models.IntegerField(default=0)
-    quota_used = models.IntegerField(default=0)
+    quota_limit = models.BigIntegerField(default=0)
+    quota_used = models.BigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
-    # objects = StacksyncUserManager()
+    keystone_id = models.CharField(max_length=64, null=True, editable=False)
+
+    objects = StacksyncUserManager()
 
     class Meta:
         db_table = settings.USER_TABLE
 
     def __init__(self, *args, **kwargs):
-
-        self.keystone = client.Client(username=settings.KEYSTONE_ADMIN_USER,
-                                      password=settings.KEYSTONE_ADMIN_PASSWORD,
-                                      tenant_name=settings.KEYSTONE_TENANT,
-                                      auth_url=settings.KEYSTONE_AUTH_URL)
-
-        self.keystone = kwargs.pop('keystone', self.keystone)
-
-        self.stacksync_tenant = self.get_keystone_tenant()
+        # Rows loaded by a queryset go through here too, so nothing in this
+        # method may talk to keystone.
+        self.keystone = kwargs.pop('keystone', None)
+        self.stacksync_tenant = None
         super(StacksyncUser, self).__init__(*args, **kwargs)
-        self.swift_account = 'AUTH_' + self.stacksync_tenant.id
 
     @property
     def keystone(self):
-        """Get the keystone client"""
+        """Get the keystone client, the process wide one unless another was given"""
+        if self._keystone_client is None:
+            return openstack.get_keystone_client()
         return self._keystone_client
 
     @keystone.setter
@@ -76,6 +164,8 @@ class StacksyncUser(models.Model):
 
     @property
     def stacksync_tenant(self):
+        if self._stacksync_tenant is None:
+            self._stacksync_tenant = self.get_keystone_tenant()
         return self._stacksync_tenant
 
     @stacksync_tenant.setter
@@ -85,16 +175,20 @@ class StacksyncUser(models.Model):
     def create_new_keystone_user(self, keystone_password):
         keystone_username = settings.KEYSTONE_TENANT + '_' + prefix() + '_' + self.name
         self.swift_user = keystone_username
-        self.keystone.users.create(name=keystone_username, password=keystone_password,
-                                   tenant_id=self.stacksync_tenant.id)
+        keystone_user = self.keystone.users.create(name=keystone_username, password=keystone_password,
+                                                   tenant_id=self.stacksync_tenant.id)
+        self.keystone_id = keystone_user.id
         return keystone_username
 
     def update_keystone_fields(self, keystone_password):
-        self.keystone.users.update_password(self.get_keystone_user(), keystone_password)
+        self.keystone.users.update_password(self.get_keystone_user_id(), keystone_password)
 
     def save(self, *args, **kwargs):
         keystone_password = kwargs.pop('password', 'testpass')
 
+        if not self.swift_account:
+            self.swift_account = 'AUTH_' + self.stacksync_tenant.id
+
         if not self.pk:
             self.create_new_keystone_user(keystone_password)
         else:
@@ -103,9 +197,10 @@ class StacksyncUser(models.Model):
         super(StacksyncUser, self).save(*args, **kwargs)
 
     def delete(self, using=None):
-        keystone_user = self.get_keystone_user()
-        if keystone_user:
-            keystone_user.delete()
+        keystone_user_id = self.get_keystone_user_id()
+        if keystone_user_id:
+            self.keystone.users.delete(keystone_user_id)
+            openstack.keystone_users.discard(self.swift_user)
         workspaces = self.get_workspaces()
         for workspace in workspaces:
             workspace.delete()
@@ -115,13 +210,35 @@ class StacksyncUser(models.Model):
     def __unicode__(self):
         return self.email
 
+    def get_keystone_user_id(self):
+        """
+        The id of the keystone user behind swift_user. Users stored before the id
+        was kept are resolved by name once, and the id saved for next time.
+        """
+        if self.keystone_id:
+            return self.keystone_id
+
+        if self._keystone_client is None:
+            keystone_id = openstack.keystone_users.get(self.swift_user)
+        else:
+            keystone_users = self._keystone_client.users.list()
+            keystone_id = next((user.id for user in keystone_users if user.name == self.swift_user), None)
+
+        if keystone_id and self.pk:
+            StacksyncUser.objects.filter(pk=self.pk).update(keystone_id=keystone_id)
+        self.keystone_id = keystone_id
+        return keystone_id
+
     def get_keystone_user(self):
-        keystone_users = self.keystone.users.list()
-        return next((user for user in keystone_users if user.name == self.swift_user), None)
+        keystone_user_id = self.get_keystone_user_id()
+        if keystone_user_id:
+            return self.keystone.users.get(keystone_user_id)
+        return None
 
     def get_keystone_tenant(self):
-        tenants = self.keystone.tenants.list()
-        return next((x for x in tenants if x.name == settings.KEYSTONE_TENANT), None)
+        if self._keystone_client is None:
+            return openstack.get_stacksync_tenant()
+        return openstack.find_stacksync_tenant(self._keystone_client)
 
     def get_workspaces(self):
         return list(StacksyncWorkspace.objects.filter(owner=self))
@@ -132,9 +249,9 @@ class StacksyncUser(models.Model):
 
 class StacksyncWorkspaceManager(models.Manager):
 
-    def __init__(self):
-        self.swift_client = SwiftClient()
-        super(StacksyncWorkspaceManager, self).__init__()
+    @property
+    def swift_client(self):
+        return get_swift_client()
 
     def setup_swift_container(self, stacksync_user, workspace):
         self.swift_client.create_container(stacksync_user.swift_user, workspace.swift_url, workspace.swift_container)
@@ -144,19 +261,95 @@ class StacksyncWorkspaceManager(models.Manager):
                                                   workspace.swift_container,
                                                   stacksync_user.quota_limit)
 
-    def create_workspace(self, stacksync_user):
+    def new_workspace(self, stacksync_user):
+        """Builds, without saving it, a new workspace owned by the user, on the swift cluster placement chooses"""
+        from users.placement import choose_endpoint
 
-        swift_url = settings.SWIFT_URL + '/' + stacksync_user.swift_account
+        swift_url = choose_endpoint(stacksync_user) + '/' + stacksync_user.swift_account
         swift_container = settings.KEYSTONE_TENANT + '_' + prefix() + '_' + stacksync_user.name
 
-        workspace = self.create(owner=stacksync_user,
-                                swift_container=swift_container,
-                                swift_url=swift_url,
-                                is_shared=False)
+        return self.model(id=uuid.uuid4(),
+                          owner=stacksync_user,
+                          swift_container=swift_container,
+                          swift_url=swift_url,
+                          is_shared=False)
+
+    def get_physical_quotas(self, workspaces):
+        """
+        Gets the quota limit in bytes of the containers of many workspaces, asking
+        swift concurrently only for the ones missing from the metadata cache.
+        :return dict: workspace id -> quota, None for the ones swift failed to answer
+        """
+        from users.swift_batch import get_swift_batch_client
+
+        cache = self.swift_client.metadata_cache
+        metadata = {}
+        misses = []
+        for workspace in workspaces:
+            cached = cache.get((workspace.swift_url, workspace.swift_container))
+            if cached is None:
+                misses.append(workspace)
+            else:
+                metadata[workspace.id] = cached
+
+        results = get_swift_batch_client().get_containers_metadata(
+            [(workspace.swift_url, workspace.swift_container) for workspace in misses])
+        for workspace, result in zip(misses, results):
+            if result.ok:
+                metadata[workspace.id] = result.value
+            else:
+                logger.warning('Could not read the quota of workspace %s: %s', workspace.id, result.error)
+                metadata[workspace.id] = None
+
+        return dict((workspace_id, get_quota_bytes(headers) if headers is not None else None)
+                    for workspace_id, headers in metadata.items())
+
+    def increment_revision(self, workspace_id, count=1, coalesce=None):
+        """
+        Adds count to the latest_revision of the workspace with a single UPDATE,
+        safe against concurrent commits, and returns the new value. With
+        coalesce, WORKSPACE_REVISION_COALESCING by default, the increments made
+        by the threads of this process at the same time share one UPDATE; not
+        inside a transaction, which would then hold the others' revisions too.
+        """
+        if coalesce is None:
+            coalesce = getattr(settings, 'WORKSPACE_REVISION_COALESCING', False)
+        if coalesce and count == 1 and not connection.in_atomic_block:
+            return revision_coalescer.increment(workspace_id)
+        return self._add_to_revision(workspace_id, count)
+
+    def _add_to_revision(self, workspace_id, count):
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                cursor = connection.cursor()
+                cursor.execute('UPDATE {workspace} SET latest_revision = latest_revision + %s WHERE id = %s '
+                               'RETURNING latest_revision'.format(
+                                   workspace=connection.ops.quote_name(self.model._meta.db_table)),
+                               [count, str(workspace_id)])
+                row = cursor.fetchone()
+            else:
+                # The row stays locked by the update until the read
+                workspaces = self.filter(pk=workspace_id)
+                updated = workspaces.update(latest_revision=models.F('latest_revision') + count)
+                row = workspaces.values_list('latest_revision').first() if updated else None
+        if row is None:
+            raise self.model.DoesNotExist('No workspace %s' % workspace_id)
+        return row[0]
+
+    def create_workspace(self, stacksync_user):
+
+        workspace = self.new_workspace(stacksync_user)
+        workspace.save(force_insert=True, using=self.db)
 
         membership = StacksyncMembership.objects.create(user=stacksync_user, workspace=workspace, name='default')
 
-        self.setup_swift_container(stacksync_user, workspace)
+        if settings.PROVISIONING_QUEUE:
+            ProvisioningJob.objects.enqueue(ProvisioningJob.CREATE_CONTAINER, workspace.swift_url,
+                                            workspace.swift_container,
+                                            keystone_username=stacksync_user.swift_user,
+                                            quota_limit=stacksync_user.quota_limit)
+        else:
+            self.setup_swift_container(stacksync_user, workspace)
 
         return workspace
 
@@ -174,7 +367,6 @@ class StacksyncWorkspace(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     objects = StacksyncWorkspaceManager()
-    swift_client = SwiftClient()
 
     class Meta:
         db_table = settings.WORKSPACE_TABLE
@@ -182,20 +374,35 @@ class StacksyncWorkspace(models.Model):
     def __unicode__(self):
         return UUIDAdapter(self.id).getquoted()
 
+    @property
+    def swift_client(self):
+        return get_swift_client()
+
     def delete(self, using=None):
-        self.swift_client.delete_container(self.swift_url, self.swift_container)
+        if settings.PROVISIONING_QUEUE:
+            ProvisioningJob.objects.enqueue(ProvisioningJob.DELETE_CONTAINER, self.swift_url, self.swift_container)
+        else:
+            self.swift_client.delete_container(self.swift_url, self.swift_container)
         super(StacksyncWorkspace, self).delete()
 
     def get_container_metadata(self):
         return self.swift_client.get_container_metadata(self.swift_url, self.swift_container)
 
+    def increment_revision(self):
+        """Moves the workspace to its next revision, see StacksyncWorkspaceManager.increment_revision"""
+        self.latest_revision = StacksyncWorkspace.objects.increment_revision(self.id)
+        return self.latest_revision
+
     def get_physical_quota(self):
         """
         Gets quota limit of container in bytes
         :return int:
         """
-        container_metadata = self.get_container_metadata()
-        return int(container_metadata.get('x-container-meta-quota-bytes', 0))
+        return get_quota_bytes(self.get_container_metadata())
+
+
+revision_coalescer = RevisionCoalescer(lambda workspace_id, count: StacksyncWorkspace.objects._add_to_revision(
+    workspace_id, count))
 
 
 class StacksyncMembership(models.Model):
@@ -209,4 +416,151 @@ class StacksyncMembership(models.Model):
 
     class Meta:
         db_table = settings.MEMBERSHIP_TABLE
-        unique_together = (("user", "workspace"),)
\ No newline at end of file
+        unique_together = (("user", "workspace"),)
+        # Pages of the workspaces of a user, see users.views.workspaces
+        index_together = (("user", "created_at"),)
+
+
+class WorkspaceUsageManager(models.Manager):
+
+    def totals_by_owner(self):
+        """Bytes and objects stored by each owner, summed over their workspaces"""
+        return (self.values('workspace__owner')
+                .annotate(bytes_used=models.Sum('bytes_used'), object_count=models.Sum('object_count')))
+
+    def update_owners_quota_used(self, owner_ids):
+        """Sets quota_used of the given users to the bytes stored in the workspaces they own"""
+        if not owner_ids:
+            return 0
+        qn = connection.ops.quote_name
+        sql = ('UPDATE {user} SET quota_used = COALESCE(('
+               'SELECT SUM(u.bytes_used) FROM {usage} u JOIN {workspace} w ON w.id = u.workspace_id '
+               'WHERE w.owner_id = {user}.id), 0) '
+               'WHERE {user}.id IN ({placeholders})').format(
+            user=qn(StacksyncUser._meta.db_table),
+            usage=qn(self.model._meta.db_table),
+            workspace=qn(StacksyncWorkspace._meta.db_table),
+            placeholders=', '.join(['%s'] * len(owner_ids)))
+        with transaction.atomic():
+            cursor = connection.cursor()
+            cursor.execute(sql, [str(owner_id) for owner_id in owner_ids])
+            return cursor.rowcount
+
+
+class WorkspaceUsage(models.Model):
+    """Bytes and objects in the swift container of a workspace, as of updated_at"""
+    workspace = models.OneToOneField(StacksyncWorkspace, primary_key=True, related_name='usage')
+    bytes_used = models.BigIntegerField(default=0)
+    object_count = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(db_index=True)
+
+    objects = WorkspaceUsageManager()
+
+    class Meta:
+        db_table = 'workspace_usage'
+
+
+class ProvisioningJobManager(models.Manager):
+
+    def enqueue(self, action, swift_url, swift_container, **fields):
+        """
+        Queues a swift operation on a container for the provisioning worker.
+
+        There is at most one job per action and container, its idempotency key.
+        Queuing it again updates and re-arms the existing job instead of adding
+        another one. A running job runs again once its lease is over, so that no
+        other worker takes it meanwhile. Deleting a container cancels its pending
+        setup.
+        """
+        key = '%s:%s/%s' % (action, swift_url, swift_container)
+        values = dict(fields, action=action, swift_url=swift_url, swift_container=swift_container,
+                      status=ProvisioningJob.PENDING, attempts=0, last_error='')
+
+        if action == ProvisioningJob.DELETE_CONTAINER:
+            self.filter(swift_url=swift_url, swift_container=swift_container,
+                        status=ProvisioningJob.PENDING).exclude(action=action).delete()
+
+        if self._rearm(key, values):
+            return
+        try:
+            with transaction.atomic():
+                self.create(idempotency_key=key, run_after=timezone.now(), **values)
+        except IntegrityError:
+            # Queued by someone else in the meantime
+            self._rearm(key, values)
+
+    def _rearm(self, key, values):
+        jobs = self.filter(idempotency_key=key)
+        if jobs.exclude(status=ProvisioningJob.RUNNING).update(run_after=timezone.now(), **values):
+            return True
+        # run_after of a running job is the end of its lease
+        return bool(jobs.filter(status=ProvisioningJob.RUNNING).update(**values))
+
+    def claim(self, batch_size, lease):
+        """
+        Marks up to batch_size due jobs as running for lease seconds and returns them.
+        Claiming a job counts an attempt. Running jobs whose lease is over,
+        because their worker died, are due again unless that was their last attempt.
+        Jobs of a container run one at a time: a container with a job still
+        running is skipped, and a batch has at most one job per container.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            self.filter(status=ProvisioningJob.RUNNING, run_after__lte=now,
+                        attempts__gte=settings.PROVISIONING_MAX_ATTEMPTS).update(
+                status=ProvisioningJob.FAILED, last_error='Lease of the last attempt expired')
+            candidates = (self.select_for_update()
+                          .filter(status__in=[ProvisioningJob.PENDING, ProvisioningJob.RUNNING], run_after__lte=now)
+                          .order_by('run_after', 'id')[:batch_size])
+            taken = set(self.filter(status=ProvisioningJob.RUNNING, run_after__gt=now)
+                        .values_list('swift_url', 'swift_container'))
+            jobs = []
+            for job in candidates:
+                if (job.swift_url, job.swift_container) not in taken:
+                    taken.add((job.swift_url, job.swift_container))
+                    jobs.append(job)
+            self.filter(id__in=[job.id for job in jobs]).update(
+                status=ProvisioningJob.RUNNING, run_after=now + timezone.timedelta(seconds=lease),
+                attempts=models.F('attempts') + 1)
+        for job in jobs:
+            job.attempts += 1
+        return jobs
+
+
+class ProvisioningJob(models.Model):
+    """A swift operation that the provisioning worker performs out of band"""
+    CREATE_CONTAINER = 'create_container'
+    SET_QUOTA = 'set_quota'
+    DELETE_CONTAINER = 'delete_container'
+    ACTIONS = ((CREATE_CONTAINER, 'Create container'),
+               (SET_QUOTA, 'Set container quota'),
+               (DELETE_CONTAINER, 'Delete container'))
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = ((PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed'))
+
+    id = models.AutoField(primary_key=True)
+    idempotency_key = models.CharField(max_length=350, unique=True)
+    action = models.CharField(max_length=20, choices=ACTIONS)
+    swift_url = models.CharField(max_length=250)
+    swift_container = models.CharField(max_length=45)
+    keystone_username = models.CharField(max_length=100, blank=True)
+    quota_limit = models.BigIntegerField(null=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    modified_at = models.DateTimeField(auto_now=True)
+
+    objects = ProvisioningJobManager()
+
+    class Meta:
+        db_table = 'provisioning_job'
+        index_together = (('status', 'run_after'),)
+
+    def __unicode__(self):
+        return u'%s %s' % (self.action, self.swift_container)
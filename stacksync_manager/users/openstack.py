@@ -0,0 +1,280 @@
+"""Process wide access to the OpenStack services used by the user manager."""
+import calendar
+import re
+import threading
+import time
+import urlparse
+from contextlib import contextmanager
+
+from django.conf import settings
+from keystoneclient.v2_0 import client
+from swiftclient import client as swift
+
+from users import metrics, resilience
+from users.cache import TTLCache, get_container_metadata_cache
+
+_lock = threading.Lock()
+_keystone_client = None
+_tenant_cache = TTLCache(getattr(settings, 'KEYSTONE_CACHE_TTL', 300))
+
+
+# Swift operations that can be repeated without changing their outcome
+IDEMPOTENT_SWIFT_OPERATIONS = frozenset(['head_container', 'delete_container', 'post_container',
+                                         'get_account', 'get_container'])
+IDEMPOTENT_KEYSTONE_METHODS = frozenset(['GET', 'HEAD'])
+
+
+def get_keystone_endpoint():
+    return resilience.get_endpoint('keystone', settings.KEYSTONE_AUTH_URL)
+
+
+def new_keystone_client():
+    endpoint = get_keystone_endpoint()
+
+    # The client authenticates as it is built
+    def build():
+        with metrics.observe('keystone', 'authenticate'):
+            return client.Client(username=settings.KEYSTONE_ADMIN_USER,
+                                 password=settings.KEYSTONE_ADMIN_PASSWORD,
+                                 tenant_name=settings.KEYSTONE_TENANT,
+                                 auth_url=settings.KEYSTONE_AUTH_URL,
+                                 timeout=endpoint.timeout)
+    return instrument_keystone_client(endpoint.call(build, idempotent=True))
+
+
+_keystone_ids = re.compile(r'(/(?:users|tenants|roles)/)[^/?]+')
+
+
+def get_keystone_operation(method, url):
+    """Method and path of a keystone request, with ids and query left out, e.g. 'GET /users/{id}'"""
+    path = _keystone_ids.sub(r'\1{id}', url.split('?', 1)[0])
+    return '%s %s' % (method, path)
+
+
+def instrument_keystone_client(keystone):
+    """
+    Observes every request the keystone client sends, and sends it through its
+    endpoint. Requests sent while authenticating are already observed and
+    guarded as part of the authentication.
+    """
+    request = keystone.request
+    endpoint = get_keystone_endpoint()
+
+    def observed_request(url, method, **kwargs):
+        if endpoint.in_call:
+            return request(url, method, **kwargs)
+
+        def call():
+            with metrics.observe('keystone', get_keystone_operation(method, url)):
+                return request(url, method, **kwargs)
+        return endpoint.call(call, idempotent=method in IDEMPOTENT_KEYSTONE_METHODS)
+    keystone.request = observed_request
+    return keystone
+
+
+def get_keystone_client():
+    """Returns the keystone admin client shared by the whole process"""
+    global _keystone_client
+    if _keystone_client is None:
+        with _lock:
+            if _keystone_client is None:
+                _keystone_client = new_keystone_client()
+    return _keystone_client
+
+
+def find_stacksync_tenant(keystone):
+    tenants = keystone.tenants.list()
+    return next((x for x in tenants if x.name == settings.KEYSTONE_TENANT), None)
+
+
+def get_stacksync_tenant():
+    """Returns the stacksync tenant, looked up at most once per KEYSTONE_CACHE_TTL"""
+    return _tenant_cache.get_or_set(settings.KEYSTONE_TENANT,
+                                    lambda: find_stacksync_tenant(get_keystone_client()))
+
+
+def get_swift_account():
+    return 'AUTH_' + get_stacksync_tenant().id
+
+
+class KeystoneUserIndex(object):
+    """
+    Keystone user name -> id, built from a single users.list() call.
+
+    A name missing from the index triggers a rebuild, but no more often than
+    every min_rebuild_interval seconds so unknown names can't hammer keystone.
+    """
+
+    def __init__(self, ttl, min_rebuild_interval=5):
+        self.ttl = ttl
+        self.min_rebuild_interval = min_rebuild_interval
+        self._ids = {}
+        self._built_at = 0
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            age = time.time() - self._built_at
+            if age >= self.ttl or (name not in self._ids and age >= self.min_rebuild_interval):
+                self._ids = dict((user.name, user.id) for user in get_keystone_client().users.list())
+                self._built_at = time.time()
+            return self._ids.get(name)
+
+    def add(self, name, user_id):
+        with self._lock:
+            self._ids[name] = user_id
+
+    def discard(self, name):
+        with self._lock:
+            self._ids.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._ids = {}
+            self._built_at = 0
+
+
+keystone_users = KeystoneUserIndex(getattr(settings, 'KEYSTONE_CACHE_TTL', 300))
+
+
+class TokenCache(object):
+    """
+    Keystone admin token shared by every swift call in the process.
+
+    The token is renewed refresh_margin seconds before keystone says it expires,
+    or as soon as somebody reports it was rejected.
+    """
+
+    def __init__(self, refresh_margin):
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._last_token = None
+        self._refresh_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._token is None or time.time() >= self._refresh_at:
+                self._authenticate()
+            return self._token
+
+    def invalidate(self, token):
+        """Drops the rejected token, unless another thread already replaced it"""
+        with self._lock:
+            if token == self._token:
+                self._token = None
+
+    def clear(self):
+        with self._lock:
+            self._token = self._last_token = None
+
+    def _authenticate(self):
+        auth_ref = get_keystone_client().auth_ref
+        # The shared client keeps the token it got when it was built, which is
+        # fine to start with, but never hand out again a token we already
+        # dropped. A new token comes from a client of its own, the shared one
+        # being in use by other threads.
+        if (auth_ref is None or auth_ref.auth_token == self._last_token or
+                time.time() >= self._get_refresh_time(auth_ref)):
+            auth_ref = new_keystone_client().auth_ref
+        self._token = self._last_token = auth_ref.auth_token
+        self._refresh_at = self._get_refresh_time(auth_ref)
+
+    def _get_refresh_time(self, auth_ref):
+        # keystone expiry times are in UTC, naive or not
+        return calendar.timegm(auth_ref.expires.utctimetuple()) - self.refresh_margin
+
+
+class ConnectionPool(object):
+    """
+    Idle swift connections kept per endpoint (scheme and host:port), so
+    consecutive requests to a proxy reuse their sockets instead of opening a new
+    one each time, whatever account they are for. New connections get the
+    timeout of their endpoint.
+    """
+
+    def __init__(self, max_idle):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self, url):
+        http_conn = self._checkout(url)
+        try:
+            yield http_conn
+        except swift.ClientException:
+            # The proxy answered, the connection is still good.
+            self._checkin(url, http_conn)
+            raise
+        else:
+            self._checkin(url, http_conn)
+
+    def get_endpoint(self, url):
+        parsed = urlparse.urlparse(url)
+        return '%s://%s' % (parsed.scheme, parsed.netloc)
+
+    def _checkout(self, url):
+        """(parsed url, connection) as swiftclient takes them, the path being the one of url"""
+        with self._lock:
+            idle = self._idle.get(self.get_endpoint(url))
+            if idle:
+                return urlparse.urlparse(url), idle.pop()
+        http_conn = swift.http_connection(url)
+        timeout = resilience.get_endpoint('swift', url).timeout
+        if timeout is not None:
+            http_conn[1].requests_args['timeout'] = timeout
+        return http_conn
+
+    def _checkin(self, url, http_conn):
+        with self._lock:
+            idle = self._idle.setdefault(self.get_endpoint(url), [])
+            if len(idle) < self.max_idle:
+                idle.append(http_conn[1])
+
+    def clear(self):
+        with self._lock:
+            self._idle.clear()
+
+
+token_cache = TokenCache(getattr(settings, 'KEYSTONE_TOKEN_REFRESH_MARGIN', 60))
+swift_connections = ConnectionPool(getattr(settings, 'SWIFT_MAX_IDLE_CONNECTIONS', 10))
+
+
+def call_swift(operation, swift_url, *args, **kwargs):
+    """
+    Runs a swiftclient operation with the shared token on a pooled connection,
+    through the endpoint of swift_url. If swift rejects the token it is renewed
+    and the operation tried once more.
+    """
+    name = getattr(operation, '__name__', 'swift')
+    endpoint = resilience.get_endpoint('swift', swift_url)
+    idempotent = name in IDEMPOTENT_SWIFT_OPERATIONS
+
+    def call(token):
+        with swift_connections.connection(swift_url) as http_conn:
+            with metrics.observe('swift', name):
+                return operation(swift_url, token, *args, http_conn=http_conn, **kwargs)
+
+    token = token_cache.get()
+    try:
+        return endpoint.call(lambda: call(token), idempotent)
+    except swift.ClientException as e:
+        if e.http_status != 401:
+            raise
+    token_cache.invalidate(token)
+    token = token_cache.get()
+    return endpoint.call(lambda: call(token), idempotent)
+
+
+def reset():
+    """Forgets the shared client, every cached lookup and the state of the endpoints"""
+    global _keystone_client
+    with _lock:
+        _keystone_client = None
+    _tenant_cache.clear()
+    keystone_users.clear()
+    token_cache.clear()
+    swift_connections.clear()
+    get_container_metadata_cache().clear()
+    resilience.endpoints.clear()
@@ -0,0 +1,221 @@
+"""Places new workspaces on one of the swift clusters of SWIFT_ENDPOINTS."""
+import bisect
+import hashlib
+import threading
+import time
+import urlparse
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Count, Sum
+from django.utils.module_loading import import_by_path
+
+from users.models import StacksyncWorkspace
+
+
+DEFAULT_PORTS = {'http': ':80', 'https': ':443'}
+
+
+def normalize_url(url):
+    """The url with its scheme and host in lower case, without default port nor trailing slash"""
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url.strip())
+    scheme, netloc = scheme.lower(), netloc.lower()
+    if netloc.endswith(DEFAULT_PORTS.get(scheme, '/')):
+        netloc = netloc[:-len(DEFAULT_PORTS[scheme])]
+    return urlparse.urlunsplit((scheme, netloc, path.rstrip('/'), query, ''))
+
+
+class SwiftEndpoint(object):
+
+    def __init__(self, url, weight=1):
+        self.url = normalize_url(url)
+        self.weight = weight
+
+    def __eq__(self, other):
+        return isinstance(other, SwiftEndpoint) and (self.url, self.weight) == (other.url, other.weight)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.url, self.weight))
+
+    def __repr__(self):
+        return 'SwiftEndpoint(%r, %r)' % (self.url, self.weight)
+
+
+def get_endpoints():
+    """The swift clusters new workspaces may go to"""
+    endpoints = getattr(settings, 'SWIFT_ENDPOINTS', None)
+    if not endpoints:
+        return [SwiftEndpoint(settings.SWIFT_URL)]
+    return [SwiftEndpoint(endpoint['URL'], endpoint.get('WEIGHT', 1)) for endpoint in endpoints]
+
+
+def get_endpoint_url(swift_url):
+    """The cluster of the storage url of a workspace, its url without the account"""
+    return normalize_url(swift_url).rsplit('/', 1)[0]
+
+
+def get_bytes_by_endpoint():
+    """endpoint url -> (workspaces, bytes used, objects stored) from the usage in the database"""
+    totals = {}
+    for row in (StacksyncWorkspace.objects.order_by().values('swift_url')
+                .annotate(workspaces=Count('id'), bytes_used=Sum('usage__bytes_used'),
+                          object_count=Sum('usage__object_count'))):
+        workspaces, bytes_used, object_count = totals.get(get_endpoint_url(row['swift_url']), (0, 0, 0))
+        totals[get_endpoint_url(row['swift_url'])] = (workspaces + row['workspaces'],
+                                                      bytes_used + (row['bytes_used'] or 0),
+                                                      object_count + (row['object_count'] or 0))
+    return totals
+
+
+class LeastUsedPlacement(object):
+    """
+    The endpoint with the fewest bytes used per unit of weight, endpoints of
+    weight 0 taking no new workspaces. The totals are read again at most every
+    SWIFT_PLACEMENT_USAGE_TTL seconds, and until then every workspace placed
+    counts as one of average size on its endpoint, so they don't all go to
+    the same one.
+    """
+
+    def __init__(self):
+        self.ttl = getattr(settings, 'SWIFT_PLACEMENT_USAGE_TTL', 60)
+        self._bytes_used = None
+        self._workspace_bytes = 1.0
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def choose(self, owner, endpoints):
+        candidates = [endpoint for endpoint in endpoints if endpoint.weight > 0]
+        if not candidates:
+            raise ImproperlyConfigured('No swift endpoint has a weight above 0')
+        with self._lock:
+            if self._bytes_used is None or time.time() >= self._loaded_at + self.ttl:
+                self._load()
+            chosen = min(candidates, key=lambda endpoint: (
+                self._bytes_used.get(endpoint.url, 0) / endpoint.weight, candidates.index(endpoint)))
+            self._bytes_used[chosen.url] = self._bytes_used.get(chosen.url, 0) + self._workspace_bytes
+        return chosen
+
+    def _load(self):
+        totals = get_bytes_by_endpoint()
+        self._bytes_used = dict((url, float(bytes_used)) for url, (workspaces, bytes_used, objects) in totals.items())
+        workspaces = sum(workspaces for workspaces, bytes_used, objects in totals.values())
+        # At least a byte, for empty clusters to fill in turn too
+        self._workspace_bytes = max(sum(self._bytes_used.values()) / workspaces if workspaces else 0, 1.0)
+        self._loaded_at = time.time()
+
+
+class ConsistentHashPlacement(object):
+    """The endpoint owning the point of the hash of the owner on a ring, with points per unit of weight"""
+
+    points_per_weight = 100
+
+    def __init__(self):
+        self._rings = {}
+        self._lock = threading.Lock()
+
+    def choose(self, owner, endpoints):
+        points, ring = self.get_ring(endpoints)
+        index = bisect.bisect(points, self.hash(str(owner.id))) % len(points)
+        return ring[index]
+
+    def get_ring(self, endpoints):
+        key = tuple(endpoints)
+        with self._lock:
+            if key not in self._rings:
+                ring = sorted((self.hash('%s-%d' % (endpoint.url, i)), endpoint) for endpoint in endpoints
+                              for i in range(int(endpoint.weight * self.points_per_weight)))
+                self._rings = {key: ([point for point, endpoint in ring], [endpoint for point, endpoint in ring])}
+            return self._rings[key]
+
+    @staticmethod
+    def hash(value):
+        return int(hashlib.md5(value).hexdigest()[:16], 16)
+
+
+class RoundRobinPlacement(object):
+    """Every endpoint in turn, smoothly weighted so heavier ones come up more often but not in a row"""
+
+    def __init__(self):
+        self._current = {}
+        self._lock = threading.Lock()
+
+    def choose(self, owner, endpoints):
+        total = sum(endpoint.weight for endpoint in endpoints)
+        with self._lock:
+            for endpoint in endpoints:
+                self._current[endpoint.url] = self._current.get(endpoint.url, 0) + endpoint.weight
+            chosen = max(endpoints, key=lambda endpoint: self._current[endpoint.url])
+            self._current[chosen.url] -= total
+        return chosen
+
+
+_placement = None
+_placement_lock = threading.Lock()
+
+
+def get_placement():
+    """The placement policy configured by settings.SWIFT_PLACEMENT"""
+    global _placement
+    if _placement is None:
+        with _placement_lock:
+            if _placement is None:
+                _placement = import_by_path(getattr(settings, 'SWIFT_PLACEMENT',
+                                                    'users.placement.LeastUsedPlacement'))()
+    return _placement
+
+
+def choose_endpoint(owner):
+    """The url of the swift cluster for a new workspace of owner"""
+    endpoints = get_endpoints()
+    if len(endpoints) == 1:
+        return endpoints[0].url
+    return get_placement().choose(owner, endpoints).url
+
+
+class ClusterLoad(object):
+
+    def __init__(self, url, weight, workspaces=0, bytes_used=0, object_count=0):
+        self.url = url
+        self.weight = weight
+        self.workspaces = workspaces
+        self.bytes_used = bytes_used
+        self.object_count = object_count
+        self.target_bytes = 0
+
+    @property
+    def configured(self):
+        """Whether new workspaces may still be placed on it"""
+        return self.weight is not None
+
+    @property
+    def excess_bytes(self):
+        """Bytes above its share by weight, to move elsewhere if positive"""
+        return self.bytes_used - self.target_bytes
+
+    def __unicode__(self):
+        return u'%s weight %s: %d workspaces, %d bytes in %d objects, %+d bytes from its share' % (
+            self.url, self.weight if self.configured else 'removed', self.workspaces, self.bytes_used,
+            self.object_count, self.excess_bytes)
+
+
+def get_cluster_loads():
+    """
+    The load of every swift cluster, configured or still holding workspaces,
+    from the database alone: the usage last collected by collect_usage.
+    :return list: a ClusterLoad per cluster, configured ones first
+    """
+    endpoints = get_endpoints()
+    totals = get_bytes_by_endpoint()
+    loads = [ClusterLoad(endpoint.url, endpoint.weight, *totals.pop(endpoint.url, (0, 0, 0)))
+             for endpoint in endpoints]
+    loads += [ClusterLoad(url, None, *totals[url]) for url in sorted(totals)]
+
+    total_bytes = sum(load.bytes_used for load in loads)
+    total_weight = sum(endpoint.weight for endpoint in endpoints)
+    for load in loads:
+        if load.configured and total_weight:
+            load.target_bytes = float(total_bytes) * load.weight / total_weight
+    return loads
@@ -0,0 +1,148 @@
+"""Creates stacksync users in bulk."""
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from users import openstack
+from users.concurrency import Report, chunked
+from users.models import StacksyncUser, StacksyncWorkspace, StacksyncMembership, ProvisioningJob
+from users.swift_batch import batch_client
+
+logger = logging.getLogger(__name__)
+
+
+class ProvisioningFailure(object):
+
+    def __init__(self, record, stage, error):
+        self.record = record
+        self.stage = stage
+        self.error = error
+
+    def __unicode__(self):
+        return u'%s (%s): %s failed: %s' % (self.record.get('name'), self.record.get('email'),
+                                           self.stage, self.error)
+
+
+class ProvisioningReport(Report):
+
+    def __init__(self):
+        super(ProvisioningReport, self).__init__()
+        self.created = []
+        self.queued = []
+
+    @property
+    def throughput(self):
+        """Users created per second"""
+        return len(self.created) / self.elapsed if self.elapsed else 0.0
+
+    def fail(self, record, stage, error):
+        self.add_failure(ProvisioningFailure(record, stage, error))
+
+
+def provision_users(records, concurrency=None, chunk_size=500):
+    """
+    Creates a stacksync user, with its keystone user, default workspace and
+    swift container, for every record.
+    :param records: iterable of dicts with name, email and optionally password and quota_limit
+    :param concurrency: threads of a pool of its own, instead of the shared one
+    :return ProvisioningReport:
+    """
+    report = ProvisioningReport()
+    with batch_client(concurrency) as client:
+        for chunk in chunked(records, chunk_size):
+            _provision_chunk(chunk, client, report)
+    report.finish()
+    return report
+
+
+def _provision_chunk(records, client, report):
+    swift_account = openstack.get_swift_account()
+
+    pending = []
+    names = set()
+    for record in records:
+        try:
+            user = StacksyncUser(id=uuid.uuid4(),
+                                 name=record['name'],
+                                 email=record['email'],
+                                 quota_limit=int(record.get('quota_limit') or 0),
+                                 swift_account=swift_account)
+            _validate_user(user, names)
+        except (KeyError, ValueError, ValidationError) as e:
+            report.fail(record, 'validation', e)
+            continue
+        names.add(user.name)
+        pending.append((record, user))
+
+    created = []
+    for result in client.run(_create_keystone_user, pending):
+        if result.ok:
+            created.append(result.item)
+        else:
+            report.fail(result.item[0], 'keystone', result.error)
+
+    users = [user for record, user in created]
+    workspaces = [StacksyncWorkspace.objects.new_workspace(user) for user in users]
+    memberships = [StacksyncMembership(id=uuid.uuid4(), user=user, workspace=workspace, name='default')
+                   for user, workspace in zip(users, workspaces)]
+    try:
+        with transaction.atomic():
+            StacksyncUser.objects.bulk_create(users)
+            StacksyncWorkspace.objects.bulk_create(workspaces)
+            StacksyncMembership.objects.bulk_create(memberships)
+    except Exception as e:
+        logger.exception('Could not insert a chunk of %d users', len(users))
+        for record, user in created:
+            report.fail(record, 'database', e)
+        # Don't leave keystone users behind for rows that were never stored
+        rollback = client.run(_delete_keystone_user, created)
+        for result in rollback:
+            if not result.ok:
+                record, user = result.item
+                logger.error('Could not delete keystone user %s of a user never stored: %s',
+                             user.swift_user, result.error)
+                report.fail(record, 'rollback', result.error)
+        return
+
+    if settings.PROVISIONING_QUEUE:
+        for user, workspace in zip(users, workspaces):
+            _enqueue_container_setup(user, workspace)
+            report.created.append(user)
+            report.queued.append(user)
+        return
+
+    results = client.run(StacksyncWorkspace.objects.setup_swift_container, zip(users, workspaces))
+    for user, workspace, result in zip(users, workspaces, results):
+        report.created.append(user)
+        if not result.ok:
+            # The user is stored already, the worker of users.jobs retries its container
+            logger.warning('Could not set up container %s, queued: %s', workspace.swift_container, result.error)
+            _enqueue_container_setup(user, workspace)
+            report.queued.append(user)
+
+
+def _enqueue_container_setup(user, workspace):
+    ProvisioningJob.objects.enqueue(ProvisioningJob.CREATE_CONTAINER, workspace.swift_url, workspace.swift_container,
+                                    keystone_username=user.swift_user, quota_limit=user.quota_limit)
+
+
+def _validate_user(user, names):
+    """Raises ValidationError for a user bulk_create would refuse, or a name already in the chunk"""
+    # swift_user is only set once the keystone user exists
+    user.full_clean(exclude=['swift_user'])
+    validate_email(user.email)
+    if user.name in names:
+        raise ValidationError('Duplicate name %s' % user.name)
+
+
+def _create_keystone_user(record, user):
+    user.create_new_keystone_user(record.get('password') or 'testpass')
+
+
+def _delete_keystone_user(record, user):
+    user.keystone.users.delete(user.keystone_id)
+
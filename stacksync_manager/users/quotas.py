@@ -0,0 +1,100 @@
+"""Changes the quota of many stacksync users at once."""
+import time
+
+from django.db import transaction
+
+from users import resilience
+from users.concurrency import Report
+from users.models import StacksyncWorkspace, ProvisioningJob
+from users.swift_batch import get_swift_batch_client
+
+
+class QuotaReport(Report):
+
+    def __init__(self, quota_limit, max_failures=100):
+        super(QuotaReport, self).__init__(max_failures)
+        self.quota_limit = quota_limit
+        self.users = 0
+        self.containers = 0
+        self.updated = 0
+        self.retried = 0
+        self.queued = 0
+        self.rejected = 0
+        self.rejections = []
+
+    def fail(self, container, error):
+        """A container whose update is queued for the provisioning worker"""
+        self.queued += 1
+        super(QuotaReport, self).fail(container, error)
+
+    def reject(self, container, error):
+        self.rejected += 1
+        if len(self.rejections) < self.max_failures:
+            self.rejections.append((container, error))
+
+    @property
+    def done(self):
+        """Containers dealt with so far, updated, queued or rejected"""
+        return self.updated + self.queued + self.rejected
+
+    def __unicode__(self):
+        return (u'Quota of %d users set to %d bytes: %d of %d containers updated, %d retries, %d queued, '
+                u'%d rejected in %.1fs' % (self.users, self.quota_limit, self.updated, self.containers, self.retried,
+                                           self.queued, self.rejected, self.elapsed))
+
+
+def is_retryable(error):
+    """Whether swift was unreachable, rather than refusing the change"""
+    return resilience.is_outage(error) or isinstance(error, resilience.CircuitOpenError)
+
+
+def set_quota_limit(queryset, quota_limit, chunk_size=500, attempts=3, retry_backoff=1, progress=None):
+    """
+    Sets the quota_limit of the users of the queryset and of the containers of
+    their workspaces. A container is tried up to attempts times, waiting
+    retry_backoff seconds, doubled every round, before the retries of a chunk.
+    progress(report), if given, is called after every chunk.
+    :return QuotaReport:
+    """
+    if attempts < 1:
+        raise ValueError('attempts must be at least 1')
+    report = QuotaReport(quota_limit)
+    with transaction.atomic():
+        # Read first: the queryset may no longer match once it is updated
+        containers = list(StacksyncWorkspace.objects.filter(owner__in=queryset.values('pk'))
+                          .order_by().values_list('swift_url', 'swift_container'))
+        report.users = queryset.update(quota_limit=quota_limit)
+    report.containers = len(containers)
+
+    batch_client = get_swift_batch_client()
+    for start in range(0, len(containers), chunk_size):
+        pending = containers[start:start + chunk_size]
+        failed = []
+        for attempt in range(attempts):
+            if attempt:
+                report.retried += len(pending)
+                time.sleep(retry_backoff * 2 ** (attempt - 1))
+            results = batch_client.set_containers_quota([(swift_url, swift_container, quota_limit)
+                                                         for swift_url, swift_container in pending])
+            report.updated += len([result for result in results if result.ok])
+            failed = []
+            for result in results:
+                if result.ok:
+                    continue
+                if is_retryable(result.error):
+                    failed.append(result)
+                else:
+                    report.reject(result.item[:2], result.error)
+            pending = [result.item[:2] for result in failed]
+            if not pending:
+                break
+        for result in failed:
+            swift_url, swift_container = result.item[:2]
+            ProvisioningJob.objects.enqueue(ProvisioningJob.SET_QUOTA, swift_url, swift_container,
+                                            quota_limit=quota_limit)
+            report.fail(result.item[:2], result.error)
+        if progress is not None:
+            progress(report)
+
+    report.finish()
+    return report
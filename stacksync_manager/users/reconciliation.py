@@ -0,0 +1,293 @@
+"""Finds, and optionally repairs, what got out of step between the database, keystone and swift."""
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from keystoneclient import exceptions as keystone_exceptions
+from swiftclient import client as swift
+
+from users import openstack
+from users.concurrency import Report, chunked
+from users.models import StacksyncUser, StacksyncWorkspace, ProvisioningJob, get_swift_client
+from users.placement import get_endpoints, normalize_url
+from users.swift_batch import batch_client
+from users.transfer import iterate_rows
+
+MISSING_CONTAINER = 'missing_container'
+ORPHAN_CONTAINER = 'orphan_container'
+ORPHAN_KEYSTONE_USER = 'orphan_keystone_user'
+
+
+class ReconciliationError(Exception):
+    pass
+
+
+class Finding(object):
+
+    def __init__(self, kind, **details):
+        self.kind = kind
+        self.details = details
+
+    def __getattr__(self, name):
+        try:
+            return self.details[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __unicode__(self):
+        return u'%s %s' % (self.kind, ' '.join('%s=%s' % item for item in sorted(self.details.items())))
+
+
+class ReconciliationReport(Report):
+    """Findings counted by kind, with the first max_examples of each kept to show"""
+
+    def __init__(self, repair, max_examples=100):
+        super(ReconciliationReport, self).__init__(max_examples)
+        self.repair = repair
+        self.max_examples = max_examples
+        self.counts = dict((kind, 0) for kind in (MISSING_CONTAINER, ORPHAN_CONTAINER, ORPHAN_KEYSTONE_USER))
+        self.examples = dict((kind, []) for kind in self.counts)
+        self.repaired = 0
+
+    def add(self, finding):
+        self.counts[finding.kind] += 1
+        if len(self.examples[finding.kind]) < self.max_examples:
+            self.examples[finding.kind].append(finding)
+
+
+def to_bytes(value):
+    return value.encode('utf8') if isinstance(value, unicode) else value
+
+
+def merge_join(left, right, left_key, right_key):
+    """
+    Pairs the items of two iterables sorted by key, yielding (left, right) for
+    keys in both, (left, None) and (None, right) for keys in only one of them.
+    Keys are compared as utf8 bytes, the order swift lists containers in.
+    """
+    left, right = iter(left), iter(right)
+    sentinel = object()
+    a, b = next(left, sentinel), next(right, sentinel)
+    previous = [None, None]
+    while a is not sentinel or b is not sentinel:
+        key_a = to_bytes(left_key(a)) if a is not sentinel else None
+        key_b = to_bytes(right_key(b)) if b is not sentinel else None
+        for side, key in enumerate((key_a, key_b)):
+            if key is not None and previous[side] is not None and key < previous[side]:
+                raise ReconciliationError('%r comes after %r, the listings must be sorted' % (key, previous[side]))
+            if key is not None:
+                previous[side] = key
+        if b is sentinel or (a is not sentinel and key_a < key_b):
+            yield a, None
+            a = next(left, sentinel)
+        elif a is sentinel or key_b < key_a:
+            yield None, b
+            b = next(right, sentinel)
+        else:
+            yield a, b
+            a, b = next(left, sentinel), next(right, sentinel)
+
+
+def order_by_bytes(queryset, column):
+    """
+    queryset sorted by the utf8 bytes of column, whatever the collation of the
+    database, with the sort key as the first value of each row.
+    """
+    qn = connection.ops.quote_name
+    sort_key = '%s.%s' % (qn(queryset.model._meta.db_table), qn(column))
+    if connection.vendor == 'postgresql':
+        sort_key += ' COLLATE "C"'
+    return queryset.extra(select={'sort_key': sort_key}, order_by=['sort_key'])
+
+
+def get_name_prefix():
+    """Start of the names of the containers and keystone users this manager creates"""
+    return settings.KEYSTONE_TENANT + '_'
+
+
+def iterate_containers(swift_url, page_size):
+    """Names of the stacksync containers of the account, listed a page at a time"""
+    marker = None
+    while True:
+        _, page = openstack.call_swift(swift.get_account, swift_url, marker=marker, limit=page_size,
+                                       prefix=get_name_prefix())
+        for container in page:
+            yield container['name']
+        if len(page) < page_size:
+            return
+        marker = page[-1]['name']
+
+
+def iterate_keystone_users(page_size):
+    """
+    Pages of the keystone users of the stacksync tenant. The v2 API of
+    keystone ignores limit and marker and lists them all at once: the listing
+    ends on a page longer than asked for, or one with no user not seen on the
+    page before.
+    """
+    keystone = openstack.get_keystone_client()
+    tenant = openstack.get_stacksync_tenant()
+    marker = None
+    previous = set()
+    while True:
+        page = keystone.users.list(tenant_id=tenant.id, limit=page_size, marker=marker)
+        page = [user for user in page if user.id not in previous]
+        if page:
+            yield page
+        if len(page) != page_size:
+            return
+        marker = page[-1].id
+        previous = set(user.id for user in page)
+
+
+def get_swift_urls():
+    """
+    The accounts holding workspaces, and the ones of the stacksync tenant on
+    every cluster, as (normalized url, swift_url of its workspaces as stored)
+    """
+    accounts = {}
+    for swift_url in StacksyncWorkspace.objects.values_list('swift_url', flat=True).distinct():
+        accounts.setdefault(normalize_url(swift_url), set()).add(swift_url)
+    for endpoint in get_endpoints():
+        accounts.setdefault(normalize_url(endpoint.url + '/' + openstack.get_swift_account()), set())
+    return sorted(accounts.items())
+
+
+def find_container_problems(page_size):
+    for swift_url, stored_urls in get_swift_urls():
+        rows = ()
+        if stored_urls:
+            workspaces = order_by_bytes(StacksyncWorkspace.objects.filter(swift_url__in=stored_urls),
+                                        'swift_container')
+            rows = iterate_rows(workspaces.values_list('sort_key', 'id', 'owner__swift_user', 'owner__quota_limit'))
+        containers = iterate_containers(swift_url, page_size)
+        for row, container in merge_join(rows, containers, lambda row: row[0], lambda name: name):
+            if container is None:
+                yield Finding(MISSING_CONTAINER, swift_url=swift_url, swift_container=row[0], workspace=str(row[1]),
+                              swift_user=row[2], quota_limit=row[3])
+            elif row is None:
+                # In an account without workspaces, a changed url is likelier than orphans
+                yield Finding(ORPHAN_CONTAINER, swift_url=swift_url, swift_container=container,
+                              known_account=bool(stored_urls))
+
+
+def find_keystone_orphans(page_size):
+    # Only the users this manager created, not other services nor the admin,
+    # whose name may well start the same way
+    prefix = get_name_prefix()
+    for page in iterate_keystone_users(page_size):
+        page = [user for user in page
+                if user.name.startswith(prefix) and user.name != settings.KEYSTONE_ADMIN_USER]
+        if not page:
+            continue
+        known = set()
+        # By name too, for the users whose keystone id was never stored
+        for keystone_id, swift_user in StacksyncUser.objects.filter(
+                Q(keystone_id__in=[user.id for user in page]) | Q(swift_user__in=[user.name for user in page])
+        ).values_list('keystone_id', 'swift_user'):
+            known.update((keystone_id, swift_user))
+        for user in page:
+            if user.id not in known and user.name not in known:
+                yield Finding(ORPHAN_KEYSTONE_USER, keystone_id=user.id, swift_user=user.name)
+
+
+def drop_false_findings(findings):
+    """
+    Drops the orphans whose rows are in the database after all, created after
+    the listing went past them, and the missing containers the provisioning
+    worker is yet to create.
+    """
+    names = [finding.swift_container for finding in findings if finding.kind == MISSING_CONTAINER]
+    queued = set((normalize_url(swift_url), name) for swift_url, name in ProvisioningJob.objects.filter(
+        swift_container__in=names, status__in=[ProvisioningJob.PENDING, ProvisioningJob.RUNNING]
+    ).values_list('swift_url', 'swift_container')) if names else set()
+
+    names = [finding.swift_container for finding in findings if finding.kind == ORPHAN_CONTAINER]
+    known_containers = set((normalize_url(swift_url), name) for swift_url, name in StacksyncWorkspace.objects.filter(
+        swift_container__in=names).values_list('swift_url', 'swift_container')) if names else set()
+
+    names = [finding.swift_user for finding in findings if finding.kind == ORPHAN_KEYSTONE_USER]
+    known_users = set(StacksyncUser.objects.filter(swift_user__in=names).values_list('swift_user', flat=True)
+                      if names else ())
+
+    return [finding for finding in findings
+            if not (finding.kind == MISSING_CONTAINER and (finding.swift_url, finding.swift_container) in queued)
+            and not (finding.kind == ORPHAN_CONTAINER and (finding.swift_url, finding.swift_container) in known_containers)
+            and not (finding.kind == ORPHAN_KEYSTONE_USER and finding.swift_user in known_users)]
+
+
+def create_missing_container(finding):
+    swift_client = get_swift_client()
+    swift_client.create_container(finding.swift_user, finding.swift_url, finding.swift_container)
+    if finding.quota_limit:
+        swift_client.set_container_quota(finding.swift_url, finding.swift_container, finding.quota_limit)
+
+
+def delete_orphan_container(finding):
+    # swift refuses to delete a container that still holds objects
+    get_swift_client().delete_container(finding.swift_url, finding.swift_container)
+
+
+def delete_orphan_keystone_user(finding):
+    try:
+        openstack.get_keystone_client().users.delete(finding.keystone_id)
+    except keystone_exceptions.NotFound:
+        pass
+    openstack.keystone_users.discard(finding.swift_user)
+
+
+REPAIRS = {
+    MISSING_CONTAINER: create_missing_container,
+    ORPHAN_CONTAINER: delete_orphan_container,
+    ORPHAN_KEYSTONE_USER: delete_orphan_keystone_user,
+}
+
+
+def reconcile(repair=False, concurrency=None, page_size=1000, chunk_size=500, max_examples=100, grace=None):
+    """
+    Compares the database with swift and keystone, and with repair on fixes
+    what can be fixed, a chunk of findings at a time on the shared batch pool,
+    or on one of concurrency threads. Without repair it is a dry run that only
+    reports.
+    :param grace: seconds keystone orphans are given to get their row, RECONCILE_KEYSTONE_GRACE by default
+    :return ReconciliationReport:
+    """
+    if grace is None:
+        grace = settings.RECONCILE_KEYSTONE_GRACE
+    report = ReconciliationReport(repair, max_examples)
+    with batch_client(concurrency) as client:
+        for chunk in chunked(find_container_problems(page_size), chunk_size):
+            check_and_repair(chunk, client, report)
+
+        listed_at = time.time()
+        orphans = list(find_keystone_orphans(page_size))
+        wait = listed_at + grace - time.time()
+        if orphans and wait > 0:
+            time.sleep(wait)
+        for chunk in chunked(orphans, chunk_size):
+            check_and_repair(chunk, client, report)
+
+    report.finish()
+    return report
+
+
+def check_and_repair(findings, client, report):
+    findings = drop_false_findings(findings)
+    for finding in findings:
+        report.add(finding)
+    if not report.repair:
+        return
+    repairable = []
+    for finding in findings:
+        if finding.kind == ORPHAN_CONTAINER and not finding.known_account:
+            report.fail(finding, ReconciliationError('no workspace is stored in this account, '
+                                                     'not deleting its containers'))
+        elif finding.kind in REPAIRS:
+            repairable.append(finding)
+    results = client.run(lambda finding: REPAIRS[finding.kind](finding), [(finding,) for finding in repairable])
+    for finding, result in zip(repairable, results):
+        if result.ok:
+            report.repaired += 1
+        else:
+            report.fail(finding, result.error)
@@ -0,0 +1,171 @@
+"""Reads from the read only replicas of the database in DATABASE_REPLICAS."""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections, DatabaseError, DEFAULT_DB_ALIAS
+
+logger = logging.getLogger(__name__)
+
+_state = threading.local()
+
+# Seconds the replica is behind the primary; none when it replayed all it received
+LAG_SQL = ('SELECT CASE WHEN NOT pg_is_in_recovery() '
+           'OR pg_last_xlog_receive_location() = pg_last_xlog_replay_location() THEN 0 '
+           'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')
+
+
+def reset():
+    """Starts over for a new request: reads may go to replicas again"""
+    _state.pinned = False
+    _state.wrote = False
+
+
+def pin_primary():
+    _state.pinned = True
+
+
+def is_pinned():
+    return getattr(_state, 'pinned', False)
+
+
+def wrote():
+    """Whether this thread wrote to the primary since reset()"""
+    return getattr(_state, 'wrote', False)
+
+
+@contextmanager
+def replica_reads():
+    """Lets the reads made inside go to a replica, the same one for all of them"""
+    _state.replica_reads = getattr(_state, 'replica_reads', 0) + 1
+    try:
+        yield
+    finally:
+        _state.replica_reads -= 1
+        if not _state.replica_reads:
+            _state.replica = None
+
+
+def use_replicas(view):
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        with replica_reads():
+            return view(*args, **kwargs)
+    return wrapped
+
+
+class ReplicaLagMonitor(object):
+    """Which replicas are close enough to the primary, rechecked every check_interval seconds"""
+
+    def __init__(self, max_lag, check_interval):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._usable = {}
+        self._lock = threading.Lock()
+
+    def is_usable(self, alias):
+        with self._lock:
+            checked_at, usable = self._usable.get(alias, (0, False))
+            if time.time() - checked_at < self.check_interval:
+                return usable
+            # Other threads keep the last answer while this one checks
+            self._usable[alias] = (time.time(), usable)
+
+        lag = self.get_lag(alias)
+        usable = lag is not None and lag <= self.max_lag
+        if not usable:
+            logger.warning('Not reading from replica %s, %s', alias,
+                           'unreachable' if lag is None else '%.1fs behind' % lag)
+        with self._lock:
+            self._usable[alias] = (time.time(), usable)
+        return usable
+
+    def get_lag(self, alias):
+        """Seconds the replica is behind, None if it can't tell"""
+        connection = connections[alias]
+        if connection.vendor != 'postgresql':
+            return 0.0
+        try:
+            cursor = connection.cursor()
+            cursor.execute(LAG_SQL)
+            lag = cursor.fetchone()[0]
+        except DatabaseError:
+            connection.close()
+            return None
+        return float(lag) if lag is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._usable.clear()
+
+
+lag_monitor = ReplicaLagMonitor(getattr(settings, 'REPLICA_MAX_LAG', 5),
+                                getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL', 10))
+
+
+def get_replica():
+    """One of the replicas close enough to the primary, None if there is none"""
+    replicas = [alias for alias in getattr(settings, 'DATABASE_REPLICAS', ()) if lag_monitor.is_usable(alias)]
+    return random.choice(replicas) if replicas else None
+
+
+def get_read_database():
+    """The database for a read that can do with slightly stale data"""
+    if is_pinned():
+        return DEFAULT_DB_ALIAS
+    return get_replica() or DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter(object):
+    """Sends the reads inside replica_reads() to a replica, every write to the primary"""
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'replica_reads', 0) and not is_pinned():
+            if not getattr(_state, 'replica', None):
+                _state.replica = get_replica() or DEFAULT_DB_ALIAS
+            return _state.replica
+        # Explicit, or the rows loaded from a replica would read their relations there
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _state.pinned = _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_syncdb(self, db, model):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaChangeListMixin(object):
+    """ModelAdmin mixin reading the changelist from a replica, unless an action is posted"""
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super(ReplicaChangeListMixin, self).changelist_view(request, extra_context)
+        with replica_reads():
+            return super(ReplicaChangeListMixin, self).changelist_view(request, extra_context)
+
+
+def check_connections(**kwargs):
+    """
+    Closes the persistent connections (CONN_MAX_AGE) that stopped working, a
+    database restart or failover, before a request gets them. Each one is
+    checked at most every DATABASE_HEALTH_CHECK_INTERVAL seconds.
+    """
+    interval = getattr(settings, 'DATABASE_HEALTH_CHECK_INTERVAL', None)
+    if interval is None:
+        return
+    now = time.time()
+    for connection in connections.all():
+        if connection.connection is None or now - getattr(connection, 'health_checked_at', 0) < interval:
+            continue
+        connection.health_checked_at = now
+        if not connection.is_usable():
+            logger.warning('Closing the broken connection to database %s', connection.alias)
+            connection.close()
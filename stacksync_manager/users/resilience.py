@@ -0,0 +1,265 @@
+"""Timeouts, retries and circuit breakers for the calls to keystone and swift."""
+import collections
+import logging
+import random
+import socket
+import threading
+import time
+import urlparse
+
+import requests
+from django.conf import settings
+from keystoneclient import exceptions as keystone_exceptions
+
+from users import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+# Value of each state in the exported metrics
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+OUTAGES = (requests.exceptions.RequestException, socket.error, keystone_exceptions.ConnectionRefused,
+           keystone_exceptions.RequestTimeout, keystone_exceptions.AuthorizationFailure)
+
+
+class CircuitOpenError(Exception):
+    """The call was not made, its endpoint is failing"""
+
+    def __init__(self, endpoint):
+        super(CircuitOpenError, self).__init__('%s is unavailable, not calling it' % endpoint)
+        self.endpoint = endpoint
+
+
+def is_outage(error):
+    """Whether error means the endpoint is down, rather than it refusing the call"""
+    if isinstance(error, OUTAGES):
+        return True
+    status = getattr(error, 'http_status', None)
+    return bool(status) and status >= 500
+
+
+class CircuitBreaker(object):
+    """
+    Closed, calls go through. Open after failure_threshold failures in a row,
+    calls are rejected. Half open reset_timeout seconds later, up to probes
+    calls go through: the first to succeed closes the circuit, a failure opens
+    it again. A failure_threshold of None never opens the circuit.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout, probes=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._probing = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call must not be made"""
+        with self._lock:
+            if self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and self._probing < self.probes:
+                self._probing += 1
+                return
+            self.rejected += 1
+        raise CircuitOpenError(self.name)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state == HALF_OPEN:
+                self._probing = 0
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failure_threshold is not None and
+                                           self.failures >= self.failure_threshold):
+                self._probing = 0
+                self.opened_at = time.time()
+                self.times_opened += 1
+                self._set_state(OPEN)
+
+    def _set_state(self, state):
+        if state != self.state:
+            log = logger.info if state == CLOSED else logger.warning
+            log('Circuit of %s is now %s after %d failures in a row', self.name, state, self.failures)
+        self.state = state
+
+
+class RetryBudget(object):
+    """
+    Allows as many retries as ratio times the calls made in the last ttl
+    seconds, plus min_per_second per second.
+    """
+
+    def __init__(self, ratio, min_per_second, ttl=10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.ttl = ttl
+        self.retries = 0
+        self.exhausted = 0
+        self._calls = collections.deque()
+        self._retries = collections.deque()
+        self._lock = threading.Lock()
+
+    def record_call(self):
+        with self._lock:
+            now = time.time()
+            self._forget(now)
+            self._calls.append(now)
+
+    def try_retry(self):
+        """Whether a retry may be made now, counting it against the budget if so"""
+        with self._lock:
+            now = time.time()
+            self._forget(now)
+            if len(self._retries) >= self.ratio * len(self._calls) + self.min_per_second * self.ttl:
+                self.exhausted += 1
+                return False
+            self._retries.append(now)
+            self.retries += 1
+            return True
+
+    def _forget(self, now):
+        for times in (self._calls, self._retries):
+            while times and now - times[0] > self.ttl:
+                times.popleft()
+
+
+def get_backoff(attempt):
+    """Seconds to wait before retry number attempt, chosen at random up to the exponential backoff"""
+    base = getattr(settings, 'OPENSTACK_RETRY_BACKOFF', 0.1)
+    cap = getattr(settings, 'OPENSTACK_RETRY_MAX_BACKOFF', 2)
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class Endpoint(object):
+    """A host:port of a service, with its circuit breaker and retry budget"""
+
+    def __init__(self, service, host):
+        self.service = service
+        self.host = host
+        self.name = '%s %s' % (service, host)
+        timeouts = getattr(settings, 'OPENSTACK_TIMEOUTS', {})
+        self.timeout = timeouts.get(host, timeouts.get(service))
+        self.max_attempts = getattr(settings, 'OPENSTACK_RETRY_ATTEMPTS', 3)
+        self.breaker = CircuitBreaker(self.name, getattr(settings, 'OPENSTACK_CIRCUIT_FAILURES', 5),
+                                      getattr(settings, 'OPENSTACK_CIRCUIT_RESET', 30),
+                                      getattr(settings, 'OPENSTACK_CIRCUIT_PROBES', 1))
+        self.budget = RetryBudget(getattr(settings, 'OPENSTACK_RETRY_RATIO', 0.2),
+                                  getattr(settings, 'OPENSTACK_RETRY_MIN_PER_SECOND', 1))
+        self._local = threading.local()
+
+    @property
+    def in_call(self):
+        """Whether a call through this endpoint is running on the current thread"""
+        return getattr(self._local, 'active', False)
+
+    def call(self, func, idempotent=False):
+        """
+        Calls func() through the circuit breaker, retrying it after an outage
+        if it is idempotent and the budget allows. A call nested in another one
+        of the same endpoint, like the requests of a client authenticating,
+        runs as is: the outer call counts for both.
+        """
+        if self.in_call:
+            return func()
+        self._local.active = True
+        try:
+            return self._call(func, idempotent)
+        finally:
+            self._local.active = False
+
+    def _call(self, func, idempotent):
+        self.budget.record_call()
+        attempt = 1
+        while True:
+            self.breaker.before_call()
+            try:
+                result = func()
+            except Exception as e:
+                if not is_outage(e):
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if not idempotent or attempt >= self.max_attempts or not self.budget.try_retry():
+                    raise
+                time.sleep(get_backoff(attempt))
+                attempt += 1
+            else:
+                self.breaker.record_success()
+                return result
+
+
+class EndpointRegistry(object):
+
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def get(self, service, url):
+        host = urlparse.urlparse(url).netloc or url
+        with self._lock:
+            endpoint = self._endpoints.get((service, host))
+            if endpoint is None:
+                endpoint = self._endpoints[service, host] = Endpoint(service, host)
+            return endpoint
+
+    def all(self):
+        with self._lock:
+            return sorted(self._endpoints.values(), key=lambda endpoint: (endpoint.service, endpoint.host))
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+endpoints = EndpointRegistry()
+
+
+def get_endpoint(service, url):
+    return endpoints.get(service, url)
+
+
+def get_states():
+    """The state of every endpoint called so far, for monitoring"""
+    return [{'service': endpoint.service, 'host': endpoint.host, 'state': endpoint.breaker.state,
+             'failures': endpoint.breaker.failures, 'times_opened': endpoint.breaker.times_opened,
+             'rejected': endpoint.breaker.rejected, 'retries': endpoint.budget.retries,
+             'retry_budget_exhausted': endpoint.budget.exhausted} for endpoint in endpoints.all()]
+
+
+def render_states():
+    """The endpoint states in the prometheus text format"""
+    states = get_states()
+    lines = []
+    for name, kind, help_text, key in [
+            ('circuit_state', 'gauge', 'Circuit breaker state, 0 closed, 1 half open, 2 open', 'state'),
+            ('circuit_opened_total', 'counter', 'Times the circuit breaker opened', 'times_opened'),
+            ('circuit_rejected_total', 'counter', 'Calls rejected while the circuit was open', 'rejected'),
+            ('retries_total', 'counter', 'Calls retried after an outage', 'retries'),
+            ('retry_budget_exhausted_total', 'counter', 'Retries not made for lack of budget',
+             'retry_budget_exhausted')]:
+        lines += ['# HELP stacksync_openstack_%s %s' % (name, help_text),
+                  '# TYPE stacksync_openstack_%s %s' % (name, kind)]
+        for state in states:
+            value = STATE_VALUES[state['state']] if key == 'state' else state[key]
+            lines.append('stacksync_openstack_%s{service="%s",endpoint="%s"} %d' % (
+                name, metrics.escape(state['service']), metrics.escape(state['host']), value))
+    return lines
+
+
+metrics.add_collector(render_states)
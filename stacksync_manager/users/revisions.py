@@ -0,0 +1,68 @@
+"""Coalesces the latest_revision increments of a process."""
+import threading
+
+
+class _Group(object):
+    """Increments of one workspace written by the same UPDATE"""
+
+    def __init__(self):
+        self.count = 0
+        self.revision = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _Workspace(object):
+
+    def __init__(self):
+        self.open = None
+        self.writing = None
+
+
+class RevisionCoalescer(object):
+    """
+    Hands out revisions of workspaces, writing them with
+    write(workspace_id, count), which adds count to the latest_revision of the
+    workspace and returns the new value.
+    """
+
+    def __init__(self, write):
+        self.write = write
+        self._workspaces = {}
+        self._lock = threading.Lock()
+
+    def increment(self, workspace_id):
+        """Adds one to the latest_revision of the workspace, returns the new value"""
+        with self._lock:
+            workspace = self._workspaces.setdefault(workspace_id, _Workspace())
+            group = workspace.open
+            leader = group is None
+            if leader:
+                group = workspace.open = _Group()
+                previous = workspace.writing
+            position = group.count
+            group.count += 1
+
+        if leader:
+            # Increments keep joining the group until the previous one is written
+            if previous is not None:
+                previous.done.wait()
+            with self._lock:
+                workspace.open = None
+                workspace.writing = group
+            try:
+                group.revision = self.write(workspace_id, group.count)
+            except Exception as e:
+                group.error = e
+            finally:
+                with self._lock:
+                    workspace.writing = None
+                    if workspace.open is None:
+                        del self._workspaces[workspace_id]
+                group.done.set()
+        else:
+            group.done.wait()
+
+        if group.error is not None:
+            raise group.error
+        return group.revision - group.count + position + 1
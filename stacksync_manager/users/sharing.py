@@ -0,0 +1,110 @@
+"""Shares workspaces with many users at once."""
+import uuid
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from users.concurrency import Report
+from users.models import StacksyncWorkspace, StacksyncMembership
+from users.swift_batch import batch_client
+
+
+class SharingReport(Report):
+
+    def __init__(self):
+        super(SharingReport, self).__init__()
+        self.added = 0
+        self.removed = 0
+
+
+def update_members(workspaces, add=(), remove=(), name=None, concurrency=None):
+    """
+    Adds the users in add to every workspace and removes the ones in remove.
+    Owners always stay members of their workspaces.
+
+    :param name: name of the workspace for the new members, the one the owner
+                 gave it by default
+    :return SharingReport: a workspace whose container ACL could not be
+                           updated is in failures; update_container_acls()
+                           on it again brings swift in line with the database
+    """
+    workspaces = list(workspaces)
+    workspace_ids = [workspace.id for workspace in workspaces]
+    add_ids = set(user.pk for user in add)
+    remove_ids = set(user.pk for user in remove) - add_ids
+    report = SharingReport()
+
+    with transaction.atomic():
+        if remove_ids:
+            members = StacksyncMembership.objects.filter(workspace__in=workspace_ids, user__in=remove_ids)
+            members = members.exclude(workspace__owner=F('user'))
+            report.removed = members.count()
+            members.delete()
+
+        if add_ids:
+            existing = set((str(workspace_id), str(user_id)) for workspace_id, user_id in
+                           StacksyncMembership.objects.filter(workspace__in=workspace_ids, user__in=add_ids)
+                           .values_list('workspace_id', 'user_id'))
+            names = get_workspace_names(workspaces) if name is None else {}
+            memberships = [StacksyncMembership(id=uuid.uuid4(), workspace=workspace, user_id=user_id,
+                                               name=name or names.get(str(workspace.id), 'shared'))
+                           for workspace in workspaces for user_id in add_ids
+                           if (str(workspace.id), str(user_id)) not in existing]
+            StacksyncMembership.objects.bulk_create(memberships)
+            report.added = len(memberships)
+
+        update_shared_flags(workspace_ids)
+
+    for workspace, error in update_container_acls(workspaces, concurrency):
+        report.fail(workspace, error)
+    return report
+
+
+def share_workspace(workspace, users, name=None):
+    return update_members([workspace], add=users, name=name)
+
+
+def unshare_workspace(workspace, users):
+    return update_members([workspace], remove=users)
+
+
+def get_workspace_names(workspaces):
+    """workspace id -> name its owner gave it"""
+    return dict((str(workspace_id), name) for workspace_id, name in
+                StacksyncMembership.objects.filter(workspace__in=[workspace.id for workspace in workspaces],
+                                                   user=F('workspace__owner'))
+                .values_list('workspace_id', 'name'))
+
+
+def update_shared_flags(workspace_ids):
+    """A workspace is shared while it has more members than its owner"""
+    shared = [workspace_id for workspace_id, members in
+              StacksyncMembership.objects.filter(workspace__in=workspace_ids)
+              .values_list('workspace').annotate(members=Count('id')) if members > 1]
+    StacksyncWorkspace.objects.filter(id__in=workspace_ids).exclude(id__in=shared).update(is_shared=False)
+    StacksyncWorkspace.objects.filter(id__in=shared).update(is_shared=True)
+
+
+def update_container_acls(workspaces, concurrency=None):
+    """
+    Sets the ACL of the container of every workspace to its current members,
+    with one request per container, on the shared SwiftBatchClient unless
+    concurrency asks for a pool of its own.
+    :return list: (workspace, error) of the containers that could not be updated
+    """
+    workspaces = list(workspaces)
+    workspace_ids = [workspace.id for workspace in workspaces]
+    members = defaultdict(set)
+    # The owner keeps access even to a workspace stored without its membership
+    for workspace_id, swift_user in StacksyncWorkspace.objects.filter(id__in=workspace_ids).values_list(
+            'id', 'owner__swift_user'):
+        members[str(workspace_id)].add(swift_user)
+    for workspace_id, swift_user in StacksyncMembership.objects.filter(workspace__in=workspace_ids).values_list(
+            'workspace_id', 'user__swift_user'):
+        members[str(workspace_id)].add(swift_user)
+
+    with batch_client(concurrency) as client:
+        results = client.set_containers_acl(
+            [(workspace.swift_url, workspace.swift_container, members[str(workspace.id)]) for workspace in workspaces])
+    return [(workspace, result.error) for workspace, result in zip(workspaces, results) if not result.ok]
@@ -1,8 +1,19 @@
+from users.indexes import create_search_indexes
 from users.models import StacksyncUser, StacksyncWorkspace
-from django.db.models.signals import post_save
+from users.replicas import check_connections
+from django.core.signals import request_started
+from django.db.models.signals import post_save, post_syncdb
 from django.dispatch import receiver
 
 @receiver(post_save, sender=StacksyncUser)
 def create_default_workspace_for_user(sender, instance, created, **kwargs):
     if created:
-        StacksyncWorkspace.objects.create_workspace(instance)
\ No newline at end of file
+        StacksyncWorkspace.objects.create_workspace(instance)
+
+
+@receiver(post_syncdb)
+def create_admin_search_indexes(sender, db, **kwargs):
+    create_search_indexes(using=db)
+
+
+request_started.connect(check_connections)
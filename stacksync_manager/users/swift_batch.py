@@ -0,0 +1,110 @@
+"""Container operations on many containers in one call, run on a shared pool of threads."""
+import threading
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+
+from users import metrics
+from users.concurrency import Result
+from users.models import get_swift_client
+
+_local = threading.local()
+
+
+def _mark_worker():
+    _local.worker = True
+
+
+class SwiftBatchClient(object):
+
+    def __init__(self, concurrency=None, swift_client=None):
+        self.concurrency = concurrency or settings.SWIFT_CONCURRENCY
+        self.swift_client = swift_client or get_swift_client()
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        """Created on first use, so importing this module starts no threads"""
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPool(self.concurrency, initializer=_mark_worker)
+        return self._pool
+
+    def run(self, operation, items):
+        """
+        Calls operation(*item) for every item. A failing item never stops the others.
+        operation must not use the database: each thread would open its own
+        connection, outside the caller's transaction.
+        :return list: a users.concurrency.Result per item, in the same order as items
+        """
+        operation = metrics.bind_request(operation)
+
+        def call(item):
+            try:
+                return Result(item, value=operation(*item))
+            except Exception as e:
+                return Result(item, error=e)
+
+        items = [tuple(item) for item in items]
+        # A batch started from a worker would wait on the workers it occupies
+        if len(items) <= 1 or self.concurrency <= 1 or getattr(_local, 'worker', False):
+            return [call(item) for item in items]
+        return self.pool.map(call, items, chunksize=1)
+
+    def create_containers(self, containers):
+        """containers: (keystone_username, swift_url, swift_container)"""
+        return self.run(self.swift_client.create_container, containers)
+
+    def delete_containers(self, containers):
+        """containers: (swift_url, swift_container)"""
+        return self.run(self.swift_client.delete_container, containers)
+
+    def get_containers_metadata(self, containers, use_cache=True):
+        """containers: (swift_url, swift_container)"""
+        return self.run(lambda swift_url, swift_container: self.swift_client.get_container_metadata(
+            swift_url, swift_container, use_cache=use_cache), containers)
+
+    def set_containers_quota(self, containers):
+        """containers: (swift_url, swift_container, quota_limit)"""
+        return self.run(self.swift_client.set_container_quota, containers)
+
+    def set_containers_acl(self, containers):
+        """containers: (swift_url, swift_container, keystone_usernames)"""
+        return self.run(self.swift_client.set_container_acl, containers)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+
+_swift_batch_client = None
+_swift_batch_client_lock = threading.Lock()
+
+
+def get_swift_batch_client():
+    """The SwiftBatchClient shared by the whole process, created on first use"""
+    global _swift_batch_client
+    if _swift_batch_client is None:
+        with _swift_batch_client_lock:
+            if _swift_batch_client is None:
+                _swift_batch_client = SwiftBatchClient()
+    return _swift_batch_client
+
+
+@contextmanager
+def batch_client(concurrency=None):
+    """The shared SwiftBatchClient, or one of its own with concurrency threads, closed on exit"""
+    if concurrency is None:
+        yield get_swift_batch_client()
+        return
+    client = SwiftBatchClient(concurrency)
+    try:
+        yield client
+    finally:
+        client.close()
@@ -1,8 +1,41 @@
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import StringIO
+import threading
+import time
+import urllib
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, DatabaseError
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.test.utils import override_settings, CaptureQueriesContext
+from django.utils import timezone
 
-from mock import MagicMock, patch
+from mock import ANY, MagicMock, patch
 from swiftclient import client as swift
-from users.models import StacksyncUser, StacksyncWorkspace, StacksyncWorkspaceManager
+from benchmarks.fake_openstack import FakeKeystone, FakeSwift
+from oauth.models import Consumer, AccessToken
+from users import indexes, metrics, openstack, placement, reconciliation, replicas, resilience
+from users.cache import DjangoCache
+from users.deletion import delete_users
+from users.jobs import process_jobs
+from users.provisioning import provision_users
+from users.quotas import set_quota_limit
+from users.middleware import ReplicaPinningMiddleware
+from users.reconciliation import reconcile, merge_join, iterate_keystone_users, ReconciliationError
+from users.revisions import RevisionCoalescer
+from users.sharing import update_members
+from users.swift_batch import SwiftBatchClient
+from users.transfer import export_rows, import_rows
+from users.usage import collect_usage
+from users.models import (StacksyncUser, StacksyncWorkspace, StacksyncWorkspaceManager, StacksyncMembership,
+                          SwiftClient, ProvisioningJob, WorkspaceUsage)
 
 
 class StacksyncTest(TestCase):
@@ -10,6 +43,10 @@ class StacksyncTest(TestCase):
     Fake class to test user creation deletion
     """
 
+    def setUp(self):
+        openstack.reset()
+        self.addCleanup(openstack.reset)
+
     @patch.object(StacksyncWorkspaceManager, 'setup_swift_container')
     def test_create_user(self, mock):
         testuser = StacksyncUser(name="AAA", email="testuser@testuser.com", keystone=self.get_mock_keystone())
@@ -31,8 +68,81 @@ class StacksyncTest(TestCase):
         keystone = MagicMock()
         tenant = self.get_mock_stacksync_tenant()
         keystone.tenants.list.return_value = [tenant]
+        keystone.users.create.return_value.id = 'id_of_keystone_user'
         return keystone
 
+    @patch('users.openstack.client.Client')
+    def test_loading_users_does_not_call_keystone(self, keystone_client):
+        StacksyncUser.objects.bulk_create([StacksyncUser(name="AAA", email="testuser@testuser.com",
+                                                         swift_user="stacksync_AAA", swift_account="AUTH_id")])
+
+        users = list(StacksyncUser.objects.all())
+        self.assertEquals(1, len(users))
+        self.assertEquals("AUTH_id", users[0].swift_account)
+        self.assertFalse(keystone_client.called)
+
+    @patch('users.openstack.client.Client')
+    def test_swift_client_is_shared_and_created_without_keystone(self, keystone_client):
+        workspace = StacksyncWorkspace(swift_url='http://swift', swift_container='container')
+
+        self.assertIs(StacksyncWorkspace.objects.swift_client, workspace.swift_client)
+        self.assertFalse(keystone_client.called)
+
+    @patch('users.openstack.client.Client')
+    def test_stacksync_tenant_is_shared_by_process(self, keystone_client):
+        keystone_client.return_value = self.get_mock_keystone()
+
+        for i in range(3):
+            testuser = StacksyncUser(name="AAA", email="testuser@testuser.com")
+            self.assertEquals('id_of_Tenant', testuser.stacksync_tenant.id)
+
+        self.assertEquals(1, keystone_client.call_count)
+        self.assertEquals(1, keystone_client.return_value.tenants.list.call_count)
+
+    @patch.object(StacksyncWorkspaceManager, 'setup_swift_container')
+    def test_password_update_uses_stored_keystone_id(self, mock):
+        keystone = self.get_mock_keystone()
+        testuser = StacksyncUser(name="AAA", email="testuser@testuser.com", keystone=keystone)
+        testuser.save()
+
+        testuser.save(password='newpass')
+
+        self.assertEquals('id_of_keystone_user', StacksyncUser.objects.get(pk=testuser.pk).keystone_id)
+        keystone.users.update_password.assert_called_with('id_of_keystone_user', 'newpass')
+        self.assertFalse(keystone.users.list.called)
+
+    @patch('users.openstack.client.Client')
+    def test_keystone_id_of_old_users_is_resolved_once(self, keystone_client):
+        keystone_user = MagicMock()
+        keystone_user.name = 'stacksync_AAA'
+        keystone_user.id = 'keystone_id'
+        keystone_client.return_value.users.list.return_value = [keystone_user]
+        StacksyncUser.objects.bulk_create([StacksyncUser(name="AAA", email="testuser@testuser.com",
+                                                         swift_user="stacksync_AAA", swift_account="AUTH_id")])
+
+        self.assertEquals('keystone_id', StacksyncUser.objects.get().get_keystone_user_id())
+        self.assertEquals('keystone_id', StacksyncUser.objects.get().get_keystone_user_id())
+        self.assertEquals(1, keystone_client.return_value.users.list.call_count)
+
+    @patch('users.openstack.client.Client')
+    def test_backfill_keystone_ids(self, keystone_client):
+        keystone_users = []
+        for name in ['stacksync_AAA', 'stacksync_BBB']:
+            keystone_user = MagicMock()
+            keystone_user.name = name
+            keystone_user.id = name + '_id'
+            keystone_users.append(keystone_user)
+        keystone_client.return_value.users.list.return_value = keystone_users
+        StacksyncUser.objects.bulk_create([
+            StacksyncUser(name="AAA", email="a@testuser.com", swift_user="stacksync_AAA", swift_account="AUTH_id"),
+            StacksyncUser(name="BBB", email="b@testuser.com", swift_user="stacksync_BBB", swift_account="AUTH_id"),
+            StacksyncUser(name="CCC", email="c@testuser.com", swift_user="stacksync_CCC", swift_account="AUTH_id")])
+
+        self.assertEquals(2, StacksyncUser.objects.backfill_keystone_ids(chunk_size=1))
+        self.assertEquals({'stacksync_AAA': 'stacksync_AAA_id', 'stacksync_BBB': 'stacksync_BBB_id',
+                           'stacksync_CCC': None},
+                          dict(StacksyncUser.objects.values_list('swift_user', 'keystone_id')))
+
     @patch.object(swift, 'delete_container')
     def test_delete_user(self, mock):
         testuser = StacksyncUser(name="AAA", email="testuser@testuser.com")
@@ -44,6 +154,1184 @@ class StacksyncTest(TestCase):
 
 
 
+class SwiftClientTest(TestCase):
+    swift_url = 'http://swift/v1/AUTH_id'
+
+    def setUp(self):
+        openstack.reset()
+        self.addCleanup(openstack.reset)
+        patcher = patch.object(openstack, 'get_keystone_client')
+        self.keystone = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.keystone.auth_ref = self.get_auth_ref('token', datetime.timedelta(hours=1))
+        # Renewed tokens come from a client of their own
+        patcher = patch.object(openstack, 'new_keystone_client')
+        self.new_keystone_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.new_keystone_client.return_value.auth_ref = self.get_auth_ref('new_token', datetime.timedelta(hours=1))
+
+    def get_auth_ref(self, token, expires_in):
+        auth_ref = MagicMock()
+        auth_ref.auth_token = token
+        auth_ref.expires = datetime.datetime.utcnow() + expires_in
+        return auth_ref
+
+    @patch.object(swift, 'head_container')
+    def test_token_is_shared_between_clients(self, head_container):
+        SwiftClient().get_container_metadata(self.swift_url, 'container1')
+        SwiftClient().get_container_metadata(self.swift_url, 'container2')
+
+        self.assertFalse(self.keystone.authenticate.called)
+        head_container.assert_called_with(self.swift_url, 'token', 'container2', http_conn=ANY)
+
+    @patch.object(swift, 'head_container')
+    def test_token_is_renewed_before_it_expires(self, head_container):
+        self.keystone.auth_ref = self.get_auth_ref('token', datetime.timedelta(seconds=30))
+
+        SwiftClient().get_container_metadata(self.swift_url, 'container1')
+        SwiftClient().get_container_metadata(self.swift_url, 'container1')
+
+        self.assertEquals(1, self.new_keystone_client.call_count)
+        self.assertFalse(self.keystone.authenticate.called)
+        head_container.assert_called_with(self.swift_url, 'new_token', 'container1', http_conn=ANY)
+
+    @patch.object(swift, 'head_container')
+    def test_rejected_token_is_renewed_once(self, head_container):
+        head_container.side_effect = [swift.ClientException('Unauthorized', http_status=401),
+                                      {'x-container-meta-quota-bytes': '10'}]
+
+        metadata = SwiftClient().get_container_metadata(self.swift_url, 'container1')
+
+        self.assertEquals('10', metadata['x-container-meta-quota-bytes'])
+        self.assertEquals(1, self.new_keystone_client.call_count)
+        self.assertEquals('token', self.keystone.auth_ref.auth_token)
+        head_container.assert_called_with(self.swift_url, 'new_token', 'container1', http_conn=ANY)
+
+    @patch.object(swift, 'post_container')
+    @patch.object(swift, 'head_container')
+    def test_container_metadata_is_cached_until_changed(self, head_container, post_container):
+        head_container.return_value = {'x-container-meta-quota-bytes': '10'}
+        client = SwiftClient()
+
+        client.get_container_metadata(self.swift_url, 'container1')
+        client.get_container_metadata(self.swift_url, 'container1')
+        self.assertEquals(1, head_container.call_count)
+
+        client.set_container_quota(self.swift_url, 'container1', 20)
+        client.get_container_metadata(self.swift_url, 'container1')
+        self.assertEquals(2, head_container.call_count)
+
+    @patch.object(swift, 'head_container')
+    def test_physical_quotas_only_fetch_misses(self, head_container):
+        head_container.side_effect = lambda url, token, container, http_conn: {
+            'x-container-meta-quota-bytes': container[-1]}
+        workspaces = [StacksyncWorkspace(id=uuid.uuid4(), swift_url=self.swift_url, swift_container='container%d' % i)
+                      for i in range(3)]
+        workspaces[0].get_physical_quota()
+
+        quotas = StacksyncWorkspace.objects.get_physical_quotas(workspaces)
+
+        self.assertEquals([0, 1, 2], [quotas[workspace.id] for workspace in workspaces])
+        self.assertEquals(3, head_container.call_count)
+
+    @patch.object(swift, 'head_container')
+    def test_connections_are_reused(self, head_container):
+        SwiftClient().get_container_metadata(self.swift_url, 'container1')
+        SwiftClient().get_container_metadata(self.swift_url, 'container2')
+
+        first_conn = head_container.call_args_list[0][1]['http_conn'][1]
+        second_conn = head_container.call_args_list[1][1]['http_conn'][1]
+        self.assertIs(first_conn, second_conn)
+
+    @patch.object(swift, 'head_container')
+    def test_connections_are_shared_by_the_accounts_of_an_endpoint(self, head_container):
+        SwiftClient().get_container_metadata(self.swift_url, 'container1')
+        SwiftClient().get_container_metadata('http://swift/v1/AUTH_other', 'container1')
+
+        (first_parsed, first_conn), (second_parsed, second_conn) = [
+            call[1]['http_conn'] for call in head_container.call_args_list]
+        self.assertIs(first_conn, second_conn)
+        self.assertEquals(['/v1/AUTH_id', '/v1/AUTH_other'], [first_parsed.path, second_parsed.path])
+
+
+class ProvisioningTest(TestCase):
+
+    def setUp(self):
+        openstack.reset()
+        self.addCleanup(openstack.reset)
+        patcher = patch.object(openstack, 'get_keystone_client')
+        self.keystone = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        tenant = MagicMock()
+        tenant.name = 'stacksync'
+        tenant.id = 'id_of_Tenant'
+        self.keystone.tenants.list.return_value = [tenant]
+
+    def create_keystone_user(self, name, password, tenant_id):
+        if name.endswith('_BBB'):
+            raise Exception('keystone is down')
+        keystone_user = MagicMock()
+        keystone_user.id = name + '_id'
+        return keystone_user
+
+    @override_settings(PROVISIONING_QUEUE=False)
+    @patch.object(StacksyncWorkspaceManager, 'setup_swift_container')
+    def test_provision_users(self, setup_swift_container):
+        self.keystone.users.create.side_effect = self.create_keystone_user
+        records = [{'name': 'AAA', 'email': 'a@testuser.com', 'quota_limit': '100'},
+                   {'name': 'BBB', 'email': 'b@testuser.com'},
+                   {'name': 'CCC', 'email': 'c@testuser.com', 'password': 'secret'},
+                   {'name': 'DDD'}]
+
+        report = provision_users(records, concurrency=2, chunk_size=3)
+
+        self.assertEquals(['AAA', 'CCC'], sorted(user.name for user in report.created))
+        self.assertEquals([('BBB', 'keystone'), ('DDD', 'validation')],
+                          [(failure.record.get('name'), failure.stage) for failure in report.failures])
+        self.assertEquals(2, StacksyncUser.objects.count())
+        self.assertEquals(2, StacksyncWorkspace.objects.count())
+        self.assertEquals(2, setup_swift_container.call_count)
+        user = StacksyncUser.objects.get(name='AAA')
+        self.assertEquals(100, user.quota_limit)
+        self.assertEquals('AUTH_id_of_Tenant', user.swift_account)
+        self.assertTrue(user.keystone_id.endswith('_AAA_id'))
+        self.assertEquals(['default'], [membership.name for membership in user.stacksyncmembership_user.all()])
+        self.assertEquals([], report.queued)
+        self.assertFalse(ProvisioningJob.objects.exists())
+
+    @patch.object(StacksyncWorkspaceManager, 'setup_swift_container')
+    def test_invalid_rows_are_left_out(self, setup_swift_container):
+        self.keystone.users.create.side_effect = self.create_keystone_user
+        records = [{'name': 'AAA', 'email': 'a@testuser.com'},
+                   {'name': 'A' * 101, 'email': 'long@testuser.com'},
+                   {'name': 'EEE', 'email': 'not an email'},
+                   {'name': 'FFF', 'email': ''},
+                   {'name': 'AAA', 'email': 'again@testuser.com'}]
+
+        report = provision_users(records)
+
+        self.assertEquals(['AAA'], [user.name for user in report.created])
+        self.assertEquals(['validation'] * 4, [failure.stage for failure in report.failures])
+        self.assertEquals(1, self.keystone.users.create.call_count)
+        self.assertEquals(1, StacksyncUser.objects.count())
+
+    @patch.object(StacksyncWorkspaceManager, 'bulk_create')
+    def test_failed_rollback_is_reported(self, bulk_create):
+        self.keystone.users.create.side_effect = self.create_keystone_user
+        bulk_create.side_effect = DatabaseError('disk full')
+        self.keystone.users.delete.side_effect = Exception('keystone is down')
+
+        report = provision_users([{'name': 'AAA', 'email': 'a@testuser.com'}])
+
+        self.assertEquals([], report.created)
+        self.assertEquals(['database', 'rollback'], [failure.stage for failure in report.failures])
+        self.assertEquals(0, StacksyncUser.objects.count())
+
+    @override_settings(PROVISIONING_QUEUE=False)
+    @patch.object(StacksyncWorkspaceManager, 'setup_swift_container')
+    def test_container_failure_is_queued(self, setup_swift_container):
+        self.keystone.users.create.side_effect = self.create_keystone_user
+        setup_swift_container.side_effect = swift.ClientException('Service unavailable', http_status=503)
+
+        report = provision_users([{'name': 'AAA', 'email': 'a@testuser.com', 'quota_limit': '100'}])
+
+        self.assertEquals(['AAA'], [user.name for user in report.queued])
+        self.assertEquals([], report.failures)
+        job = ProvisioningJob.objects.get()
+        self.assertEquals(ProvisioningJob.CREATE_CONTAINER, job.action)
+        self.assertEquals(StacksyncWorkspace.objects.get().swift_container, job.swift_container)
+        self.assertEquals(100, job.quota_limit)
+
+    @override_settings(PROVISIONING_QUEUE=True)
+    @patch.object(StacksyncWorkspaceManager, 'setup_swift_container')
+    def test_provision_users_queues_containers(self, setup_swift_container):
+        self.keystone.users.create.side_effect = self.create_keystone_user
+
+        report = provision_users([{'name': 'AAA', 'email': 'a@testuser.com'},
+                                  {'name': 'CCC', 'email': 'c@testuser.com'}])
+
+        self.assertEquals(['AAA', 'CCC'], sorted(user.name for user in report.queued))
+        self.assertFalse(setup_swift_container.called)
+        self.assertEquals(2, ProvisioningJob.objects.filter(action=ProvisioningJob.CREATE_CONTAINER).count())
+
+
+class ProvisioningQueueTest(TestCase):
+
+    def setUp(self):
+        keystone = MagicMock()
+        tenant = MagicMock()
+        tenant.name = 'stacksync'
+        tenant.id = 'id_of_Tenant'
+        keystone.tenants.list.return_value = [tenant]
+        keystone.users.create.return_value.id = 'id_of_keystone_user'
+        self.testuser = StacksyncUser(name="AAA", email="testuser@testuser.com", quota_limit=100, keystone=keystone)
+        self.testuser.save()
+        self.workspace = self.testuser.get_workspaces()[0]
+
+    def test_user_creation_queues_container_setup(self):
+        job = ProvisioningJob.objects.get()
+        self.assertEquals(ProvisioningJob.CREATE_CONTAINER, job.action)
+        self.assertEquals(ProvisioningJob.PENDING, job.status)
+        self.assertEquals(self.workspace.swift_container, job.swift_container)
+        self.assertEquals(self.testuser.swift_user, job.keystone_username)
+        self.assertEquals(100, job.quota_limit)
+
+    @patch.object(SwiftClient, 'set_container_quota')
+    @patch.object(SwiftClient, 'create_container')
+    def test_worker_sets_up_container(self, create_container, set_container_quota):
+        self.assertEquals(1, process_jobs())
+
+        create_container.assert_called_with(self.testuser.swift_user, self.workspace.swift_url,
+                                            self.workspace.swift_container)
+        set_container_quota.assert_called_with(self.workspace.swift_url, self.workspace.swift_container, 100)
+        self.assertEquals(ProvisioningJob.DONE, ProvisioningJob.objects.get().status)
+        self.assertEquals(0, process_jobs())
+
+    @patch.object(SwiftClient, 'create_container')
+    def test_failed_job_is_retried_later(self, create_container):
+        create_container.side_effect = swift.ClientException('Service unavailable', http_status=503)
+
+        self.assertEquals(1, process_jobs())
+
+        job = ProvisioningJob.objects.get()
+        self.assertEquals(ProvisioningJob.PENDING, job.status)
+        self.assertEquals(1, job.attempts)
+        self.assertIn('Service unavailable', job.last_error)
+        self.assertEquals(0, process_jobs())
+
+    @patch.object(SwiftClient, 'delete_container')
+    def test_workspace_deletion_cancels_pending_setup(self, delete_container):
+        swift_url, swift_container = self.workspace.swift_url, self.workspace.swift_container
+        self.workspace.delete()
+        ProvisioningJob.objects.enqueue(ProvisioningJob.DELETE_CONTAINER, swift_url, swift_container)
+
+        job = ProvisioningJob.objects.get()
+        self.assertEquals(ProvisioningJob.DELETE_CONTAINER, job.action)
+        self.assertEquals(1, process_jobs())
+        delete_container.assert_called_once_with(job.swift_url, job.swift_container)
+
+    def test_jobs_of_a_container_run_one_at_a_time(self):
+        create = ProvisioningJob.objects.claim(10, lease=300)
+        ProvisioningJob.objects.enqueue(ProvisioningJob.DELETE_CONTAINER, self.workspace.swift_url,
+                                        self.workspace.swift_container)
+
+        # Not while its setup runs
+        self.assertEquals([], ProvisioningJob.objects.claim(10, lease=300))
+        ProvisioningJob.objects.filter(id=create[0].id).update(status=ProvisioningJob.DONE)
+        self.assertEquals([ProvisioningJob.DELETE_CONTAINER],
+                          [job.action for job in ProvisioningJob.objects.claim(10, lease=300)])
+
+    def test_running_job_queued_again_is_not_claimed_twice(self):
+        self.assertEquals(1, len(ProvisioningJob.objects.claim(10, lease=300)))
+        ProvisioningJob.objects.enqueue(ProvisioningJob.CREATE_CONTAINER, self.workspace.swift_url,
+                                        self.workspace.swift_container, quota_limit=200)
+
+        self.assertEquals([], ProvisioningJob.objects.claim(10, lease=300))
+        # It runs again with the new quota once the lease is over
+        job = ProvisioningJob.objects.get()
+        self.assertEquals(ProvisioningJob.PENDING, job.status)
+        self.assertEquals(200, job.quota_limit)
+        self.assertGreater(job.run_after, timezone.now())
+
+    @override_settings(PROVISIONING_MAX_ATTEMPTS=2)
+    def test_job_whose_worker_keeps_dying_fails(self):
+        for attempts in [1, 2]:
+            jobs = ProvisioningJob.objects.claim(10, lease=0)
+            self.assertEquals([attempts], [job.attempts for job in jobs])
+
+        self.assertEquals([], ProvisioningJob.objects.claim(10, lease=0))
+        job = ProvisioningJob.objects.get()
+        self.assertEquals(ProvisioningJob.FAILED, job.status)
+        self.assertEquals(2, job.attempts)
+
+
+class SharingTest(TestCase):
+
+    def setUp(self):
+        StacksyncUser.objects.bulk_create([
+            StacksyncUser(name=name, email=name + "@testuser.com", swift_user="stacksync_" + name,
+                          swift_account="AUTH_id")
+            for name in ["AAA", "BBB", "CCC", "DDD"]])
+        self.users = list(StacksyncUser.objects.order_by('name'))
+        self.owner = self.users[0]
+        for _ in range(2):
+            StacksyncWorkspace.objects.create_workspace(self.owner)
+        self.workspaces = list(StacksyncWorkspace.objects.all())
+
+    def get_acls(self, set_container_acl):
+        return dict((args[1], sorted(args[2])) for args, kwargs in set_container_acl.call_args_list)
+
+    @patch.object(SwiftClient, 'set_container_acl')
+    def test_members_are_added_with_one_acl_update_per_workspace(self, set_container_acl):
+        report = update_members(self.workspaces, add=self.users[1:])
+
+        self.assertEquals(6, report.added)
+        self.assertEquals(8, StacksyncMembership.objects.count())
+        self.assertEquals(2, set_container_acl.call_count)
+        for acl in self.get_acls(set_container_acl).values():
+            self.assertEquals(['stacksync_AAA', 'stacksync_BBB', 'stacksync_CCC', 'stacksync_DDD'], acl)
+        self.assertTrue(all(workspace.is_shared for workspace in StacksyncWorkspace.objects.all()))
+
+    @patch.object(SwiftClient, 'set_container_acl')
+    def test_members_are_removed_but_not_the_owner(self, set_container_acl):
+        update_members(self.workspaces, add=self.users[1:3])
+        set_container_acl.reset_mock()
+
+        report = update_members(self.workspaces, remove=self.users[:3])
+
+        self.assertEquals(4, report.removed)
+        self.assertEquals(2, StacksyncMembership.objects.count())
+        self.assertEquals(['stacksync_AAA'], self.get_acls(set_container_acl).values()[0])
+        self.assertFalse(any(workspace.is_shared for workspace in StacksyncWorkspace.objects.all()))
+
+    @patch.object(SwiftClient, 'set_container_acl')
+    def test_failed_acl_update_is_reported(self, set_container_acl):
+        set_container_acl.side_effect = [None, swift.ClientException('Service Unavailable', http_status=503)]
+
+        report = update_members(self.workspaces, add=self.users[1:2], concurrency=1)
+
+        self.assertEquals(2, report.added)
+        self.assertEquals([self.workspaces[1]], [workspace for workspace, error in report.failures])
+
+    def test_acl_headers_merge_members(self):
+        headers = SwiftClient().get_acl_headers(['bbb', 'aaa', 'bbb'])
+        self.assertEquals({'x-container-read': 'stacksync:aaa,stacksync:bbb',
+                           'x-container-write': 'stacksync:aaa,stacksync:bbb'}, headers)
+
+
+class DeletionTest(TestCase):
+
+    def setUp(self):
+        openstack.reset()
+        self.addCleanup(openstack.reset)
+        patcher = patch.object(openstack, 'get_keystone_client')
+        self.keystone = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        StacksyncUser.objects.bulk_create([
+            StacksyncUser(name=name, email=name + "@testuser.com", swift_user="stacksync_" + name,
+                          swift_account="AUTH_id", keystone_id=name + "_id")
+            for name in ["AAA", "BBB", "CCC"]])
+        for user in StacksyncUser.objects.all():
+            StacksyncWorkspace.objects.create_workspace(user)
+
+    @patch.object(SwiftClient, 'delete_container')
+    def test_delete_users(self, delete_container):
+        self.keystone.users.delete.side_effect = lambda user_id: self.fail_for('BBB_id', user_id)
+        delete_container.side_effect = lambda url, container: self.fail_for('_CCC', container)
+
+        results = delete_users(StacksyncUser.objects.order_by('name'), concurrency=2)
+
+        self.assertEquals([True, False, True], [result.deleted for result in results])
+        self.assertEquals([0, 1, 1], [len(result.errors) for result in results])
+        self.assertEquals(['BBB'], [user.name for user in StacksyncUser.objects.all()])
+        self.assertEquals(1, StacksyncWorkspace.objects.count())
+        self.assertEquals(3, self.keystone.users.delete.call_count)
+        self.assertEquals(2, delete_container.call_count)
+        retried = ProvisioningJob.objects.get(action=ProvisioningJob.DELETE_CONTAINER)
+        self.assertTrue(retried.swift_container.endswith('_CCC'))
+
+    @patch.object(SwiftClient, 'delete_container')
+    def test_unresolved_keystone_id_keeps_the_user(self, delete_container):
+        StacksyncUser.objects.filter(name='BBB').update(keystone_id=None)
+        self.keystone.users.list.side_effect = Exception('Service unavailable')
+
+        results = delete_users(StacksyncUser.objects.order_by('name'), concurrency=2)
+
+        self.assertEquals([True, False, True], [result.deleted for result in results])
+        self.assertEquals(['keystone: Service unavailable'], results[1].errors)
+        self.assertEquals(['BBB'], [user.name for user in StacksyncUser.objects.all()])
+
+    def fail_for(self, name, value):
+        if value.endswith(name):
+            raise Exception('Service unavailable')
+
+
+class DjangoCacheTest(TestCase):
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_keys_are_hashed(self):
+        cache = DjangoCache(60)
+        key = (u'stacksync_\xe1' + 'x' * 300, 'secret with spaces')
+
+        cache.set(key, 'value')
+
+        self.assertEquals('value', cache.get(key))
+        self.assertEquals(None, cache.get((key[0], 'other')))
+        self.assertRegexpMatches(cache._key(key), r'^stacksync:[0-9a-f]{32}$')
+
+
+class RevisionTest(TestCase):
+
+    def setUp(self):
+        self.user = StacksyncUser(id=uuid.uuid4(), name="AAA", email="a@testuser.com", swift_user="stacksync_AAA",
+                                  swift_account="AUTH_id")
+        StacksyncUser.objects.bulk_create([self.user])
+        self.workspace = StacksyncWorkspace.objects.create(id=uuid.uuid4(), owner=self.user, swift_container='c',
+                                                           swift_url='http://swift/v1/AUTH_id')
+
+    def test_increment_returns_the_new_revision(self):
+        self.assertEquals(1, self.workspace.increment_revision())
+        self.assertEquals(4, StacksyncWorkspace.objects.increment_revision(self.workspace.id, count=3))
+        self.assertEquals(4, StacksyncWorkspace.objects.get().latest_revision)
+        self.assertRaises(StacksyncWorkspace.DoesNotExist, StacksyncWorkspace.objects.increment_revision, uuid.uuid4())
+
+    def test_concurrent_increments_share_a_write(self):
+        writes = []
+        writing, release = threading.Event(), threading.Event()
+        revision = [0]
+
+        def write(workspace_id, count):
+            writes.append(count)
+            writing.set()
+            release.wait()
+            revision[0] += count
+            return revision[0]
+
+        coalescer = RevisionCoalescer(write)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(coalescer.increment('w'))) for _ in range(5)]
+        threads[0].start()
+        writing.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while coalescer._workspaces['w'].open is None or coalescer._workspaces['w'].open.count < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals([1, 4], writes)
+        self.assertEquals([1, 2, 3, 4, 5], sorted(results))
+        self.assertEquals({}, coalescer._workspaces)
+
+
+@override_settings(SWIFT_ENDPOINTS=[{'URL': 'http://swift-a/v1', 'WEIGHT': 2}, {'URL': 'http://swift-b/v1'}])
+class PlacementTest(TestCase):
+
+    def setUp(self):
+        self.users = [StacksyncUser(id=uuid.uuid4(), name=name, email=name + "@testuser.com",
+                                    swift_user="stacksync_" + name, swift_account="AUTH_id")
+                      for name in ["AAA", "BBB", "CCC"]]
+        StacksyncUser.objects.bulk_create(self.users)
+        # 300 bytes on a, 200 on b and 50 left on a cluster taken out of service
+        for i, (cluster, bytes_used) in enumerate([('a', 100), ('a', 200), ('b', 200), ('old', 50)]):
+            workspace = StacksyncWorkspace.objects.create(id=uuid.uuid4(), owner=self.users[i % 3],
+                                                          swift_container='c%d' % i,
+                                                          swift_url='http://swift-%s/v1/AUTH_id' % cluster)
+            WorkspaceUsage.objects.create(workspace=workspace, bytes_used=bytes_used, object_count=1,
+                                          updated_at=timezone.now())
+        self.a, self.b = placement.get_endpoints()
+
+    def test_least_used(self):
+        self.assertEquals(self.a, placement.LeastUsedPlacement().choose(self.users[0], [self.a, self.b]))
+        WorkspaceUsage.objects.filter(workspace__swift_url='http://swift-a/v1/AUTH_id').update(bytes_used=500)
+        self.assertEquals(self.b, placement.LeastUsedPlacement().choose(self.users[0], [self.a, self.b]))
+
+    def test_least_used_spreads_workspaces_until_the_usage_is_read_again(self):
+        policy = placement.LeastUsedPlacement()
+        with self.assertNumQueries(1):
+            chosen = [policy.choose(self.users[0], [self.a, self.b]) for _ in range(6)]
+        # 137.5 bytes per workspace on average
+        self.assertEquals([self.a, self.b, self.a, self.a, self.b, self.a], chosen)
+
+    def test_least_used_skips_endpoints_of_weight_zero(self):
+        drained = placement.SwiftEndpoint('http://swift-c/v1', 0)
+        policy = placement.LeastUsedPlacement()
+        self.assertEquals(self.a, policy.choose(self.users[0], [drained, self.a]))
+        self.assertRaises(ImproperlyConfigured, policy.choose, self.users[0], [drained])
+
+    def test_consistent_hashing_keeps_owners_in_place(self):
+        policy = placement.ConsistentHashPlacement()
+        owners = [StacksyncUser(id=uuid.uuid4()) for _ in range(300)]
+        before = [policy.choose(owner, [self.a, self.b]) for owner in owners]
+        self.assertEquals(before, [policy.choose(owner, [self.a, self.b]) for owner in owners])
+        self.assertTrue(before.count(self.a) > before.count(self.b) > 50)
+
+        c = placement.SwiftEndpoint('http://swift-c/v1')
+        after = [policy.choose(owner, [self.a, self.b, c]) for owner in owners]
+        self.assertTrue(all(new in (old, c) for old, new in zip(before, after)))
+
+    def test_weighted_round_robin(self):
+        policy = placement.RoundRobinPlacement()
+        self.assertEquals([self.a, self.b, self.a] * 2, [policy.choose(None, [self.a, self.b]) for _ in range(6)])
+
+    def test_new_workspaces_are_placed(self):
+        with patch.object(placement, '_placement', placement.RoundRobinPlacement()):
+            urls = [StacksyncWorkspace.objects.new_workspace(self.users[0]).swift_url for _ in range(3)]
+        self.assertEquals(['http://swift-a/v1/AUTH_id', 'http://swift-b/v1/AUTH_id', 'http://swift-a/v1/AUTH_id'],
+                          urls)
+
+    def test_cluster_loads(self):
+        loads = placement.get_cluster_loads()
+        # The 550 bytes shared 2 to 1, the removed cluster having to give all of its own away
+        self.assertEquals([('http://swift-a/v1', 2, 300, -67), ('http://swift-b/v1', 1, 200, 17),
+                           ('http://swift-old/v1', None, 50, 50)],
+                          [(load.url, load.weight, load.bytes_used, int(round(load.excess_bytes))) for load in loads])
+        self.assertEquals(2, loads[0].workspaces)
+
+
+class UsageTest(TestCase):
+
+    def setUp(self):
+        StacksyncUser.objects.bulk_create([
+            StacksyncUser(name=name, email=name + "@testuser.com", swift_user="stacksync_" + name,
+                          swift_account="AUTH_id")
+            for name in ["AAA", "BBB"]])
+        self.aaa, self.bbb = StacksyncUser.objects.order_by('name')
+        for user in [self.aaa, self.aaa, self.bbb]:
+            StacksyncWorkspace.objects.create_workspace(user)
+
+    def get_container_metadata(self, swift_url, swift_container, use_cache=True):
+        return {'x-container-bytes-used': '1000' if '_AAA' in swift_container else '5',
+                'x-container-object-count': '2'}
+
+    @patch.object(SwiftClient, 'get_container_metadata')
+    def test_collect_usage(self, get_container_metadata):
+        get_container_metadata.side_effect = self.get_container_metadata
+
+        report = collect_usage(concurrency=2, chunk_size=2)
+
+        self.assertEquals(3, report.workspaces)
+        self.assertEquals(2, report.owners)
+        self.assertEquals(2000, StacksyncUser.objects.get(pk=self.aaa.pk).quota_used)
+        self.assertEquals(5, StacksyncUser.objects.get(pk=self.bbb.pk).quota_used)
+        totals = dict((str(row['workspace__owner']), row['object_count'])
+                      for row in WorkspaceUsage.objects.totals_by_owner())
+        self.assertEquals({str(self.aaa.pk): 4, str(self.bbb.pk): 2}, totals)
+
+    @patch.object(SwiftClient, 'get_container_metadata')
+    def test_incremental_collection_skips_fresh_workspaces(self, get_container_metadata):
+        get_container_metadata.side_effect = self.get_container_metadata
+        # One thread, mock call counts are not thread safe
+        collect_usage(workspaces=StacksyncWorkspace.objects.filter(owner=self.aaa), concurrency=1)
+
+        report = collect_usage(stale_after=3600, concurrency=1)
+
+        self.assertEquals(1, report.workspaces)
+        self.assertEquals(3, get_container_metadata.call_count)
+        self.assertEquals(3, WorkspaceUsage.objects.count())
+
+
+class TransferTest(TestCase):
+
+    def setUp(self):
+        StacksyncUser.objects.bulk_create([
+            StacksyncUser(name=name, email=name + "@testuser.com", swift_user="stacksync_" + name,
+                          swift_account="AUTH_id")
+            for name in ["AAA", "BBB", "CCC"]])
+        for user in StacksyncUser.objects.all():
+            StacksyncWorkspace.objects.create_workspace(user)
+            consumer = Consumer.objects.create(consumer_key='key' + user.name, consumer_secret='secret', user=user)
+            AccessToken.objects.create(consumer=consumer, user=user, access_token='token' + user.name,
+                                       access_token_secret='secret')
+        StacksyncMembership.objects.update(created_at=timezone.now() - datetime.timedelta(days=30))
+
+    def dump(self):
+        return [sorted(model.objects.values_list()) for model in (StacksyncUser, StacksyncWorkspace,
+                                                                     StacksyncMembership, Consumer, AccessToken)]
+
+    def export(self):
+        output = StringIO.StringIO()
+        report = export_rows(output, chunk_size=2)
+        return output.getvalue(), report
+
+    @patch.object(openstack, 'get_keystone_client')
+    def test_export_import_round_trip_without_keystone(self, get_keystone_client):
+        before = self.dump()
+        data, report = self.export()
+        self.assertEquals(3 + 3 + 3 + 3 + 3, report.total)
+        self.assertEquals(report.total, len(data.splitlines()))
+
+        StacksyncUser.objects.all().delete()
+        # Per model: the rows already there and the insert, in a savepoint
+        with self.assertNumQueries(5 * 4):
+            report = import_rows(StringIO.StringIO(data), chunk_size=100)
+
+        self.assertEquals(15, report.total)
+        self.assertEquals(before, self.dump())
+        self.assertFalse(get_keystone_client.called)
+        # The sequences are past the imported ids
+        Consumer.objects.create(consumer_key='new', consumer_secret='secret', user=StacksyncUser.objects.all()[0])
+
+    def test_rows_already_there_are_skipped(self):
+        data, _ = self.export()
+        StacksyncMembership.objects.all()[0].delete()
+
+        report = import_rows(StringIO.StringIO(data), chunk_size=2)
+
+        self.assertEquals(1, report.total)
+        self.assertEquals(14, report.skipped)
+        self.assertEquals(3, StacksyncMembership.objects.count())
+
+
+class FakeOpenStackTestCase(TestCase):
+    """
+    Runs the real keystone and swift clients against the in process fake
+    services of the benchmarks.
+    """
+
+    def setUp(self):
+        self.swift = FakeSwift(tokens=()).start()
+        self.addCleanup(self.swift.stop)
+        self.keystone = FakeKeystone(settings.KEYSTONE_ADMIN_USER, settings.KEYSTONE_ADMIN_PASSWORD,
+                                     settings.KEYSTONE_TENANT, swift=self.swift).start()
+        self.addCleanup(self.keystone.stop)
+
+        overrides = override_settings(KEYSTONE_AUTH_URL=self.keystone.url, SWIFT_URL=self.swift.url,
+                                      PROVISIONING_QUEUE=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        openstack.reset()
+        self.addCleanup(openstack.reset)
+
+
+class FakeOpenStackTest(FakeOpenStackTestCase):
+
+    def test_user_life_cycle(self):
+        user = StacksyncUser(name="AAA", email="testuser@testuser.com", quota_limit=100)
+        user.save()
+        self.assertEquals([user.keystone_id], list(self.keystone.users))
+        self.assertEquals('AUTH_bench_tenant', user.swift_account)
+
+        workspace = user.get_workspaces()[0]
+        self.assertEquals(100, workspace.get_physical_quota())
+
+        user.delete()
+        self.assertEquals({}, self.keystone.users)
+        self.assertEquals({}, self.swift.containers)
+
+    def test_calls_are_measured_and_exported(self):
+        metrics.registry.clear()
+        calls = metrics.start_request()
+        try:
+            user = StacksyncUser(name="AAA", email="testuser@testuser.com")
+            user.save()
+            self.assertRaises(swift.ClientException, SwiftClient().get_container_metadata,
+                              self.swift.url + '/' + user.swift_account, 'missing')
+        finally:
+            metrics.finish_request()
+
+        # authentication, tenant lookup and user creation; container creation and the failed HEAD
+        self.assertEquals({'keystone': 3, 'swift': 2}, calls.by_service)
+        self.assertEquals(1, calls.errors)
+
+        response = self.client.get('/metrics')
+        self.assertContains(response, 'stacksync_openstack_call_duration_seconds_count'
+                                      '{service="keystone",operation="POST /users"} 1')
+        self.assertContains(response, 'stacksync_openstack_call_duration_seconds_count'
+                                      '{service="swift",operation="put_container"} 1')
+        self.assertContains(response, 'stacksync_openstack_call_errors_total'
+                                      '{service="swift",operation="head_container",error="404"} 1')
+
+    def test_batch_client_runs_every_container(self):
+        swift_url = self.swift.url + '/' + openstack.get_swift_account()
+        names = ['batch%d' % i for i in range(6)]
+        batch_client = SwiftBatchClient(concurrency=3)
+        self.addCleanup(batch_client.close)
+
+        results = batch_client.create_containers([('stacksync_aaa', swift_url, name) for name in names])
+        self.assertTrue(all(result.ok for result in results))
+        results = batch_client.set_containers_quota([(swift_url, name, i) for i, name in enumerate(names)])
+        self.assertTrue(all(result.ok for result in results))
+
+        results = batch_client.get_containers_metadata([(swift_url, name) for name in names + ['missing']])
+        self.assertEquals(range(6), [int(result.value['x-container-meta-quota-bytes']) for result in results[:6]])
+        self.assertIsInstance(results[6].error, swift.ClientException)
+
+        # Started from a worker, a batch runs there instead of waiting on the pool
+        nested = batch_client.run(lambda name: len(batch_client.delete_containers([(swift_url, name)])),
+                                  [(name,) for name in names])
+        self.assertEquals([1] * 6, [result.value for result in nested])
+        self.assertEquals({}, self.swift.containers)
+
+    @patch('users.middleware.logger')
+    def test_slow_requests_are_logged(self, logger):
+        with self.settings(SLOW_REQUEST_THRESHOLD=0):
+            self.client.get('/metrics')
+        self.assertTrue(logger.warning.called)
+
+
+class ResilienceTest(FakeOpenStackTestCase):
+
+    @override_settings(OPENSTACK_RETRY_BACKOFF=0)
+    def test_only_idempotent_calls_are_retried_after_outages(self):
+        endpoint = resilience.Endpoint('swift', 'swift:8080')
+        outages = []
+
+        def call():
+            if outages:
+                raise outages.pop()
+            return 'ok'
+
+        outages.append(swift.ClientException('down', http_status=503))
+        self.assertEquals('ok', endpoint.call(call, idempotent=True))
+        outages.append(swift.ClientException('down', http_status=503))
+        self.assertRaises(swift.ClientException, endpoint.call, call)
+
+        missing = MagicMock(side_effect=swift.ClientException('missing', http_status=404))
+        self.assertRaises(swift.ClientException, endpoint.call, missing, idempotent=True)
+        self.assertEquals(1, missing.call_count)
+        self.assertEquals(0, endpoint.breaker.failures)
+
+    def test_nested_calls_count_once(self):
+        endpoint = resilience.Endpoint('keystone', 'keystone:5000')
+
+        def authenticate():
+            return endpoint.call(MagicMock(side_effect=swift.ClientException('down', http_status=503)))
+
+        self.assertRaises(swift.ClientException, endpoint.call, authenticate)
+        self.assertEquals(1, endpoint.breaker.failures)
+        self.assertFalse(endpoint.in_call)
+
+    def test_retry_budget(self):
+        budget = resilience.RetryBudget(ratio=0.5, min_per_second=0)
+        for _ in range(4):
+            budget.record_call()
+        self.assertEquals([True, True, False], [budget.try_retry() for _ in range(3)])
+        self.assertEquals(1, budget.exhausted)
+
+    @override_settings(OPENSTACK_TIMEOUTS={'swift': 3, 'swift.example:8080': 1})
+    def test_connections_get_the_timeout_of_their_endpoint(self):
+        for url, timeout in [('http://swift.example:8080/v1/AUTH_id', 1), ('http://other:8080/v1/AUTH_id', 3)]:
+            parsed, http_conn = openstack.swift_connections._checkout(url)
+            self.assertEquals(timeout, http_conn.requests_args['timeout'])
+
+    @override_settings(OPENSTACK_CIRCUIT_FAILURES=2, OPENSTACK_RETRY_ATTEMPTS=1)
+    def test_failing_swift_is_not_called_until_probed(self):
+        swift_url = self.swift.url + '/' + openstack.get_swift_account()
+        client = SwiftClient()
+        self.swift.error_rate = 1.0
+        for _ in range(2):
+            self.assertRaises(swift.ClientException, client.get_container_metadata, swift_url, 'c', use_cache=False)
+
+        requests = self.swift.requests
+        self.assertRaises(resilience.CircuitOpenError, client.get_container_metadata, swift_url, 'c', use_cache=False)
+        self.assertEquals(requests, self.swift.requests)
+        endpoint = resilience.get_endpoint('swift', swift_url)
+        self.assertContains(self.client.get('/metrics'), 'stacksync_openstack_circuit_state'
+                                                         '{service="swift",endpoint="%s"} 2' % endpoint.host)
+
+        # Once it is time, a probe finds swift back, a 404 being an answer
+        self.swift.error_rate = 0
+        endpoint.breaker.opened_at -= settings.OPENSTACK_CIRCUIT_RESET
+        self.assertRaises(swift.ClientException, client.get_container_metadata, swift_url, 'c', use_cache=False)
+        self.assertEquals(resilience.CLOSED, endpoint.breaker.state)
+        self.assertEquals(1, endpoint.breaker.times_opened)
+
+
+    @override_settings(OPENSTACK_CIRCUIT_FAILURES=2, OPENSTACK_RETRY_ATTEMPTS=1)
+    def test_failing_keystone_authentication_opens_the_circuit(self):
+        operations = []
+        hook = lambda service, operation, elapsed, error: operations.append(operation)
+        metrics.add_hook(hook)
+        self.addCleanup(metrics.remove_hook, hook)
+        openstack.token_cache.invalidate(openstack.token_cache.get())
+        endpoint = openstack.get_keystone_endpoint()
+        del operations[:]
+
+        self.keystone.error_rate = 1.0
+        for failures in [1, 2]:
+            self.assertRaises(Exception, openstack.token_cache.get)
+            # One failure, and one observed call, per authentication
+            self.assertEquals(failures, endpoint.breaker.failures)
+            self.assertEquals(['authenticate'] * failures, operations)
+
+        requests = self.keystone.requests
+        self.assertRaises(resilience.CircuitOpenError, openstack.token_cache.get)
+        self.assertEquals(requests, self.keystone.requests)
+
+        # The probe gets the token
+        self.keystone.error_rate = 0
+        endpoint.breaker.opened_at -= settings.OPENSTACK_CIRCUIT_RESET
+        self.assertTrue(openstack.token_cache.get())
+        self.assertEquals(resilience.CLOSED, endpoint.breaker.state)
+
+    def test_token_renewal_leaves_the_shared_client_alone(self):
+        keystone = openstack.get_keystone_client()
+        auth_ref = keystone.auth_ref
+        token = openstack.token_cache.get()
+        openstack.token_cache.invalidate(token)
+
+        self.assertNotEquals(token, openstack.token_cache.get())
+        self.assertIs(auth_ref, keystone.auth_ref)
+        self.assertIs(keystone, openstack.get_keystone_client())
+
+
+class QuotaTest(FakeOpenStackTestCase):
+
+    def setUp(self):
+        super(QuotaTest, self).setUp()
+        for name in ["AAA", "BBB", "CCC"]:
+            StacksyncUser(name=name, email=name + "@testuser.com", quota_limit=100).save()
+        self.account = '/v1/AUTH_bench_tenant/'
+
+    def get_container_quotas(self):
+        return dict((workspace.owner.name, self.swift.containers.get(self.account + workspace.swift_container, {})
+                     .get('x-container-meta-quota-bytes'))
+                    for workspace in StacksyncWorkspace.objects.select_related('owner'))
+
+    def test_quota_reaches_every_container(self):
+        progress = []
+        report = set_quota_limit(StacksyncUser.objects.exclude(name="CCC"), 500, chunk_size=1,
+                                 progress=lambda report: progress.append(report.done))
+
+        self.assertEquals((2, 2, 2, 0), (report.users, report.containers, report.updated, report.queued))
+        self.assertEquals([1, 2], progress)
+        self.assertEquals({'AAA': 500, 'BBB': 500, 'CCC': 100},
+                          dict(StacksyncUser.objects.values_list('name', 'quota_limit')))
+        self.assertEquals({'AAA': '500', 'BBB': '500', 'CCC': '100'}, self.get_container_quotas())
+
+    def test_quota_of_several_gigabytes(self):
+        quota_limit = 5 * 2 ** 30
+        report = set_quota_limit(StacksyncUser.objects.filter(name="AAA"), quota_limit)
+
+        self.assertEquals(1, report.updated)
+        self.assertEquals(quota_limit, StacksyncUser.objects.get(name="AAA").quota_limit)
+        self.assertEquals(str(quota_limit), self.get_container_quotas()['AAA'])
+
+    def test_failing_containers_are_retried_then_queued(self):
+        workspace = StacksyncWorkspace.objects.get(owner__name="AAA")
+        set_container_quota = SwiftClient.set_container_quota
+
+        def unavailable(swift_client, swift_url, swift_container, quota_limit):
+            if swift_container == workspace.swift_container:
+                raise swift.ClientException('down', http_status=503)
+            return set_container_quota(swift_client, swift_url, swift_container, quota_limit)
+
+        with patch.object(SwiftClient, 'set_container_quota', unavailable):
+            report = set_quota_limit(StacksyncUser.objects.all(), 500, attempts=2, retry_backoff=0)
+
+        self.assertEquals((3, 2, 1, 1), (report.containers, report.updated, report.retried, report.queued))
+        job = ProvisioningJob.objects.get()
+        self.assertEquals((ProvisioningJob.SET_QUOTA, workspace.swift_container, 500),
+                          (job.action, job.swift_container, job.quota_limit))
+
+    def test_rejected_containers_are_not_retried(self):
+        workspace = StacksyncWorkspace.objects.get(owner__name="AAA")
+        del self.swift.containers[self.account + workspace.swift_container]
+
+        report = set_quota_limit(StacksyncUser.objects.all(), 500, attempts=2, retry_backoff=0)
+
+        self.assertEquals((3, 2, 0, 0, 1), (report.containers, report.updated, report.retried, report.queued,
+                                            report.rejected))
+        self.assertEquals(3, report.done)
+        self.assertFalse(ProvisioningJob.objects.exists())
+        self.assertRaises(ValueError, set_quota_limit, StacksyncUser.objects.all(), 500, attempts=0)
+
+    def test_admin_action(self):
+        User.objects.create_superuser('admin', 'admin@stacksync.org', 'admin')
+        self.client.login(username='admin', password='admin')
+        data = {'action': 'set_quota', '_selected_action': [str(user.pk) for user in StacksyncUser.objects.all()]}
+
+        response = self.client.post('/admin/users/stacksyncuser/', data)
+        self.assertContains(response, 'name="quota_limit"')
+
+        data.update(apply='yes', quota_limit='700')
+        response = self.client.post('/admin/users/stacksyncuser/', data)
+        self.assertEquals(302, response.status_code)
+        self.assertEquals({'AAA': '700', 'BBB': '700', 'CCC': '700'}, self.get_container_quotas())
+
+
+class WorkspacesApiTest(TestCase):
+
+    def setUp(self):
+        StacksyncUser.objects.bulk_create([
+            StacksyncUser(name=name, email=name + "@testuser.com", swift_user="stacksync_" + name,
+                          swift_account="AUTH_id")
+            for name in ["AAA", "BBB"]])
+        self.user, self.other = StacksyncUser.objects.order_by('name')
+        for _ in range(5):
+            StacksyncWorkspace.objects.create_workspace(self.user)
+        StacksyncWorkspace.objects.create_workspace(self.other)
+        consumer = Consumer.objects.create(consumer_key='key', consumer_secret='consumer secret', user=self.user)
+        AccessToken.objects.create(consumer=consumer, user=self.user, access_token='token',
+                                   access_token_secret='token secret')
+        self.nonces = iter(range(1000))
+
+    def get_authorization(self, query=None, nonce=None, method='HMAC-SHA1'):
+        parameters = {'oauth_consumer_key': 'key', 'oauth_token': 'token', 'oauth_signature_method': method,
+                      'oauth_timestamp': str(int(time.time())),
+                      'oauth_nonce': nonce or 'nonce%d' % next(self.nonces), 'oauth_version': '1.0'}
+        key = 'consumer%20secret&token%20secret'
+        if method == 'PLAINTEXT':
+            parameters['oauth_signature'] = key
+        else:
+            normalized = '&'.join('%s=%s' % (urllib.quote(name, safe='~'), urllib.quote(value, safe='~'))
+                                  for name, value in sorted(parameters.items() + (query or {}).items()))
+            base_string = '&'.join(['GET', urllib.quote('http://testserver/api/workspaces', safe='~'),
+                                    urllib.quote(normalized, safe='~')])
+            parameters['oauth_signature'] = base64.b64encode(hmac.new(key, base_string, hashlib.sha1).digest())
+        return 'OAuth ' + ', '.join('%s="%s"' % (name, urllib.quote(value, safe='~'))
+                                    for name, value in sorted(parameters.items()))
+
+    def get(self, query=None, **extra):
+        query = dict((name, str(value)) for name, value in (query or {}).items())
+        return self.client.get('/api/workspaces', query, HTTP_AUTHORIZATION=self.get_authorization(query), **extra)
+
+    def count_listing_queries(self, queries):
+        return len([query for query in queries.captured_queries if settings.MEMBERSHIP_TABLE in query['sql']])
+
+    def test_unsigned_request_is_rejected(self):
+        response = self.client.get('/api/workspaces')
+        self.assertEquals(401, response.status_code)
+        self.assertEquals('OAuth realm="stacksync"', response['WWW-Authenticate'])
+
+    def test_bad_signature_and_replayed_nonce_are_rejected(self):
+        authorization = self.get_authorization(nonce='once')
+        self.assertEquals(200, self.client.get('/api/workspaces', HTTP_AUTHORIZATION=authorization).status_code)
+        self.assertEquals(401, self.client.get('/api/workspaces', HTTP_AUTHORIZATION=authorization).status_code)
+
+        authorization = self.get_authorization({'limit': '1'})
+        self.assertEquals(401, self.client.get('/api/workspaces', {'limit': '2'},
+                                               HTTP_AUTHORIZATION=authorization).status_code)
+
+    def test_revoked_token_is_rejected(self):
+        self.assertEquals(200, self.get().status_code)
+        AccessToken.objects.all().delete()
+        self.assertEquals(401, self.get().status_code)
+
+    def test_plaintext_signature(self):
+        response = self.client.get('/api/workspaces', HTTP_AUTHORIZATION=self.get_authorization(method='PLAINTEXT'))
+        self.assertEquals(200, response.status_code)
+
+    def test_pages_follow_the_cursor(self):
+        workspaces = []
+        query = {'limit': 2}
+        for expected in [2, 2, 1]:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.get(query)
+            # The page, with the workspaces joined, read once for the etag and the body
+            self.assertEquals(1, self.count_listing_queries(queries))
+            body = json.loads(response.content)
+            self.assertEquals(expected, len(body['workspaces']))
+            workspaces += [workspace['id'] for workspace in body['workspaces']]
+            query['cursor'] = body['next']
+        self.assertIsNone(body['next'])
+
+        expected = [str(membership.workspace_id) for membership in
+                    StacksyncMembership.objects.filter(user=self.user).order_by('created_at', 'id')]
+        self.assertEquals(expected, workspaces)
+
+    def test_bad_cursor(self):
+        self.assertEquals(400, self.get({'cursor': 'garbage'}).status_code)
+
+    def test_unchanged_listing_is_not_sent_again(self):
+        etag = self.get()['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(304, response.status_code)
+        self.assertEquals(1, self.count_listing_queries(queries))
+        self.assertEquals('', response.content)
+
+        workspace = StacksyncWorkspace.objects.filter(owner=self.user)[0]
+        workspace.latest_revision += 1
+        workspace.save()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(200, response.status_code)
+        self.assertNotEquals(etag, response['ETag'])
+
+    def test_renamed_or_shared_workspace_changes_the_etag(self):
+        etag = self.get()['ETag']
+        StacksyncMembership.objects.filter(user=self.user).update(name='renamed')
+        renamed = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(200, renamed.status_code)
+
+        StacksyncWorkspace.objects.filter(owner=self.user).update(is_shared=True)
+        shared = self.get(HTTP_IF_NONE_MATCH=renamed['ETag'])
+        self.assertEquals(200, shared.status_code)
+        self.assertNotEquals(renamed['ETag'], shared['ETag'])
+
+
+@override_settings(RECONCILE_KEYSTONE_GRACE=0)
+class ReconciliationTest(FakeOpenStackTestCase):
+
+    def setUp(self):
+        super(ReconciliationTest, self).setUp()
+        for name in ["AAA", "BBB", "CCC"]:
+            StacksyncUser(name=name, email=name + "@testuser.com").save()
+        self.account = '/v1/AUTH_bench_tenant/'
+        workspaces = list(StacksyncWorkspace.objects.order_by('owner__name'))
+
+        # A workspace lost its container, a user row went without its keystone
+        # user and container, and a container was left over by hand
+        del self.swift.containers[self.account + workspaces[0].swift_container]
+        self.gone = StacksyncUser.objects.get(name="BBB")
+        StacksyncUser.objects.filter(pk=self.gone.pk).delete()
+        for name in ['stacksync_left_over', 'not_ours']:
+            self.swift.containers[self.account + name] = {'x-container-object-count': '0',
+                                                          'x-container-bytes-used': '0'}
+
+    def test_dry_run_reports_without_repairing(self):
+        containers = dict(self.swift.containers)
+
+        report = reconcile(page_size=1, chunk_size=2)
+
+        self.assertEquals({'missing_container': 1, 'orphan_container': 2, 'orphan_keystone_user': 1}, report.counts)
+        self.assertEquals([self.gone.swift_user], [finding.swift_user for finding in
+                                                   report.examples['orphan_keystone_user']])
+        self.assertEquals(containers, self.swift.containers)
+        self.assertEquals(3, len(self.keystone.users))
+
+    def test_repair(self):
+        report = reconcile(repair=True, page_size=2, concurrency=4)
+
+        self.assertEquals(4, report.repaired)
+        self.assertEquals(2, len(self.keystone.users))
+        self.assertNotIn(self.gone.keystone_id, self.keystone.users)
+        self.assertEquals(sorted([self.account + workspace.swift_container
+                                  for workspace in StacksyncWorkspace.objects.all()] + [self.account + 'not_ours']),
+                          sorted(self.swift.containers))
+        self.assertEquals({'missing_container': 0, 'orphan_container': 0, 'orphan_keystone_user': 0},
+                          reconcile().counts)
+
+    def test_urls_are_compared_normalized(self):
+        StacksyncWorkspace.objects.update(swift_url=self.swift.url.upper().replace('/V1', '/v1') +
+                                          '/AUTH_bench_tenant/')
+
+        report = reconcile(repair=True)
+
+        self.assertEquals({'missing_container': 1, 'orphan_container': 2, 'orphan_keystone_user': 1}, report.counts)
+        self.assertEquals(0, report.failed)
+
+    def test_containers_of_an_account_without_workspaces_are_kept(self):
+        other = FakeSwift(tokens=()).start()
+        self.addCleanup(other.stop)
+        other.tokens = self.swift.tokens
+        other.containers[self.account + 'stacksync_elsewhere'] = {'x-container-object-count': '0',
+                                                                  'x-container-bytes-used': '0'}
+
+        with self.settings(SWIFT_ENDPOINTS=[{'URL': self.swift.url}, {'URL': other.url}]):
+            report = reconcile(repair=True)
+
+        self.assertEquals(3, report.counts['orphan_container'])
+        self.assertEquals(1, report.failed)
+        self.assertEquals('stacksync_elsewhere', report.failures[0][0].swift_container)
+        self.assertIn(self.account + 'stacksync_elsewhere', other.containers)
+
+    def test_keystone_users_given_their_row_in_the_grace_period_are_kept(self):
+        def store_row(seconds):
+            self.assertGreater(seconds, 0)
+            StacksyncUser.objects.bulk_create([StacksyncUser(name='BBB', email='b@testuser.com',
+                                                             swift_user=self.gone.swift_user, swift_account='AUTH_id')])
+
+        clock = MagicMock(wraps=time)
+        clock.sleep.side_effect = store_row
+        with patch.object(reconciliation, 'time', clock):
+            report = reconcile(repair=True, grace=60)
+
+        self.assertEquals(1, clock.sleep.call_count)
+        self.assertEquals(0, report.counts['orphan_keystone_user'])
+        self.assertEquals(3, len(self.keystone.users))
+
+    def test_containers_queued_for_the_worker_are_not_missing(self):
+        workspace = StacksyncWorkspace.objects.order_by('owner__name')[0]
+        ProvisioningJob.objects.enqueue(ProvisioningJob.CREATE_CONTAINER, workspace.swift_url,
+                                        workspace.swift_container, keystone_username=workspace.owner.swift_user)
+
+        report = reconcile(repair=True)
+
+        self.assertEquals(0, report.counts['missing_container'])
+        self.assertNotIn(self.account + workspace.swift_container, self.swift.containers)
+
+    def test_keystone_users_are_listed_once(self):
+        users = sorted(self.keystone.users)
+        # The fake, like keystone, ignores limit and marker
+        self.assertEquals([users], [sorted(user.id for user in page) for page in iterate_keystone_users(2)])
+        self.assertEquals([users], [sorted(user.id for user in page) for page in iterate_keystone_users(3)])
+
+        def list_page(tenant_id, limit, marker):
+            return [MagicMock(id=user_id) for user_id in users if marker is None or user_id > marker][:limit]
+        with patch.object(openstack.get_keystone_client().users, 'list', side_effect=list_page):
+            self.assertEquals([users[:2], users[2:]], [[user.id for user in page]
+                                                       for page in iterate_keystone_users(2)])
+
+    def test_merge_join(self):
+        pairs = list(merge_join([1, 3, 4], [2, 3, 5], str, str))
+        self.assertEquals([(1, None), (None, 2), (3, 3), (4, None), (None, 5)], pairs)
+        self.assertRaises(ReconciliationError, list, merge_join([2, 1], [], str, str))
+
+
+class SearchIndexesTest(TestCase):
+
+    def test_trigram_indexes_are_skipped_without_pg_trgm(self):
+        database = MagicMock(vendor='postgresql', alias='default')
+        cursor = database.cursor.return_value
+        cursor.fetchone.return_value = None
+        cursor.execute.side_effect = lambda sql, params=None: self.refuse(sql, 'CREATE EXTENSION')
+        database.introspection.table_names.return_value = [table for table, column, kind
+                                                           in indexes.get_search_indexes()]
+        database.ops.quote_name = lambda name: '"%s"' % name
+
+        with patch.object(indexes, 'connections', {'default': database}):
+            created = indexes.create_search_indexes()
+
+        self.assertEquals(4, len(created))
+        self.assertFalse([name for name in created if name.endswith('_trgm')])
+
+    def refuse(self, sql, statement):
+        if sql.startswith(statement):
+            raise DatabaseError('permission denied to create extension "pg_trgm"')
+
+
+class ReplicaRouterTest(TestCase):
+
+    def setUp(self):
+        self.router = replicas.ReplicaRouter()
+        replicas.reset()
+        self.addCleanup(replicas.reset)
+        replicas.lag_monitor.clear()
+        self.addCleanup(replicas.lag_monitor.clear)
+        overrides = override_settings(DATABASE_REPLICAS=['replica'])
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    @patch.object(replicas.ReplicaLagMonitor, 'get_lag', return_value=0.5)
+    def test_reads_go_to_the_replica_until_a_write(self, get_lag):
+        self.assertEquals('default', self.router.db_for_read(StacksyncUser))
+        with replicas.replica_reads():
+            self.assertEquals('replica', self.router.db_for_read(StacksyncUser))
+            self.assertEquals('default', self.router.db_for_write(StacksyncUser))
+            self.assertEquals('default', self.router.db_for_read(StacksyncUser))
+        self.assertTrue(replicas.wrote())
+        self.assertEquals(1, get_lag.call_count)
+
+    @patch.object(replicas.ReplicaLagMonitor, 'get_lag', return_value=30.0)
+    def test_lagging_replica_is_not_read_from(self, get_lag):
+        with replicas.replica_reads():
+            self.assertEquals('default', self.router.db_for_read(StacksyncUser))
+        self.assertEquals('default', replicas.get_read_database())
+        # Checked again only after REPLICA_LAG_CHECK_INTERVAL
+        self.assertEquals(1, get_lag.call_count)
+
+    @patch.object(replicas, 'get_replica', return_value='default')
+    def test_admin_changelist_reads_the_replica_and_pins_after_a_write(self, get_replica):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        replicas.reset()
+
+        response = self.client.get('/admin/users/stacksyncworkspace/')
+        self.assertEquals(200, response.status_code)
+        self.assertTrue(get_replica.called)
+        self.assertNotIn(ReplicaPinningMiddleware.cookie_name, response.cookies)
+
+        self.client.post('/admin/password_change/', {'old_password': 'admin', 'new_password1': 'admin',
+                                                     'new_password2': 'admin'})
+        self.assertIn(ReplicaPinningMiddleware.cookie_name, self.client.cookies)
+
+        get_replica.reset_mock()
+        self.client.get('/admin/users/stacksyncworkspace/')
+        self.assertFalse(get_replica.called)
+
+    def test_broken_persistent_connections_are_closed(self):
+        connection = MagicMock(health_checked_at=0)
+        connection.is_usable.return_value = False
+        with patch.object(replicas.connections, 'all', return_value=[connection]):
+            replicas.check_connections()
+            replicas.check_connections()
+        self.assertEquals(1, connection.close.call_count)
+
+
 class FunctionalStacksyncUserTests(TestCase):
     """
     This class connects to all the databases, and openstack services.
@@ -57,9 +1345,11 @@ class FunctionalStacksyncUserTests(TestCase):
     def setUp(self):
         self.testuser = StacksyncUser(name=self.user_name, email="testuser@testuser.com")
         self.testuser.save()
+        process_jobs()
 
     def tearDown(self):
         self.testuser.delete()
+        process_jobs()
 
     def test_add_two_stacksync_users(self):
         testuser1 = StacksyncUser(name=self.user_name, email="testuser@testuser.com")
@@ -0,0 +1,153 @@
+"""Streams users, workspaces, memberships and OAuth tables in and out of the database as JSON lines."""
+import datetime
+import itertools
+import json
+import uuid
+from decimal import Decimal
+from operator import itemgetter
+
+from django.core.management.color import no_style
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import get_model
+
+from oauth.models import Consumer, RequestToken, AccessToken
+from users.concurrency import Report, chunked
+from users.models import StacksyncUser, StacksyncWorkspace, StacksyncMembership
+
+# In an order where every row only refers to rows exported before it
+MODELS = (StacksyncUser, StacksyncWorkspace, StacksyncMembership, Consumer, RequestToken, AccessToken)
+
+
+class TransferReport(Report):
+
+    def __init__(self):
+        super(TransferReport, self).__init__()
+        self.rows = dict((get_label(model), 0) for model in MODELS)
+        self.skipped = 0
+
+    @property
+    def total(self):
+        return sum(self.rows.values())
+
+    @property
+    def throughput(self):
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+
+def get_label(model):
+    return '%s.%s' % (model._meta.app_label, model._meta.model_name)
+
+
+def get_models(labels=None):
+    """The models to transfer, all of them by default, always in the order of MODELS"""
+    if not labels:
+        return MODELS
+    models = [get_model(*label.split('.')) for label in labels]
+    if None in models or any(model not in MODELS for model in models):
+        raise ValueError('Only %s can be transferred' % ', '.join(get_label(model) for model in MODELS))
+    return [model for model in MODELS if model in models]
+
+
+def encode(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (uuid.UUID, Decimal)):
+        return str(value)
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def iterate_rows(rows, chunk_size=2000):
+    """Yields the rows of a values_list queryset, holding at most chunk_size of them"""
+    connection = connections[rows.db]
+    if connection.vendor != 'postgresql':
+        for row in rows.iterator():
+            yield row
+        return
+
+    # psycopg2 reads the whole result of a plain cursor into memory, a named
+    # one keeps it on the server and fetches itersize rows at a time
+    sql, params = rows.query.get_compiler(rows.db).as_sql()
+    with transaction.atomic(using=rows.db):
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(name='rows_%s' % uuid.uuid4().hex)
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute(sql, params)
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+
+
+def export_rows(output, models=MODELS, chunk_size=2000, using=DEFAULT_DB_ALIAS):
+    """
+    Writes every row of models to output, as a JSON object per line.
+    :return TransferReport:
+    """
+    report = TransferReport()
+    for model in models:
+        label = get_label(model)
+        fields = [field.attname for field in model._meta.concrete_fields]
+        rows = model._default_manager.using(using).order_by().values_list(*fields)
+        for row in iterate_rows(rows, chunk_size):
+            output.write(json.dumps({'model': label, 'fields': dict(zip(fields, row))}, default=encode))
+            output.write('\n')
+            report.rows[label] += 1
+    report.finish()
+    return report
+
+
+def insert_rows(model, instances, using=DEFAULT_DB_ALIAS):
+    """
+    Inserts the instances with a single INSERT statement run for all of them.
+    Unlike bulk_create, which calls pre_save, it stores the created_at and
+    modified_at read from the export instead of the current time.
+    """
+    if not instances:
+        return
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    fields = model._meta.concrete_fields
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (quote(model._meta.db_table),
+                                               ', '.join(quote(field.column) for field in fields),
+                                               ', '.join(['%s'] * len(fields)))
+    connection.cursor().executemany(sql, [[field.get_db_prep_save(getattr(instance, field.attname), connection)
+                                           for field in fields] for instance in instances])
+
+
+def import_rows(lines, chunk_size=2000, using=DEFAULT_DB_ALIAS):
+    """
+    Inserts the rows of an export, chunk by chunk. Rows whose primary key is
+    already in the database are skipped, so an interrupted import can be run
+    again from the start.
+    :return TransferReport:
+    """
+    report = TransferReport()
+    records = (json.loads(line) for line in lines if line.strip())
+    imported = set()
+    for label, group in itertools.groupby(records, key=itemgetter('model')):
+        model = get_models([label])[0]
+        manager = model._default_manager.db_manager(using)
+        for chunk in chunked(group, chunk_size):
+            # Building instances runs no keystone code, see StacksyncUser.__init__
+            instances = [model(**dict((str(name), value) for name, value in record['fields'].items()))
+                         for record in chunk]
+            with transaction.atomic(using=using):
+                existing = set(str(pk) for pk in manager.filter(pk__in=[instance.pk for instance in instances])
+                               .values_list('pk', flat=True))
+                instances = [instance for instance in instances if str(instance.pk) not in existing]
+                insert_rows(model, instances, using)
+            report.rows[label] += len(instances)
+            report.skipped += len(chunk) - len(instances)
+        imported.add(model)
+
+    # Rows came with their ids, move the sequences of the serial ones past them
+    connection = connections[using]
+    statements = connection.ops.sequence_reset_sql(no_style(), [model for model in MODELS if model in imported])
+    if statements:
+        with transaction.atomic(using=using):
+            cursor = connection.cursor()
+            for sql in statements:
+                cursor.execute(sql)
+    report.finish()
+    return report
@@ -0,0 +1,64 @@
+"""Collects the storage used by every workspace from swift into the database."""
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from users.concurrency import Report, chunked
+from users.models import StacksyncWorkspace, WorkspaceUsage
+from users.swift_batch import batch_client
+
+
+class UsageReport(Report):
+
+    def __init__(self):
+        super(UsageReport, self).__init__()
+        self.workspaces = 0
+        self.owners = 0
+
+
+def get_stale_workspaces(stale_after):
+    """Workspaces whose usage was never collected or is older than stale_after seconds"""
+    threshold = timezone.now() - timezone.timedelta(seconds=stale_after)
+    return StacksyncWorkspace.objects.filter(Q(usage__isnull=True) | Q(usage__updated_at__lt=threshold))
+
+
+def collect_usage(workspaces=None, stale_after=None, concurrency=None, chunk_size=500):
+    """
+    Reads the usage of the containers of the given workspaces, all of them by
+    default or only the stale ones if stale_after is given, and stores it.
+    Containers are read on the shared batch pool, or on one of concurrency threads.
+    :return UsageReport:
+    """
+    if workspaces is None:
+        workspaces = StacksyncWorkspace.objects.all()
+    if stale_after is not None:
+        workspaces = workspaces & get_stale_workspaces(stale_after)
+
+    report = UsageReport()
+    owners = set()
+    rows = workspaces.values_list('id', 'owner_id', 'swift_url', 'swift_container').iterator()
+    with batch_client(concurrency) as client:
+        for chunk in chunked(rows, chunk_size):
+            results = client.get_containers_metadata([row[2:] for row in chunk], use_cache=False)
+            now = timezone.now()
+            usages = []
+            for (workspace_id, owner_id, swift_url, swift_container), result in zip(chunk, results):
+                if not result.ok:
+                    report.fail(swift_container, result.error)
+                    continue
+                usages.append(WorkspaceUsage(workspace_id=workspace_id,
+                                             bytes_used=int(result.value.get('x-container-bytes-used', 0)),
+                                             object_count=int(result.value.get('x-container-object-count', 0)),
+                                             updated_at=now))
+                owners.add(owner_id)
+
+            with transaction.atomic():
+                WorkspaceUsage.objects.filter(workspace__in=[usage.workspace_id for usage in usages]).delete()
+                WorkspaceUsage.objects.bulk_create(usages)
+            report.workspaces += len(usages)
+
+    for chunk in chunked(owners, chunk_size):
+        WorkspaceUsage.objects.update_owners_quota_used(chunk)
+    report.owners = len(owners)
+    report.finish()
+    return report
@@ -0,0 +1,119 @@
+import base64
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, Http404
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import condition, require_GET
+
+from oauth.authentication import oauth_required
+from users import metrics
+from users.replicas import use_replicas
+from users.models import StacksyncMembership
+
+WORKSPACES_PAGE_SIZE = 100
+WORKSPACES_MAX_PAGE_SIZE = 1000
+
+
+def openstack_metrics(request):
+    """OpenStack call metrics of this process, in the prometheus text format"""
+    if not getattr(settings, 'OPENSTACK_METRICS', False):
+        raise Http404
+    if settings.INTERNAL_IPS and request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def encode_cursor(membership):
+    return base64.urlsafe_b64encode('%s|%s' % (membership.created_at.isoformat(), membership.id))
+
+
+def decode_cursor(cursor):
+    """(created_at, id) of the last membership of the previous page"""
+    try:
+        created_at, membership_id = base64.urlsafe_b64decode(cursor.encode('ascii')).split('|')
+        created_at = parse_datetime(created_at)
+        membership_id = uuid.UUID(membership_id)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if created_at is None:
+        raise ValueError('Invalid cursor')
+    return created_at, membership_id
+
+
+def get_page_size(request):
+    try:
+        return max(1, min(int(request.GET.get('limit', WORKSPACES_PAGE_SIZE)), WORKSPACES_MAX_PAGE_SIZE))
+    except ValueError:
+        return WORKSPACES_PAGE_SIZE
+
+
+def get_workspaces_page(request):
+    """
+    The body of the page of workspaces asked for, read once per request
+    :raises ValueError: if the cursor is invalid
+    """
+    if not hasattr(request, 'workspaces_page'):
+        memberships = (StacksyncMembership.objects.filter(user=request.stacksync_user)
+                       .select_related('workspace').order_by('created_at', 'id'))
+        if request.GET.get('cursor'):
+            created_at, membership_id = decode_cursor(request.GET['cursor'])
+            memberships = memberships.filter(Q(created_at__gt=created_at) |
+                                             Q(created_at=created_at, id__gt=membership_id))
+
+        page_size = get_page_size(request)
+        page = list(memberships[:page_size + 1])
+        request.workspaces_page = {
+            'workspaces': [serialize_membership(membership) for membership in page[:page_size]],
+            'next': encode_cursor(page[page_size - 1]) if len(page) > page_size else None}
+    return request.workspaces_page
+
+
+def get_workspaces_etag(request):
+    """
+    A hash of the page as it would be sent, so any change to what it lists
+    changes it. The page is kept for the view, which doesn't read it again.
+    """
+    try:
+        body = get_workspaces_page(request)
+    except ValueError:
+        return None
+    return hashlib.md5(json.dumps(body, sort_keys=True)).hexdigest()
+
+
+def serialize_membership(membership):
+    workspace = membership.workspace
+    return {
+        'id': str(workspace.id),
+        'name': membership.name,
+        'owner': str(workspace.owner_id),
+        'is_shared': workspace.is_shared,
+        'is_encrypted': workspace.is_encrypted,
+        'latest_revision': workspace.latest_revision,
+        'swift_container': workspace.swift_container,
+        'swift_url': workspace.swift_url,
+        'parent_item_id': membership.parent_item_id,
+        'created_at': workspace.created_at.isoformat(),
+        'member_since': membership.created_at.isoformat(),
+    }
+
+
+@require_GET
+@oauth_required
+@use_replicas
+@condition(etag_func=get_workspaces_etag)
+def workspaces(request):
+    """
+    Workspaces of the user signing the request, oldest membership first, a page
+    at a time: the next page is asked for with the cursor returned as next.
+    Clients sending back the ETag they got in If-None-Match get a 304 while
+    nothing changed.
+    """
+    try:
+        body = get_workspaces_page(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(unicode(e))
+    return HttpResponse(json.dumps(body), content_type='application/json')